@@ -1,118 +1,214 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+import time
 from typing import List, Dict, Optional
 from datetime import datetime
 
+# How often a read may stat() accounts.json to notice changes made outside
+# this process (restore from Supabase, manual edits). Writes made through any
+# AccountStorage in this process update the shared cache immediately.
+MTIME_CHECK_INTERVAL_SECONDS = 1.0
+
+
+class _AccountIndex:
+    """Разобранный accounts.json с индексами по id и телефону.
+
+    Один экземпляр на файл на весь процесс — роутеры и сервисы создают
+    свои AccountStorage, но видят одни и те же данные.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data: Optional[dict] = None
+        self.mtime_ns: Optional[int] = None
+        self.checked_at = 0.0
+        self.by_id: Dict[int, dict] = {}
+        self.by_phone: Dict[str, dict] = {}
+        self.connected: List[dict] = []
+
+    def rebuild(self, data: dict, mtime_ns: Optional[int]):
+        data.setdefault("accounts", [])
+        data.setdefault("selected_chats", {})
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.monotonic()
+        self.by_id = {acc.get("id"): acc for acc in data["accounts"]}
+        self.by_phone = {acc.get("phone_number"): acc for acc in data["accounts"]}
+        self.connected = [acc for acc in data["accounts"] if acc.get("is_connected", False)]
+
+
+_indexes: Dict[str, _AccountIndex] = {}
+_indexes_lock = threading.Lock()
+
+
 class AccountStorage:
     def __init__(self):
         self.storage_file = "accounts.json"
+        with _indexes_lock:
+            self._index = _indexes.setdefault(os.path.abspath(self.storage_file), _AccountIndex())
         self._ensure_file_exists()
-    
+
     def _ensure_file_exists(self):
         """Создает файл хранилища если его нет"""
         if not os.path.exists(self.storage_file):
-            with open(self.storage_file, "w", encoding="utf-8") as f:
-                json.dump({"accounts": [], "selected_chats": {}}, f, ensure_ascii=False, indent=2)
-    
-    def _read_data(self) -> dict:
+            self._write_data({"accounts": [], "selected_chats": {}}, backup=False)
+
+    def _file_mtime_ns(self) -> Optional[int]:
+        try:
+            return os.stat(self.storage_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_file(self) -> dict:
         """Читает данные из файла"""
         try:
             with open(self.storage_file, "r", encoding="utf-8") as f:
                 return json.load(f)
         except:
             return {"accounts": [], "selected_chats": {}}
-    
-    def _write_data(self, data: dict):
-        """Записывает данные в файл"""
-        with open(self.storage_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def _read_data(self) -> dict:
+        """Возвращает разобранные данные из памяти; файл перечитывается
+        только если изменился его mtime (проверка не чаще раза в секунду)."""
+        index = self._index
+        with index.lock:
+            now = time.monotonic()
+            if index.data is not None and now - index.checked_at < MTIME_CHECK_INTERVAL_SECONDS:
+                return index.data
+            mtime_ns = self._file_mtime_ns()
+            if index.data is None or mtime_ns != index.mtime_ns:
+                index.rebuild(self._read_file(), mtime_ns)
+            else:
+                index.checked_at = now
+            return index.data
+
+    def _write_data(self, data: dict, backup: bool = True):
+        """Атомарно записывает данные (temp-файл + rename) и обновляет индекс"""
+        directory = os.path.dirname(os.path.abspath(self.storage_file))
+        with self._index.lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=".accounts.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.storage_file)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            self._index.rebuild(data, self._file_mtime_ns())
+        if not backup:
+            return
         # Mirror to Supabase so the account list + selected chats survive
         # container rebuilds (Timeweb Apps have no persistent disk).
+        # Debounced: a burst of writes produces a single upload.
         # Best-effort: never let a persistence hiccup break account storage.
         try:
             from backend.database import state_persistence
-            state_persistence.backup_accounts()
+            state_persistence.schedule_accounts_backup()
         except Exception:
             pass
-    
+
+    def _mutable_data(self) -> dict:
+        """Копия данных для изменения: кэш меняется только через _write_data."""
+        return copy.deepcopy(self._read_data())
+
     def add_account(self, account_data: dict) -> int:
         """Добавляет аккаунт и возвращает его ID"""
-        data = self._read_data()
-        
-        # Проверяем, нет ли уже такого аккаунта
-        for acc in data["accounts"]:
-            if acc["phone_number"] == account_data["phone_number"]:
+        with self._index.lock:
+            data = self._mutable_data()
+
+            # Проверяем, нет ли уже такого аккаунта
+            if account_data["phone_number"] in self._index.by_phone:
                 raise ValueError("Account with this phone number already exists")
-        
-        new_id = max([acc.get("id", 0) for acc in data["accounts"]], default=0) + 1
-        
-        account = {
-            "id": new_id,
-            "api_id": account_data["api_id"],
-            "api_hash": account_data["api_hash"],
-            "phone_number": account_data["phone_number"],
-            "name": account_data.get("name"),
-            "is_connected": False,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        data["accounts"].append(account)
-        self._write_data(data)
-        return new_id
-    
+
+            new_id = max([acc.get("id", 0) for acc in data["accounts"]], default=0) + 1
+
+            account = {
+                "id": new_id,
+                "api_id": account_data["api_id"],
+                "api_hash": account_data["api_hash"],
+                "phone_number": account_data["phone_number"],
+                "name": account_data.get("name"),
+                "is_connected": False,
+                "created_at": datetime.utcnow().isoformat()
+            }
+
+            data["accounts"].append(account)
+            self._write_data(data)
+            return new_id
+
     def get_account(self, account_id: int) -> Optional[dict]:
         """Получает аккаунт по ID"""
-        data = self._read_data()
-        for acc in data["accounts"]:
-            if acc["id"] == account_id:
-                return acc
-        return None
-    
+        with self._index.lock:
+            self._read_data()
+            acc = self._index.by_id.get(account_id)
+            return dict(acc) if acc else None
+
+    def get_account_by_phone(self, phone_number: str) -> Optional[dict]:
+        """Получает аккаунт по номеру телефона"""
+        with self._index.lock:
+            self._read_data()
+            acc = self._index.by_phone.get(phone_number)
+            return dict(acc) if acc else None
+
     def get_all_accounts(self) -> List[dict]:
         """Получает все аккаунты"""
-        data = self._read_data()
-        return data["accounts"]
-    
+        with self._index.lock:
+            return [dict(acc) for acc in self._read_data()["accounts"]]
+
     def get_all_connected_accounts(self) -> List[dict]:
         """Получает все подключенные аккаунты"""
-        data = self._read_data()
-        return [acc for acc in data["accounts"] if acc.get("is_connected", False)]
-    
+        with self._index.lock:
+            self._read_data()
+            return [dict(acc) for acc in self._index.connected]
+
     def update_account_connection(self, account_id: int, is_connected: bool):
         """Обновляет статус подключения аккаунта"""
-        data = self._read_data()
-        for acc in data["accounts"]:
-            if acc["id"] == account_id:
-                acc["is_connected"] = is_connected
-                self._write_data(data)
-                return
-        raise ValueError("Account not found")
-    
+        with self._index.lock:
+            data = self._mutable_data()
+            for acc in data["accounts"]:
+                if acc["id"] == account_id:
+                    if acc.get("is_connected") == is_connected:
+                        return  # ничего не изменилось — не пишем файл и не бэкапим
+                    acc["is_connected"] = is_connected
+                    self._write_data(data)
+                    return
+            raise ValueError("Account not found")
+
     def set_selected_chats(self, account_id: int, chat_ids: List[int]):
         """Устанавливает выбранные чаты для аккаунта"""
-        data = self._read_data()
-        if "selected_chats" not in data:
-            data["selected_chats"] = {}
-        data["selected_chats"][str(account_id)] = chat_ids
-        self._write_data(data)
-    
+        with self._index.lock:
+            data = self._mutable_data()
+            if "selected_chats" not in data:
+                data["selected_chats"] = {}
+            data["selected_chats"][str(account_id)] = chat_ids
+            self._write_data(data)
+
     def get_selected_chats(self, account_id: int) -> List[int]:
         """Получает выбранные чаты для аккаунта"""
-        data = self._read_data()
-        return data.get("selected_chats", {}).get(str(account_id), [])
-    
+        with self._index.lock:
+            data = self._read_data()
+            return list(data.get("selected_chats", {}).get(str(account_id), []))
+
     def delete_account(self, account_id: int) -> bool:
         """Удаляет аккаунт"""
-        data = self._read_data()
-        original_count = len(data["accounts"])
-        data["accounts"] = [acc for acc in data["accounts"] if acc.get("id") != account_id]
-        
-        # Удаляем выбранные чаты для этого аккаунта
-        if "selected_chats" in data:
-            data["selected_chats"].pop(str(account_id), None)
-        
-        if len(data["accounts"]) < original_count:
-            self._write_data(data)
-            return True
-        return False
+        with self._index.lock:
+            data = self._mutable_data()
+            original_count = len(data["accounts"])
+            data["accounts"] = [acc for acc in data["accounts"] if acc.get("id") != account_id]
 
+            # Удаляем выбранные чаты для этого аккаунта
+            if "selected_chats" in data:
+                data["selected_chats"].pop(str(account_id), None)
+
+            if len(data["accounts"]) < original_count:
+                self._write_data(data)
+                return True
+            return False
@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+from backend.database.file_lock import file_lock
+from backend.database.watermark_storage import watermark_key
+
+# A checkpoint older than this is from a run nobody is going to resume
+# (the catch-up window has moved on) — it is dropped and the run starts over.
+CHECKPOINT_MAX_AGE_SECONDS = int(os.getenv("PARSER_CHECKPOINT_MAX_AGE_SECONDS", str(6 * 3600)))
+
+
+class CheckpointStorage:
+    """Прогресс незавершённого батч-прогона по аккаунтам.
+
+    Пока прогон идёт, после каждой записанной пачки здесь фиксируется, какие
+    чаты уже дочитаны и докуда дочитаны начатые источники (чат или топик).
+    Если прогон прервали (редеплой, таймаут аккаунта, /api/parser/stop),
+    следующий начинает с недочитанных источников, затем берёт не начатые
+    чаты, а дочитанные пропускает. Завершённый прогон удаляет свою запись.
+
+    Формат checkpoints.json:
+        {"<phone>": {"run_id": "...", "started_at": ts, "updated_at": ts,
+                     "done": [chat_id, ...],
+                     "sources": {"<chat_id>:<topic_id|0>": {
+                         "chat_id": ..., "topic_id": ..., "min_id": ...,
+                         "offset_id": ..., "newest_id": ..., "newest_time": "..."}}}}
+
+    Источник читается от новых сообщений к старым: offset_id — последнее
+    обработанное и записанное сообщение, дочитывать нужно (min_id, offset_id).
+    newest_id/newest_time — самое новое сообщение источника в прерванном
+    прогоне, из него после дочитывания получится high-water mark.
+    """
+
+    def __init__(self):
+        self.storage_file = "checkpoints.json"
+        self._lock = threading.Lock()
+
+    def _read_data(self) -> dict:
+        try:
+            with open(self.storage_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def _write_data(self, data: dict):
+        """Атомарно записывает данные (temp-файл + fsync + rename)."""
+        directory = os.path.dirname(os.path.abspath(self.storage_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".checkpoints.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.storage_file)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        try:
+            from backend.database import state_persistence
+            state_persistence.schedule_checkpoints_backup()
+        except Exception:
+            pass
+
+    def get_account(self, phone_number: str) -> Optional[dict]:
+        """Незавершённый прогон аккаунта или None (нет или устарел)."""
+        entry = self._read_data().get(phone_number)
+        if not entry:
+            return None
+        if time.time() - entry.get("updated_at", 0) > CHECKPOINT_MAX_AGE_SECONDS:
+            return None
+        return entry
+
+    def start(self, phone_number: str, run_id: str):
+        """Новый прогон: прежний прогресс аккаунта отбрасывается."""
+        with self._lock, file_lock(self.storage_file):
+            data = self._read_data()
+            now = time.time()
+            data[phone_number] = {
+                "run_id": run_id,
+                "started_at": now,
+                "updated_at": now,
+                "done": [],
+                "sources": {},
+            }
+            self._write_data(data)
+
+    def record(self, phone_number: str, progress: List[dict], done_chats: List[int]):
+        """Фиксирует записанную пачку: позиции источников и дочитанные чаты."""
+        if not progress and not done_chats:
+            return
+        with self._lock, file_lock(self.storage_file):
+            data = self._read_data()
+            entry = data.get(phone_number)
+            if entry is None:
+                return  # прогон уже завершён или сброшен
+            sources = entry.setdefault("sources", {})
+            for point in progress:
+                sources[watermark_key(point["chat_id"], point.get("topic_id"))] = point
+            done = set(entry.get("done", []))
+            for chat_id in done_chats:
+                done.add(chat_id)
+                prefix = f"{chat_id}:"
+                for key in [k for k in sources if k.startswith(prefix)]:
+                    del sources[key]
+            entry["done"] = sorted(done)
+            entry["updated_at"] = time.time()
+            self._write_data(data)
+
+    def finish(self, phone_number: str, chat_ids: List[int]) -> bool:
+        """Удаляет запись, если все чаты прогона дочитаны. Returns True, если удалена."""
+        with self._lock, file_lock(self.storage_file):
+            data = self._read_data()
+            entry = data.get(phone_number)
+            if entry is None:
+                return True
+            if not set(chat_ids) <= set(entry.get("done", [])):
+                return False
+            del data[phone_number]
+            self._write_data(data)
+            return True
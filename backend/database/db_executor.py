@@ -0,0 +1,40 @@
+"""
+Dedicated thread pool for blocking Supabase (PostgREST) calls.
+
+supabase-py's sync client does a blocking HTTP round-trip per `.execute()`.
+Called straight from a coroutine it freezes the whole event loop — every
+Pyrogram handler and FastAPI request waits for the write to finish. All
+database I/O made from async code goes through `run_blocking` instead.
+
+The pool is separate from asyncio's default executor so slow writes can't
+starve other `run_in_executor` users, and it is small on purpose: the
+supabase client keeps one pooled httpx session, and a few threads are
+enough to keep it busy without opening a connection per write.
+"""
+import asyncio
+import functools
+import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DB_IO_WORKERS = max(1, int(os.getenv("SUPABASE_IO_WORKERS", "4")))
+
+_executor = ThreadPoolExecutor(max_workers=DB_IO_WORKERS, thread_name_prefix="supabase-io")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking DB call in the pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def run_in_background(fn, *args, **kwargs) -> Future:
+    """Fire-and-forget a blocking DB call from sync or async code.
+    Exceptions are logged, never raised to the caller."""
+    def _call():
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:  # noqa: BLE001
+            print(f">>> [db-io] background {getattr(fn, '__name__', fn)} failed: {e}", file=sys.stderr, flush=True)
+            return None
+    return _executor.submit(_call)
@@ -0,0 +1,28 @@
+"""
+Cross-process lock for the JSON state files.
+
+With PARSER_WORKERS > 0 several processes update watermarks.json and
+checkpoints.json, each as a read-modify-write of the whole file. A
+threading.Lock only orders the threads of one process, so writers also take
+an advisory flock on "<file>.lock". Without fcntl (Windows) the lock is a
+no-op — worker mode is meant for the Linux deployment.
+"""
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as handle:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
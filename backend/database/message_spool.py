@@ -0,0 +1,230 @@
+"""
+Local write-ahead spool for real-time messages.
+
+A message received by RealtimeService is appended here before the handler
+returns, and removed only after Supabase has accepted the batch it went out
+in. A failed insert or a crash therefore leaves the rows on disk: they are
+retried with backoff and replayed on the next start, so a Supabase outage
+delays messages instead of losing them.
+
+The spool is a SQLite file in WAL mode (REALTIME_SPOOL_PATH, empty to
+disable). REALTIME_SPOOL_SYNC picks the fsync policy:
+
+- "normal" (default): commits survive a crash of the process, the last
+  few may be lost if the machine itself goes down;
+- "full": every commit is fsynced — survives power loss, costs a disk
+  flush per commit.
+
+SQLite work runs on one spool thread, never on the event loop. Appends that
+arrive while a commit is in progress are written together in the next
+transaction, so a burst costs one commit (and fsync) per group, not per
+message. `append_async` returns once the message's group is committed.
+
+Replayed rows can include messages that had in fact been written just before
+a crash; the messages table deduplicates them (messages_unique_hash_idx).
+"""
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+DEFAULT_REALTIME_SPOOL_PATH = "realtime_spool.sqlite3"
+REALTIME_SPOOL_PATH = os.getenv("REALTIME_SPOOL_PATH", DEFAULT_REALTIME_SPOOL_PATH)
+REALTIME_SPOOL_SYNC = os.getenv("REALTIME_SPOOL_SYNC", "normal").lower()
+
+
+# One thread: SQLite writes are serialized anyway, and spool I/O must not
+# queue behind Supabase calls in the db_executor pool.
+_spool_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-io")
+
+
+def _log(msg: str) -> None:
+    print(f">>> [spool] {msg}", file=sys.stderr, flush=True)
+
+
+class MessageSpool:
+    def __init__(self, path: Optional[str] = REALTIME_SPOOL_PATH, sync: str = REALTIME_SPOOL_SYNC):
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # (payload, created_at, future) — ждут следующего группового commit
+        self._pending: List[tuple] = []
+        self._committer: Optional[asyncio.Future] = None
+        self.appended = 0
+        self.removed = 0
+        self.commits = 0
+        # Строк в файле и created_at самой старой — для status(), чтобы не
+        # считать COUNT/MIN на event loop. Меняются вместе с записью/удалением.
+        self.rows = 0
+        self._oldest_at: Optional[float] = None
+        if path:
+            self._open(path, sync)
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def _open(self, path: str, sync: str) -> None:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={'FULL' if sync == 'full' else 'NORMAL'}")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+            self.rows = self.count()
+            self._oldest_at = self._read_oldest_at()
+            if self.rows:
+                _log(f"{self.rows} message(s) left from a previous run will be replayed")
+        except sqlite3.Error as e:
+            _log(f"disabled ({path}): {e} — real-time messages are kept in memory only")
+            self._db = None
+
+    def append(self, message: dict) -> Optional[int]:
+        """Сохраняет сообщение, возвращает id строки (None — спул выключен
+        или запись не удалась: сообщение остаётся только в памяти)."""
+        if self._db is None:
+            return None
+        payload = json.dumps(message, ensure_ascii=False)
+        created_at = time.time()
+        try:
+            with self._lock:
+                cursor = self._db.execute(
+                    "INSERT INTO spool (payload, created_at) VALUES (?, ?)", (payload, created_at)
+                )
+                self._db.commit()
+                self._added(1, created_at)
+        except sqlite3.Error as e:
+            _log(f"append failed: {e}")
+            return None
+        self.appended += 1
+        return cursor.lastrowid
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_spool_executor, functools.partial(fn, *args))
+
+    async def append_async(self, message: dict) -> Optional[int]:
+        """append без блокировки event loop; одновременные вызовы пишутся
+        одной транзакцией. Возвращает id строки после commit."""
+        if self._db is None:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((json.dumps(message, ensure_ascii=False), time.time(), future))
+        if self._committer is None or self._committer.done():
+            self._committer = asyncio.ensure_future(self._commit_pending())
+        return await future
+
+    async def _commit_pending(self) -> None:
+        while self._pending:
+            group, self._pending = self._pending, []
+            try:
+                ids = await self._run(self._insert_many, [(payload, created) for payload, created, _ in group])
+            except Exception as e:  # noqa: BLE001
+                _log(f"append of {len(group)} message(s) failed: {e}")
+                ids = [None] * len(group)
+            for (_, _, future), row_id in zip(group, ids):
+                if not future.done():
+                    future.set_result(row_id)
+
+    def _insert_many(self, rows: List[Tuple[str, float]]) -> List[int]:
+        with self._lock:
+            try:
+                ids = [
+                    self._db.execute("INSERT INTO spool (payload, created_at) VALUES (?, ?)", row).lastrowid
+                    for row in rows
+                ]
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+            self._added(len(ids), rows[0][1])
+        self.appended += len(ids)
+        self.commits += 1
+        return ids
+
+    async def remove_async(self, ids: List[int]) -> None:
+        """remove без блокировки event loop."""
+        if self._db is not None and ids:
+            try:
+                await self._run(self.remove, ids)
+            except sqlite3.Error as e:
+                # Строки останутся и уйдут повтором — дубликаты отсечёт база
+                _log(f"remove failed: {e}")
+
+    async def read_async(self, limit: int) -> List[Tuple[int, dict]]:
+        if self._db is None:
+            return []
+        return await self._run(self.read, limit)
+
+    def remove(self, ids: List[int]) -> None:
+        """Удаляет записанные в Supabase строки."""
+        ids = [i for i in ids if i is not None]
+        if self._db is None or not ids:
+            return
+        with self._lock:
+            cursor = self._db.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+            self._db.commit()
+            self.rows = max(0, self.rows - cursor.rowcount)
+            # По первичному ключу, а не MIN по всей таблице; мы на потоке спула
+            self._oldest_at = self._read_oldest_at() if self.rows else None
+        self.removed += len(ids)
+
+    def read(self, limit: int) -> List[Tuple[int, dict]]:
+        """Самые старые limit строк: [(id, message)]."""
+        if self._db is None:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, payload FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def _added(self, n: int, created_at: float) -> None:
+        if n and not self.rows:
+            self._oldest_at = created_at
+        self.rows += n
+
+    def _read_oldest_at(self) -> Optional[float]:
+        row = self._db.execute("SELECT created_at FROM spool ORDER BY id LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        if self._db is None:
+            return 0
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Только счётчики в памяти — вызывается со status() на event loop."""
+        age = time.time() - self._oldest_at if self._oldest_at is not None else None
+        return {
+            "enabled": self.enabled,
+            "pending": self.rows,
+            "oldest_age_seconds": round(age, 1) if age is not None else None,
+            "appended": self.appended,
+            "removed": self.removed,
+            "commits": self.commits,
+        }
+
+
+_default_spool: Optional[MessageSpool] = None
+
+
+def default_spool() -> MessageSpool:
+    """Process-wide spool of RealtimeService at REALTIME_SPOOL_PATH, opened
+    on first use. Worker processes pass their own MessageSpool instead."""
+    global _default_spool
+    if _default_spool is None:
+        _default_spool = MessageSpool(os.getenv("REALTIME_SPOOL_PATH", DEFAULT_REALTIME_SPOOL_PATH))
+    return _default_spool
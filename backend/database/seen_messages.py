@@ -0,0 +1,113 @@
+"""
+In-process seen-set for messages already stored in Supabase.
+
+The batch parser re-reads recent history that realtime has already saved, so
+a large share of every insert is duplicates that Postgres then rejects. This
+cache remembers messages by the same tuple as the unique index
+messages_unique_hash_idx — (md5(message), COALESCE(username, ''), chat_name,
+message_time) — and lets SupabaseClient drop known rows before they are
+serialized and sent.
+
+It is a bounded LRU (oldest entries are evicted first), shared by every
+SupabaseClient in the process and safe to use from the DB I/O threads.
+A miss only costs one round-trip to the database, which still deduplicates.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+
+SEEN_CACHE_MAX_SIZE = int(os.getenv("SEEN_CACHE_MAX_SIZE", "200000"))
+
+
+def _normalize_time(value) -> float:
+    """message_time comes back from PostgREST in a different string format
+    than the one we send, so compare instants, not strings."""
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return round(dt.timestamp(), 6)
+
+
+def message_key(msg: dict) -> Tuple[str, str, str, float]:
+    text = msg.get("message") or ""
+    return (
+        hashlib.md5(text.encode("utf-8")).hexdigest(),
+        msg.get("username") or "",
+        msg.get("chat_name") or "",
+        _normalize_time(msg.get("message_time")),
+    )
+
+
+class SeenMessageCache:
+    def __init__(self, max_size: int = SEEN_CACHE_MAX_SIZE):
+        self.max_size = max(1, max_size)
+        self._keys: "OrderedDict[tuple, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+
+    def filter_new(self, messages: List[dict]) -> Tuple[List[dict], int]:
+        """Returns (messages not seen yet, number dropped). Duplicates inside
+        the batch itself are dropped too."""
+        fresh = []
+        batch_keys = set()
+        dropped = 0
+        with self._lock:
+            for msg in messages:
+                try:
+                    key = message_key(msg)
+                except (TypeError, ValueError):
+                    fresh.append(msg)  # unparsable time — let the DB decide
+                    continue
+                if key in self._keys or key in batch_keys:
+                    if key in self._keys:
+                        self._keys.move_to_end(key)
+                    dropped += 1
+                    continue
+                batch_keys.add(key)
+                fresh.append(msg)
+            self.hits += dropped
+            self.misses += len(fresh)
+        return fresh, dropped
+
+    def add_many(self, messages: Iterable[dict]) -> None:
+        """Remember messages the database now holds (inserted or duplicate)."""
+        with self._lock:
+            for msg in messages:
+                try:
+                    key = message_key(msg)
+                except (TypeError, ValueError):
+                    continue
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def warm(self, rows: Iterable[dict]) -> int:
+        before = len(self._keys)
+        self.add_many(rows)
+        added = len(self._keys) - before
+        self.warmed += added
+        return added
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._keys),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "warmed": self.warmed,
+        }
+
+
+# Process-wide instance: batch and realtime writes share one view of the DB.
+seen_messages = SeenMessageCache()
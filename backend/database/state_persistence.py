@@ -23,22 +23,45 @@ Requires a one-time table (run in Supabase SQL editor):
 Everything here is best-effort: if the table is missing or Supabase is
 unreachable, calls log and return without raising, so the parser keeps
 running (just without persistence).
+
+watermarks.json and checkpoints.json are stored per account
+(`watermarks:<phone>`, `checkpoints:<phone>`), and a node uploads only the
+accounts whose entry changed since it restored or last uploaded it. With
+several nodes each one writes the accounts it works, instead of the last
+node to back up overwriting everyone's progress with its stale copy.
 """
 import os
 import sys
 import base64
 import glob
+import json
 import sqlite3
 import tempfile
+import threading
 from datetime import datetime, timezone
 
 from supabase import create_client
 
 SESSIONS_DIR = "sessions"
 ACCOUNTS_FILE = "accounts.json"
+WATERMARKS_FILE = "watermarks.json"
+CHECKPOINTS_FILE = "checkpoints.json"
 TABLE = "parser_state"
 
+# accounts.json changes arrive in bursts (add → verify → select chats); one
+# upload per burst is enough, and it must not run on the caller's thread.
+ACCOUNTS_BACKUP_DEBOUNCE_SECONDS = 5
+# Batch-run checkpoints move after every written batch; upload at most this often.
+CHECKPOINTS_BACKUP_DEBOUNCE_SECONDS = 30
+
 _client = None
+_backup_timers = {}
+_backup_timers_lock = threading.Lock()
+
+# Per-account rows: key -> content this node restored or last uploaded
+# (None — row deleted). Unchanged accounts are not uploaded again.
+_synced = {}
+_synced_lock = threading.Lock()
 
 
 def _log(msg: str) -> None:
@@ -82,6 +105,55 @@ def _upsert(key: str, content: str) -> bool:
         return False
 
 
+def _delete(key: str) -> bool:
+    c = _get_client()
+    if not c:
+        return False
+    try:
+        c.table(TABLE).delete().eq("key", key).execute()
+        return True
+    except Exception as e:  # noqa: BLE001
+        _log(f"delete {key} failed: {e}")
+        return False
+
+
+def _account_row(phone: str, entry) -> str:
+    """Content of a per-account row: the account's slice of the file."""
+    return json.dumps({phone: entry}, ensure_ascii=False, sort_keys=True)
+
+
+def _backup_per_account(path: str, prefix: str) -> None:
+    """Uploads `<prefix>:<phone>` for every account whose entry in `path`
+    changed, deletes rows of accounts this node removed from the file."""
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:  # noqa: BLE001
+        _log(f"read {path} failed: {e}")
+        return
+    with _synced_lock:
+        uploaded = 0
+        current = set()
+        for phone, entry in data.items():
+            key = f"{prefix}:{_safe_phone(phone)}"
+            current.add(key)
+            content = _account_row(phone, entry)
+            if _synced.get(key) == content:
+                continue
+            if _upsert(key, content):
+                _synced[key] = content
+                uploaded += 1
+        for key, content in list(_synced.items()):
+            if key.startswith(f"{prefix}:") and content is not None and key not in current:
+                if _delete(key):
+                    _synced[key] = None
+                    uploaded += 1
+    if uploaded:
+        _log(f"{path}: {uploaded} account(s) backed up")
+
+
 def _sqlite_snapshot_bytes(path: str) -> bytes:
     """Consistent snapshot of a (possibly in-use) SQLite session file via the
     SQLite online-backup API, so we never capture a torn read."""
@@ -118,6 +190,47 @@ def backup_accounts() -> None:
         _log("accounts.json backed up")
 
 
+def _run_scheduled_backup(name: str, backup) -> None:
+    with _backup_timers_lock:
+        _backup_timers.pop(name, None)
+    backup()
+
+
+def _schedule_backup(name: str, backup, delay: float) -> None:
+    """Debounced backup on a background thread. Calls made while a backup is
+    already pending are coalesced into it — it reads the file when it fires,
+    so it always uploads the latest content."""
+    with _backup_timers_lock:
+        if name in _backup_timers:
+            return
+        timer = threading.Timer(delay, _run_scheduled_backup, args=(name, backup))
+        timer.daemon = True
+        _backup_timers[name] = timer
+        timer.start()
+
+
+def schedule_accounts_backup(delay: float = ACCOUNTS_BACKUP_DEBOUNCE_SECONDS) -> None:
+    """Debounced backup_accounts()."""
+    _schedule_backup("accounts", backup_accounts, delay)
+
+
+def backup_watermarks() -> None:
+    """Mirror the incremental-parsing high-water marks, so a rebuilt container
+    resumes from the last saved message instead of the fixed hours_back window."""
+    _backup_per_account(WATERMARKS_FILE, "watermarks")
+
+
+def backup_checkpoints() -> None:
+    """Mirror batch-run checkpoints, so a run killed by a redeploy resumes
+    in the new container instead of starting over."""
+    _backup_per_account(CHECKPOINTS_FILE, "checkpoints")
+
+
+def schedule_checkpoints_backup(delay: float = CHECKPOINTS_BACKUP_DEBOUNCE_SECONDS) -> None:
+    """Debounced backup_checkpoints()."""
+    _schedule_backup("checkpoints", backup_checkpoints, delay)
+
+
 def backup_session(phone: str) -> None:
     safe = _safe_phone(phone)
     path = os.path.join(SESSIONS_DIR, f"{safe}.session")
@@ -135,6 +248,8 @@ def backup_session(phone: str) -> None:
 
 def backup_all() -> None:
     backup_accounts()
+    backup_watermarks()
+    backup_checkpoints()
     for path in glob.glob(os.path.join(SESSIONS_DIR, "*.session")):
         safe = os.path.basename(path)[: -len(".session")]
         backup_session(safe)
@@ -143,7 +258,7 @@ def backup_all() -> None:
 # ── restore ──────────────────────────────────────────────────────────────
 
 def restore_all() -> None:
-    """Restore accounts.json + every session file from Supabase. Call this on
+    """Restore accounts.json, watermarks.json, checkpoints.json + every session file from Supabase. Call this on
     boot BEFORE the realtime service reads accounts / opens sessions."""
     c = _get_client()
     if not c:
@@ -158,6 +273,10 @@ def restore_all() -> None:
         return
     os.makedirs(SESSIONS_DIR, exist_ok=True)
     restored = 0
+    # file -> {phone: entry}; whole-file rows of older versions first,
+    # per-account rows override them
+    legacy = {WATERMARKS_FILE: {}, CHECKPOINTS_FILE: {}}
+    per_account = {WATERMARKS_FILE: {}, CHECKPOINTS_FILE: {}}
     for row in rows:
         key = row.get("key") or ""
         content = row.get("content")
@@ -168,6 +287,11 @@ def restore_all() -> None:
                 with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
                     f.write(content)
                 restored += 1
+            elif key in (WATERMARKS_FILE, CHECKPOINTS_FILE):
+                legacy[key].update(json.loads(content))
+            elif key.startswith(("watermarks:", "checkpoints:")):
+                path = WATERMARKS_FILE if key.startswith("watermarks:") else CHECKPOINTS_FILE
+                per_account[path].update(json.loads(content))
             elif key.startswith("session:"):
                 safe = key.split(":", 1)[1]
                 with open(os.path.join(SESSIONS_DIR, f"{safe}.session"), "wb") as f:
@@ -175,4 +299,18 @@ def restore_all() -> None:
                 restored += 1
         except Exception as e:  # noqa: BLE001
             _log(f"restore {key} failed: {e}")
+    for path, prefix in ((WATERMARKS_FILE, "watermarks"), (CHECKPOINTS_FILE, "checkpoints")):
+        data = {**legacy[path], **per_account[path]}
+        if not data:
+            continue
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            restored += 1
+        except Exception as e:  # noqa: BLE001
+            _log(f"restore {path} failed: {e}")
+            continue
+        with _synced_lock:
+            for phone, entry in data.items():
+                _synced[f"{prefix}:{_safe_phone(phone)}"] = _account_row(phone, entry)
     _log(f"restored {restored} item(s) from DB")
@@ -1,11 +1,32 @@
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
+from backend.database.db_executor import run_blocking
+from backend.database.seen_messages import seen_messages
+from datetime import datetime, timedelta, timezone
 
 load_dotenv()
 
+# Rows per insert_messages_dedup RPC call. One request per chunk regardless of
+# duplicates, so chunks can be much larger than on the legacy upsert path.
+DEDUP_RPC_CHUNK_SIZE = 500
+LEGACY_CHUNK_SIZE = 50
+
+# Startup warm-up of the seen-message cache: how far back and how many rows.
+# Batch runs re-read about one hour, so a couple of hours covers the overlap.
+SEEN_CACHE_WARM_HOURS = int(os.getenv("SEEN_CACHE_WARM_HOURS", "2"))
+SEEN_CACHE_WARM_MAX_ROWS = 20000
+
 class SupabaseClient:
     def __init__(self):
+        # Сбрасывается в False, если SQL-функция из messages_dedup.sql не создана
+        self._dedup_rpc_available = True
+        # Сбрасывается в False, если нет get_parsing_sessions из parsing_sessions_summary.sql
+        self._sessions_rpc_available = True
+        # Сбрасывается в False, если нет таблицы parsing_sessions из parsing_sessions_schema.sql
+        self._sessions_table_available = True
+        # Сбрасывается в False, если нет backfill_bios из messages_bio_backfill.sql
+        self._bios_rpc_available = True
         print("\n" + "="*70, flush=True)
         print("🔧 INITIALIZING SUPABASE CLIENT", flush=True)
         print("="*70, flush=True)
@@ -86,11 +107,25 @@ class SupabaseClient:
     def insert_messages_batch(self, messages: list) -> bool:
         """Вставляет пакет сообщений с устойчивостью к дубликатам.
         
+        Возвращает True, если хоть что-то записано или ошибок не было.
+        Подробные счётчики — в insert_messages_batch_counts.
+        """
+        counts = self.insert_messages_batch_counts(messages)
+        return counts["errors"] == 0 or counts["inserted"] > 0
+
+    def insert_messages_batch_counts(self, messages: list) -> dict:
+        """Вставляет пакет сообщений и возвращает
+        {"inserted": int, "duplicates": int, "errors": int}.
+        
         Unique index messages_unique_hash_idx использует выражения
         (md5(message), COALESCE(username,''), chat_name, message_time),
         поэтому PostgREST upsert не может разрешить конфликт автоматически.
-        Вставляем чанками; при ошибке дубликата — fallback на поштучную вставку.
+        Основной путь — RPC insert_messages_dedup (database/messages_dedup.sql):
+        один запрос на чанк, дубликаты отсекает сам Postgres через
+        ON CONFLICT DO NOTHING. Если функция ещё не создана — старый путь:
+        upsert чанками и поштучная вставка при ошибке дубликата.
         """
+        counts = {"inserted": 0, "duplicates": 0, "errors": 0}
         if not self.client:
             print("\n" + "="*70, flush=True)
             print("❌ ERROR: Supabase client not initialized. Messages not saved!", flush=True)
@@ -99,11 +134,20 @@ class SupabaseClient:
             print("   2. Backend not restarted after adding variables", flush=True)
             print("   3. Invalid Supabase credentials", flush=True)
             print("="*70 + "\n", flush=True)
-            return False
+            counts["errors"] = len(messages)
+            return counts
         
         if not messages:
             print("No messages to insert", flush=True)
-            return True
+            return counts
+
+        # 🧠 Отсекаем то, что БД уже точно хранит, ещё до сериализации
+        messages, cached = seen_messages.filter_new(messages)
+        counts["duplicates"] += cached
+        if cached:
+            print(f"⏩ Dedup cache dropped {cached} known messages before sending", flush=True)
+        if not messages:
+            return counts
             
         print(f"Inserting {len(messages)} messages to Supabase...", flush=True)
         
@@ -115,38 +159,90 @@ class SupabaseClient:
             print(f"   first_name: {first_msg.get('first_name')}", flush=True)
             print(f"   chat_name: {first_msg.get('chat_name')}", flush=True)
 
-        CHUNK_SIZE = 50
-        total_inserted = 0
-        total_duplicates = 0
-        total_errors = 0
+        if self._dedup_rpc_available:
+            chunk_size = DEDUP_RPC_CHUNK_SIZE
+        else:
+            chunk_size = LEGACY_CHUNK_SIZE
 
-        for i in range(0, len(messages), CHUNK_SIZE):
-            chunk = messages[i:i + CHUNK_SIZE]
-            try:
-                result = self.client.table('messages').upsert(chunk, ignore_duplicates=True).execute()
-                inserted = len(result.data) if result.data else 0
-                total_inserted += inserted
-                total_duplicates += len(chunk) - inserted
-            except Exception as chunk_err:
-                err_code = getattr(chunk_err, 'code', '') or ''
-                err_msg = str(chunk_err)
-                is_duplicate = '23505' in err_msg or '23505' in str(err_code)
-
-                if is_duplicate:
-                    ins, dup, errs = self._insert_individually(chunk)
-                    total_inserted += ins
-                    total_duplicates += dup
-                    total_errors += errs
-                else:
-                    print(f"❌ Chunk insert error (non-duplicate): {chunk_err}", flush=True)
-                    total_errors += len(chunk)
+        for i in range(0, len(messages), chunk_size):
+            chunk = messages[i:i + chunk_size]
+            if self._dedup_rpc_available:
+                ins, dup, errs = self._insert_chunk_rpc(chunk)
+            else:
+                ins, dup, errs = self._insert_chunk_legacy(chunk)
+            counts["inserted"] += ins
+            counts["duplicates"] += dup
+            counts["errors"] += errs
+            if errs == 0:
+                seen_messages.add_many(chunk)
 
-        if total_duplicates > 0 or total_errors > 0:
-            print(f"✅ Inserted {total_inserted}, ⏩ duplicates skipped {total_duplicates}, ❌ errors {total_errors} (total {len(messages)})", flush=True)
+        if counts["duplicates"] > 0 or counts["errors"] > 0:
+            print(f"✅ Inserted {counts['inserted']}, ⏩ duplicates skipped {counts['duplicates']}, ❌ errors {counts['errors']} (total {len(messages)})", flush=True)
         else:
-            print(f"✅ Successfully inserted all {total_inserted} messages!", flush=True)
+            print(f"✅ Successfully inserted all {counts['inserted']} messages!", flush=True)
 
-        return total_errors == 0 or total_inserted > 0
+        return counts
+
+    def warm_seen_cache(self, hours: int = SEEN_CACHE_WARM_HOURS) -> int:
+        """Загружает ключи недавних сообщений в seen_messages при старте,
+        чтобы первый батч после рестарта не слал уже сохранённое."""
+        if not self.client:
+            return 0
+        since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+        page_size = 1000  # PostgREST max-rows по умолчанию
+        loaded = 0
+        try:
+            while loaded < SEEN_CACHE_WARM_MAX_ROWS:
+                result = self.client.table('messages')\
+                    .select("message,username,chat_name,message_time")\
+                    .gte('message_time', since)\
+                    .order('message_time', desc=True)\
+                    .range(loaded, loaded + page_size - 1)\
+                    .execute()
+                rows = result.data or []
+                seen_messages.warm(rows)
+                loaded += len(rows)
+                if len(rows) < page_size:
+                    break
+            print(f"🧠 Dedup cache warmed with {loaded} messages from the last {hours}h", flush=True)
+        except Exception as e:
+            print(f"⚠️ Could not warm dedup cache: {e}", flush=True)
+        return loaded
+
+    def _insert_chunk_rpc(self, chunk: list):
+        """Один RPC-вызов на чанк; конфликты по messages_unique_hash_idx
+        разрешаются на сервере. Returns (inserted, duplicates, errors)."""
+        try:
+            result = self.client.rpc('insert_messages_dedup', {'p_rows': chunk}).execute()
+            row = (result.data or [{}])[0]
+            inserted = int(row.get('inserted') or 0)
+            return inserted, len(chunk) - inserted, 0
+        except Exception as rpc_err:
+            err_msg = str(rpc_err)
+            # PGRST202 — функции нет в schema cache, 42883 — undefined_function
+            if 'PGRST202' in err_msg or '42883' in err_msg or 'Could not find the function' in err_msg:
+                print("⚠️ RPC insert_messages_dedup not found — run database/messages_dedup.sql "
+                      "in Supabase. Falling back to chunked upsert.", flush=True)
+                self._dedup_rpc_available = False
+                return self._insert_chunk_legacy(chunk)
+            print(f"❌ Chunk insert error (RPC): {rpc_err}", flush=True)
+            return 0, 0, len(chunk)
+
+    def _insert_chunk_legacy(self, chunk: list):
+        """Старый путь без RPC: upsert чанка, при 23505 — поштучно."""
+        try:
+            result = self.client.table('messages').upsert(chunk, ignore_duplicates=True).execute()
+            inserted = len(result.data) if result.data else 0
+            return inserted, len(chunk) - inserted, 0
+        except Exception as chunk_err:
+            err_code = getattr(chunk_err, 'code', '') or ''
+            err_msg = str(chunk_err)
+            is_duplicate = '23505' in err_msg or '23505' in str(err_code)
+
+            if is_duplicate:
+                return self._insert_individually(chunk)
+            print(f"❌ Chunk insert error (non-duplicate): {chunk_err}", flush=True)
+            return 0, 0, len(chunk)
 
     def _insert_individually(self, messages: list):
         """Fallback: вставляет сообщения по одному, пропуская дубликаты."""
@@ -170,6 +266,222 @@ class SupabaseClient:
                         print(f"⚠️ Individual insert error: {err_msg[:150]}", flush=True)
         return inserted, duplicates, errors
     
+    def backfill_bios(self, bios: dict) -> int:
+        """Проставляет bio уже сохранённым сообщениям: {user_id: bio}.
+        Один RPC-вызов на всю пачку; обновляются только строки с bio IS NULL.
+        Returns число обновлённых строк — его считает база, а не клиент."""
+        if not self.client or not bios or not self._bios_rpc_available:
+            return 0
+        try:
+            result = self.client.rpc(
+                'backfill_bios', {'p_bios': {str(user_id): bio for user_id, bio in bios.items()}}
+            ).execute()
+        except Exception as rpc_err:
+            err_msg = str(rpc_err)
+            # PGRST202 — функции нет в schema cache, 42883 — undefined_function
+            if 'PGRST202' in err_msg or '42883' in err_msg or 'Could not find the function' in err_msg:
+                # UPDATE напрямую под RLS не найдёт ни одной строки — без функции не пишем
+                print("⚠️ RPC backfill_bios not found — run database/messages_bio_backfill.sql "
+                      "in Supabase. Bio back-fill is disabled.", flush=True)
+                self._bios_rpc_available = False
+            else:
+                print(f"⚠️ Bio back-fill failed for {len(bios)} user(s): {err_msg[:150]}", flush=True)
+            return 0
+        if not isinstance(result.data, int):
+            print(f"⚠️ Bio back-fill: unexpected RPC result {result.data!r}", flush=True)
+            return 0
+        return result.data
+
+    async def backfill_bios_async(self, bios: dict) -> int:
+        """backfill_bios без блокировки event loop."""
+        return await run_blocking(self.backfill_bios, bios)
+
+    async def insert_messages_batch_async(self, messages: list) -> bool:
+        """insert_messages_batch без блокировки event loop (в пуле db_executor)."""
+        return await run_blocking(self.insert_messages_batch, messages)
+
+    async def insert_messages_batch_counts_async(self, messages: list) -> dict:
+        """insert_messages_batch_counts без блокировки event loop."""
+        return await run_blocking(self.insert_messages_batch_counts, messages)
+
+    def fetch_chat_activity(self, phone_number: str, since_iso: str, page_size: int = 1000) -> list:
+        """Строки parsing_logs аккаунта начиная с since_iso — только колонки,
+        нужные планировщику чатов (chat_id, messages_found,
+        execution_time_seconds, started_at, status)."""
+        if not self.client:
+            return []
+        rows = []
+        offset = 0
+        while True:
+            result = (
+                self.client.table('parsing_logs')
+                .select('chat_id,messages_found,execution_time_seconds,started_at,status')
+                .eq('phone_number', phone_number)
+                .gte('started_at', since_iso)
+                .order('started_at', desc=False)
+                .range(offset, offset + page_size - 1)
+                .execute()
+            )
+            page = result.data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+        return rows
+
+    async def fetch_chat_activity_async(self, phone_number: str, since_iso: str) -> list:
+        """fetch_chat_activity без блокировки event loop."""
+        return await run_blocking(self.fetch_chat_activity, phone_number, since_iso)
+
+    def insert_parsing_session(self, row: dict) -> bool:
+        """Пишет итоги прогона в parsing_sessions (одна строка на прогон)."""
+        if not self.client or not self._sessions_table_available:
+            return False
+        try:
+            self.client.table('parsing_sessions').insert(row).execute()
+            print(f"📋 Saved run summary {row['session_id']}: {row['total_chats']} chats, "
+                  f"{row['total_messages']} messages, {row['error_count']} errors", flush=True)
+            return True
+        except Exception as e:
+            if self._is_missing_table(e):
+                print("⚠️ Table parsing_sessions not found — run database/parsing_sessions_schema.sql "
+                      "in Supabase. Run summaries are not saved.", flush=True)
+                self._sessions_table_available = False
+            else:
+                print(f"❌ ERROR inserting run summary: {e}", flush=True)
+            return False
+
+    async def insert_parsing_session_async(self, row: dict) -> bool:
+        """insert_parsing_session без блокировки event loop."""
+        return await run_blocking(self.insert_parsing_session, row)
+
+    @staticmethod
+    def _is_missing_table(err: Exception) -> bool:
+        # PGRST205 — таблицы нет в schema cache, 42P01 — undefined_table
+        err_msg = str(err)
+        return 'PGRST205' in err_msg or '42P01' in err_msg or 'Could not find the table' in err_msg
+
+    def fetch_parsing_sessions(self, limit: int = 50) -> list:
+        """Последние limit прогонов. Итоги пишет ParserService в
+        parsing_sessions; пока таблицы нет (или она пуста) — агрегаты по
+        parsing_logs (RPC get_parsing_sessions, без функции — в Python)."""
+        if not self.client:
+            return []
+        if self._sessions_table_available:
+            try:
+                result = (
+                    self.client.table('parsing_sessions')
+                    .select('*')
+                    .order('started_at', desc=True)
+                    .limit(limit)
+                    .execute()
+                )
+                if result.data:
+                    return result.data
+            except Exception as e:
+                if not self._is_missing_table(e):
+                    raise
+                self._sessions_table_available = False
+        if self._sessions_rpc_available:
+            try:
+                result = self.client.rpc('get_parsing_sessions', {'p_limit': limit}).execute()
+                return result.data or []
+            except Exception as rpc_err:
+                err_msg = str(rpc_err)
+                if 'PGRST202' in err_msg or '42883' in err_msg or 'Could not find the function' in err_msg:
+                    print("⚠️ RPC get_parsing_sessions not found — run database/parsing_sessions_summary.sql "
+                          "in Supabase. Aggregating sessions in Python.", flush=True)
+                    self._sessions_rpc_available = False
+                else:
+                    raise
+        return self._aggregate_parsing_sessions(limit)
+
+    def _aggregate_parsing_sessions(self, limit: int, page_size: int = 1000) -> list:
+        """Запасной путь без RPC: сначала id последних limit сессий (лёгкие
+        колонки, пока не наберётся limit), затем все логи только этих сессий."""
+        session_ids = {}  # dict — уникальные id в порядке появления
+        offset = 0
+        while len(session_ids) < limit:
+            page = (
+                self.client.table('parsing_logs')
+                .select('parsing_session_id')
+                .order('started_at', desc=True)
+                .range(offset, offset + page_size - 1)
+                .execute()
+            ).data or []
+            for row in page:
+                session_ids.setdefault(row['parsing_session_id'], None)
+            if len(page) < page_size:
+                break
+            offset += page_size
+        session_ids = list(session_ids)[:limit]
+        if not session_ids:
+            return []
+
+        logs = []
+        offset = 0
+        while True:
+            page = (
+                self.client.table('parsing_logs')
+                .select('parsing_session_id,started_at,finished_at,phone_number,chat_name,'
+                        'messages_saved,status,error_type,error_message')
+                .in_('parsing_session_id', session_ids)
+                .order('id')
+                .range(offset, offset + page_size - 1)
+                .execute()
+            ).data or []
+            logs.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+        sessions = {}
+        for log in logs:
+            session_id = log['parsing_session_id']
+            session = sessions.get(session_id)
+            if session is None:
+                session = sessions[session_id] = {
+                    'session_id': session_id,
+                    'started_at': log['started_at'],
+                    'finished_at': log.get('finished_at'),
+                    'total_chats': 0,
+                    'total_messages': 0,
+                    'success_count': 0,
+                    'error_count': 0,
+                    'skipped_count': 0,
+                    'accounts': set(),
+                    'errors': []
+                }
+            session['started_at'] = min(session['started_at'], log['started_at'])
+            if log.get('finished_at') and (session['finished_at'] or '') < log['finished_at']:
+                session['finished_at'] = log['finished_at']
+            session['total_chats'] += 1
+            session['total_messages'] += log.get('messages_saved') or 0
+            session['accounts'].add(log['phone_number'])
+            if log['status'] == 'success':
+                session['success_count'] += 1
+            elif log['status'] == 'error':
+                session['error_count'] += 1
+                session['errors'].append({
+                    'chat_name': log['chat_name'],
+                    'error_type': log.get('error_type'),
+                    'error_message': log.get('error_message')
+                })
+            elif log['status'] == 'skipped':
+                session['skipped_count'] += 1
+
+        for session in sessions.values():
+            session['accounts'] = sorted(session['accounts'])
+        return sorted(sessions.values(), key=lambda x: x['started_at'], reverse=True)
+
+    async def fetch_parsing_sessions_async(self, limit: int = 50) -> list:
+        """fetch_parsing_sessions без блокировки event loop."""
+        return await run_blocking(self.fetch_parsing_sessions, limit)
+
+    async def insert_parsing_logs_batch_async(self, logs: list) -> bool:
+        """insert_parsing_logs_batch без блокировки event loop (в пуле db_executor)."""
+        return await run_blocking(self.insert_parsing_logs_batch, logs)
+
     def insert_parsing_logs_batch(self, logs: list) -> bool:
         """Вставляет пакет логов парсинга"""
         if not self.client:
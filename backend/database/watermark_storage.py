@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from backend.database.file_lock import file_lock
+
+
+def watermark_key(chat_id: int, topic_id: Optional[int] = None) -> str:
+    """Ключ источника сообщений: чат или конкретный топик форума."""
+    return f"{chat_id}:{topic_id or 0}"
+
+
+class WatermarkStorage:
+    """High-water marks для инкрементального парсинга.
+
+    Для каждой пары (аккаунт, источник) хранится id и время самого нового
+    сохранённого сообщения. Следующий батч запрашивает у Telegram только
+    сообщения новее отметки, а после простоя дочитывает пропуск целиком.
+
+    Формат watermarks.json:
+        {"<phone>": {"<chat_id>:<topic_id|0>": {"message_id": 123,
+                                                "message_time": "...+00:00"}}}
+    """
+
+    def __init__(self):
+        self.storage_file = "watermarks.json"
+        self._lock = threading.Lock()
+
+    def _read_data(self) -> dict:
+        try:
+            with open(self.storage_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def _write_data(self, data: dict):
+        """Атомарно записывает данные (temp-файл + fsync + rename): оборванная
+        запись не должна обнулить отметки — иначе следующий прогон
+        перечитает всё окно догонки."""
+        directory = os.path.dirname(os.path.abspath(self.storage_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".watermarks.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.storage_file)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get_account_marks(self, phone_number: str) -> Dict[str, dict]:
+        """Все отметки аккаунта: {watermark_key: {"message_id", "message_time"}}"""
+        return self._read_data().get(phone_number, {})
+
+    def update(self, phone_number: str, marks: List[dict]) -> int:
+        """Сдвигает отметки вперёд. Отметка никогда не уменьшается, поэтому
+        запоздалый или повторный вызов не откатит прогресс. Возвращает число
+        изменённых отметок."""
+        if not marks:
+            return 0
+        with self._lock, file_lock(self.storage_file):
+            data = self._read_data()
+            account_marks = data.setdefault(phone_number, {})
+            changed = 0
+            for mark in marks:
+                key = watermark_key(mark["chat_id"], mark.get("topic_id"))
+                current = account_marks.get(key)
+                if current and current.get("message_id", 0) >= mark["message_id"]:
+                    continue
+                account_marks[key] = {
+                    "message_id": mark["message_id"],
+                    "message_time": mark.get("message_time"),
+                }
+                changed += 1
+            if changed:
+                self._write_data(data)
+        return changed
@@ -59,6 +59,10 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠️ State restore failed (continuing): {e}", flush=True)
 
+    # Warm the dedup cache in the background — startup must not wait for it.
+    from backend.database.db_executor import run_in_background
+    run_in_background(supabase_client.warm_seen_cache)
+
     # Инициализация сервисов
     parser_service = ParserService(supabase_client)
     realtime_service = RealtimeService(supabase_client)
@@ -68,38 +72,83 @@ async def lifespan(app: FastAPI):
     # yet at lifespan startup).
     parser_service.set_realtime_service(realtime_service)
 
+    # Bios of unknown senders are resolved in the background and back-filled
+    # into saved rows through this client.
+    from backend.services.profile_resolver import profile_resolver
+    profile_resolver.attach(supabase_client)
+
+    # PARSER_WORKERS > 0: аккаунты шардируются по процессам-воркерам, этот
+    # процесс только координирует (realtime и батч работают в воркерах)
+    from backend.services.worker_pool import worker_pool
+    if worker_pool.enabled:
+        await worker_pool.start()
+        app.state.worker_pool = worker_pool
+
     # Сохраняем в app.state для доступа из роутеров
     app.state.scheduler = scheduler
     app.state.auto_parsing_enabled = True
-    app.state.realtime_service = realtime_service
+    app.state.realtime_service = worker_pool.realtime if worker_pool.enabled else realtime_service
+    app.state.parser_service = parser_service
     
-    # Запуск планировщика (batch-парсинг как fallback каждые 30 мин)
+    # Запуск планировщика: частый тик, но каждый тик читает только чаты,
+    # которым пора по активности (ChatScheduler), в пределах бюджета аккаунта
+    from backend.services.chat_scheduler import PARSER_SCHEDULER_TICK_MINUTES
     scheduler.start()
     scheduler.add_job(
-        parser_service.parse_all_accounts,
+        worker_pool.parse_scheduled if worker_pool.enabled else parser_service.parse_scheduled,
         'interval',
-        minutes=30,
+        minutes=PARSER_SCHEDULER_TICK_MINUTES,
         id='hourly_parse',
         replace_existing=True,
         max_instances=1,
         coalesce=True,
         misfire_grace_time=300
     )
-    print("✅ Scheduler started — batch fallback every 30 min", flush=True)
+    print(f"✅ Scheduler started — activity-based batch tick every {PARSER_SCHEDULER_TICK_MINUTES} min", flush=True)
     
     # Запуск real-time сервиса
-    try:
-        await realtime_service.start()
-        print("✅ Realtime service started — messages arrive instantly\n", flush=True)
-    except Exception as e:
-        print(f"⚠️ Realtime service failed to start: {e}", flush=True)
-        print("   Batch parsing will still work as fallback\n", flush=True)
+    if worker_pool.enabled:
+        print(f"✅ Realtime runs in {worker_pool.count} worker process(es)\n", flush=True)
+    else:
+        try:
+            await realtime_service.start()
+            print("✅ Realtime service started — messages arrive instantly\n", flush=True)
+        except Exception as e:
+            print(f"⚠️ Realtime service failed to start: {e}", flush=True)
+            print("   Batch parsing will still work as fallback\n", flush=True)
+
+    # Аренды аккаунтов между узлами: продлеваем свои, подбираем свободные
+    # и просроченные; при смене набора перезапускаем realtime / перешардируем
+    from backend.services.account_leases import account_leases
+    from backend.services.client_pool import client_pool
+
+    async def on_leases_changed(lost: set):
+        if worker_pool.enabled:
+            # Воркеры сами закрывают клиенты аккаунтов, ушедших из assign
+            await worker_pool.rebalance()
+            return
+        await realtime_service.restart()
+        # Аккаунт теперь работает другой узел — второе подключение той же
+        # сессии здесь держать нельзя
+        for phone in lost:
+            await client_pool.close(phone)
+
+    account_leases.on_change(on_leases_changed)
+    account_leases.start(parser_service.account_storage.get_all_connected_accounts)
+    print(f"✅ Account leases: node {account_leases.node_id}", flush=True)
     
     yield
     
     # Остановка при завершении
     print("\nShutting down backend...", flush=True)
+    await worker_pool.stop()
     await realtime_service.stop()
+    # Сессии закрыты — аккаунты можно сразу отдать другим узлам
+    await account_leases.stop()
+    await profile_resolver.stop()
+    await client_pool.close_all()
+    from backend.services.profile_cache import profile_cache
+    profile_cache.flush()
     # Clients are stopped now, so session files are consistent — back them up.
     try:
         from backend.database import state_persistence
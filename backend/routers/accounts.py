@@ -3,6 +3,10 @@ from pydantic import BaseModel
 from backend.services.telegram_service import TelegramService
 from backend.database.account_storage import AccountStorage
 from backend.database import state_persistence
+from backend.database.db_executor import run_blocking
+from backend.services.client_pool import client_pool, is_auth_error
+from backend.services.dialog_cache import dialog_cache
+from backend.services.worker_pool import worker_pool
 import os
 import shutil
 
@@ -74,12 +78,7 @@ async def add_account(account_data: AccountCreateRequest):
         name = (account_data.name or "").strip() if account_data.name else None
         
         # Проверяем, существует ли аккаунт с таким номером
-        existing_account = None
-        all_accounts = account_storage.get_all_accounts()
-        for acc in all_accounts:
-            if acc.get("phone_number") == phone:
-                existing_account = acc
-                break
+        existing_account = account_storage.get_account_by_phone(phone)
         
         if existing_account:
             # Если аккаунт существует и не подключен, пытаемся запросить новый код
@@ -219,7 +218,7 @@ async def verify_code(request: VerifyCodeRequest):
         if success:
             account_storage.update_account_connection(request.account_id, True)
             # Persist the freshly created session to Supabase so it survives rebuilds.
-            state_persistence.backup_session(account["phone_number"])
+            await run_blocking(state_persistence.backup_session, account["phone_number"])
             return {"status": "success", "message": "Account connected successfully"}
         else:
             raise HTTPException(status_code=400, detail="Verification failed")
@@ -296,6 +295,12 @@ async def upload_session(
         # Создаем папку sessions если нет
         os.makedirs("sessions", exist_ok=True)
         
+        # Пул держит старую сессию открытой — закрываем перед заменой файла
+        await client_pool.close(phone)
+        if worker_pool.started:
+            await worker_pool.release(phone)
+        dialog_cache.invalidate(phone)
+        
         # Формируем имя файла сессии
         phone_clean = phone.replace("+", "")
         session_filename = f"{phone_clean}.session"
@@ -366,12 +371,7 @@ async def upload_session(
             print(f"Session valid! User: {me.first_name} (@{me.username})", file=sys.stderr, flush=True)
             
             # Проверяем существующий аккаунт
-            existing_account = None
-            all_accounts = account_storage.get_all_accounts()
-            for acc in all_accounts:
-                if acc.get("phone_number") == phone:
-                    existing_account = acc
-                    break
+            existing_account = account_storage.get_account_by_phone(phone)
             
             if existing_account:
                 # Обновляем существующий аккаунт
@@ -392,7 +392,7 @@ async def upload_session(
                 print(f"Created new account {account_id}", file=sys.stderr, flush=True)
 
             # Persist the uploaded session to Supabase so it survives rebuilds.
-            state_persistence.backup_session(phone)
+            await run_blocking(state_persistence.backup_session, phone)
 
             return {
                 "status": "success",
@@ -454,6 +454,10 @@ async def delete_account(account_id: int):
         # Получаем путь к файлу сессии для удаления
         phone_number = account.get("phone_number")
         if phone_number:
+            await client_pool.close(phone_number)
+            if worker_pool.started:
+                await worker_pool.release(phone_number)
+            dialog_cache.invalidate(phone_number)
             from backend.services.telegram_service import TelegramService
             telegram_service = TelegramService()
             session_path = telegram_service.get_session_path(phone_number)
@@ -495,40 +499,36 @@ async def check_account_status(account_id: int):
             return {"is_connected": False, "status": "no_session"}
         
         # Пробуем подключиться с существующей сессией (без запроса кода!)
-        from pyrogram import Client
-        import asyncio
-        
-        client = None
+        # через общий пул — если клиент уже подключён, это один get_me().
         try:
-            client = Client(
-                f"sessions/{phone_clean}",
-                api_id=int(account["api_id"]),
-                api_hash=account["api_hash"]
-            )
-            
-            await client.start()
-            me = await client.get_me()
-            await client.stop()
-            
-            # Даём время на освобождение файла
-            await asyncio.sleep(0.5)
+            if worker_pool.started:
+                # Сессию держит воркер аккаунта — проверяем через него
+                me = await worker_pool.call_owner(
+                    phone, "get_me", api_id=account["api_id"], api_hash=account["api_hash"]
+                )
+                first_name = me["first_name"]
+            else:
+                async with client_pool.lease(account["api_id"], account["api_hash"], phone) as client:
+                    me = await client.get_me()
+                first_name = me.first_name
             
-            print(f"check-status: Session valid for {phone} - {me.first_name}", file=sys.stderr, flush=True)
+            print(f"check-status: Session valid for {phone} - {first_name}", file=sys.stderr, flush=True)
             account_storage.update_account_connection(account_id, True)
-            # Session re-validated and stopped — capture any refresh to Supabase.
-            state_persistence.backup_session(phone)
-            return {"is_connected": True, "status": "connected", "user": me.first_name}
+            # Session re-validated — capture any refresh to Supabase
+            # (online SQLite backup, safe while the client is running).
+            await run_blocking(state_persistence.backup_session, phone)
+            return {"is_connected": True, "status": "connected", "user": first_name}
             
         except Exception as e:
             error_msg = str(e)
+            if not is_auth_error(e):
+                # FloodWait, сеть: сессия цела, общий клиент (и realtime на нём) не трогаем
+                print(f"check-status: Check failed for {phone}: {error_msg}", file=sys.stderr, flush=True)
+                return {"is_connected": bool(account.get("is_connected")), "status": "check_failed", "message": error_msg}
             print(f"check-status: Session invalid for {phone}: {error_msg}", file=sys.stderr, flush=True)
             
-            # Закрываем клиент если открыт
-            if client:
-                try:
-                    await client.stop()
-                except:
-                    pass
+            # Невалидный клиент не оставляем в пуле
+            await client_pool.close(phone)
             
             # НЕ удаляем сессию и НЕ запрашиваем код - просто сообщаем статус
             account_storage.update_account_connection(account_id, False)
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from typing import List
 from backend.services.telegram_service import TelegramService
 from backend.database.account_storage import AccountStorage
+from backend.services.worker_pool import worker_pool
 
 router = APIRouter()
 telegram_service = TelegramService()
@@ -13,8 +14,8 @@ class ChatSelectRequest(BaseModel):
     chat_ids: List[int]
 
 @router.get("/{account_id}")
-async def get_chats(account_id: int):
-    """Получает список чатов для аккаунта"""
+async def get_chats(account_id: int, refresh: bool = False):
+    """Получает список чатов для аккаунта (из кэша диалогов; refresh=true — перечитать из Telegram)"""
     try:
         account = account_storage.get_account(account_id)
         if not account:
@@ -23,11 +24,19 @@ async def get_chats(account_id: int):
         if not account.get("is_connected"):
             raise HTTPException(status_code=400, detail="Account is not connected")
         
-        chats = await telegram_service.get_chats(
-            account["api_id"],
-            account["api_hash"],
-            account["phone_number"]
-        )
+        if worker_pool.started:
+            # Сессию аккаунта держит его воркер — спрашиваем через него
+            chats = await worker_pool.call_owner(
+                account["phone_number"], "get_chats",
+                api_id=account["api_id"], api_hash=account["api_hash"], force_refresh=refresh
+            )
+        else:
+            chats = await telegram_service.get_chats(
+                account["api_id"],
+                account["api_hash"],
+                account["phone_number"],
+                force_refresh=refresh
+            )
         
         return {"chats": chats}
     
@@ -1,11 +1,14 @@
 from fastapi import APIRouter, HTTPException, Request
 from backend.services.parser_service import ParserService
-from backend.database.supabase_client import SupabaseClient
+from backend.services.worker_pool import worker_pool
+from backend.services.response_cache import RESPONSE_CACHE_STATUS_TTL_SECONDS, response_cache
+from backend.services.event_bus import EVENTS_HEARTBEAT_SECONDS, EVENTS_MIN_INTERVAL_MS, event_bus
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
 import sys
 
 router = APIRouter()
-supabase_client = SupabaseClient()
-parser_service = ParserService(supabase_client)
 
 
 # ── Realtime endpoints ──────────────────────────────────────────────
@@ -51,15 +54,56 @@ async def realtime_restart(request: Request):
     await rt.restart()
     return {"status": "success", "message": "Realtime restarted"}
 
+@router.get("/limits")
+async def get_limits():
+    """Состояние flood-лимитеров: бакеты по (аккаунт, метод API)"""
+    if worker_pool.started:
+        return {"limits": await worker_pool.merged("limits")}
+    from backend.services.rate_limiter import flood_limiter
+    return {"limits": flood_limiter.status()}
+
+def _parser_service(request: Request) -> ParserService:
+    """Сервис из main.py — тот же, что у планировщика и realtime."""
+    ps = getattr(request.app.state, 'parser_service', None)
+    if not ps:
+        raise HTTPException(status_code=500, detail="Parser service not initialized")
+    return ps
+
+@router.get("/schedule/chats")
+async def get_chat_schedule(request: Request):
+    """Активность чатов и последний выбор планировщика (сервис из main.py)"""
+    if worker_pool.started:
+        return await worker_pool.merged("schedule")
+    return _parser_service(request).chat_scheduler.status()
+
+@router.get("/workers")
+async def get_workers():
+    """Процессы-воркеры (PARSER_WORKERS > 0): аккаунты, живость, перезапуски"""
+    if not worker_pool.started:
+        return {"enabled": False, "workers": []}
+    return {"enabled": True, **worker_pool.status()}
+
+@router.get("/leases")
+async def get_leases():
+    """Аренды аккаунтов этого узла и чужие владельцы (несколько реплик)"""
+    from backend.services.account_leases import account_leases
+    return account_leases.status()
+
 @router.post("/start")
-async def start_parsing():
+async def start_parsing(request: Request):
     """Запускает парсинг для всех подключенных аккаунтов"""
+    is_running = worker_pool.is_parsing() if worker_pool.started else _parser_service(request).is_running()
+    if is_running:
+        raise HTTPException(status_code=409, detail="Parsing is already running")
     try:
         print("\n" + "="*60, file=sys.stderr, flush=True)
         print("PARSER START REQUEST RECEIVED", file=sys.stderr, flush=True)
         print("="*60 + "\n", file=sys.stderr, flush=True)
         
-        await parser_service.parse_all_accounts()
+        if worker_pool.started:
+            await worker_pool.parse_all()
+        else:
+            await _parser_service(request).parse_all_accounts()
         
         print("\n" + "="*60, file=sys.stderr, flush=True)
         print("PARSER COMPLETED SUCCESSFULLY", file=sys.stderr, flush=True)
@@ -73,24 +117,89 @@ async def start_parsing():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/status")
-async def get_status():
-    """Получает статус парсера"""
-    is_running = parser_service.is_running()
+async def get_status(request: Request):
+    """Получает статус парсера (кэш + ETag: опрашивается каждой вкладкой)"""
+    async def produce():
+        is_running = worker_pool.is_parsing() if worker_pool.started else _parser_service(request).is_running()
+        return {
+            "is_running": is_running,
+            "status": "running" if is_running else "idle",
+            "message": "Parser is running" if is_running else "Parser is idle"
+        }
+    return await response_cache.respond(request, produce, RESPONSE_CACHE_STATUS_TTL_SECONDS, tags=("parser",))
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def _realtime_snapshot(status: dict) -> dict:
     return {
-        "is_running": is_running,
-        "status": "running" if is_running else "idle",
-        "message": "Parser is running" if is_running else "Parser is idle"
+        "running": status.get("running", False),
+        "accounts": status.get("accounts", 0),
+        "messages_received": status.get("messages_received", 0),
+        "errors": len(status.get("recent_errors", [])),
+        "last_error": (status.get("recent_errors") or [None])[-1],
     }
 
+def _snapshot(request: Request) -> list:
+    """Начальное состояние для нового подписчика: по событию на источник
+    (в режиме воркеров — на каждого воркера, с полем worker)."""
+    if worker_pool.started:
+        events = []
+        for worker in worker_pool.workers:
+            events.append(("parser", {"is_running": bool(worker.status.get("parser_running")),
+                                      "worker": worker.index}))
+            events.append(("realtime", {**_realtime_snapshot(worker.status.get("realtime") or {}),
+                                        "worker": worker.index}))
+        return events
+    rt = getattr(request.app.state, 'realtime_service', None)
+    ps = getattr(request.app.state, 'parser_service', None)
+    return [
+        ("parser", {"is_running": bool(ps and ps.is_running())}),
+        ("realtime", _realtime_snapshot(rt.status() if rt else {})),
+    ]
+
+@router.get("/events")
+async def stream_events(request: Request):
+    """Живые события (SSE) вместо опроса /status и /realtime/status:
+    parser, chat, run_finished, realtime. Схлопываются по клиенту —
+    не чаще раза в EVENTS_MIN_INTERVAL_MS, по последнему на ключ."""
+    async def stream():
+        subscription = event_bus.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            for event, data in _snapshot(request):
+                yield _sse(event, data)
+            while True:
+                events = await subscription.next(EVENTS_HEARTBEAT_SECONDS)
+                if await request.is_disconnected():
+                    break
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(_sse(event, data) for event, _, data in events)
+                await asyncio.sleep(EVENTS_MIN_INTERVAL_MS / 1000)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx перед бэкендом не должен копить поток
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/stop")
-async def stop_parsing():
+async def stop_parsing(request: Request):
     """Останавливает текущий процесс парсинга"""
     try:
         print("\n" + "="*60, file=sys.stderr, flush=True)
         print("PARSER STOP REQUEST RECEIVED", file=sys.stderr, flush=True)
         print("="*60 + "\n", file=sys.stderr, flush=True)
         
-        stopped = parser_service.stop_parsing()
+        if worker_pool.started:
+            stopped = await worker_pool.stop_parsing()
+        else:
+            stopped = _parser_service(request).stop_parsing()
         
         if stopped:
             return {"status": "success", "message": "Parser stop signal sent"}
@@ -103,6 +212,11 @@ async def stop_parsing():
 @router.get("/schedule/status")
 async def get_schedule_status(request: Request):
     """Получает статус автоматического парсинга и realtime"""
+    return await response_cache.respond(
+        request, lambda: _schedule_status(request), RESPONSE_CACHE_STATUS_TTL_SECONDS, tags=("schedule",)
+    )
+
+async def _schedule_status(request: Request) -> dict:
     try:
         auto_parsing_enabled = getattr(request.app.state, 'auto_parsing_enabled', True)
         scheduler = getattr(request.app.state, 'scheduler', None)
@@ -143,6 +257,7 @@ async def pause_schedule(request: Request):
         if job:
             scheduler.pause_job('hourly_parse')
             request.app.state.auto_parsing_enabled = False
+            response_cache.invalidate("schedule")
             print("✅ Auto-parsing PAUSED", file=sys.stderr, flush=True)
             return {
                 "status": "success",
@@ -176,6 +291,7 @@ async def resume_schedule(request: Request):
         if job:
             scheduler.resume_job('hourly_parse')
             request.app.state.auto_parsing_enabled = True
+            response_cache.invalidate("schedule")
             next_run = job.next_run_time.isoformat() if job.next_run_time else "calculating..."
             print(f"✅ Auto-parsing RESUMED. Next run: {next_run}", file=sys.stderr, flush=True)
             return {
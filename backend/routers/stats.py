@@ -1,9 +1,34 @@
 from fastapi import APIRouter, HTTPException, Request
-from typing import Optional
+from typing import List, Optional
 from backend.database.supabase_client import SupabaseClient
+from backend.database.db_executor import run_blocking
+from backend.services.response_cache import RESPONSE_CACHE_STATS_TTL_SECONDS, response_cache
+import base64
+import json
 
 router = APIRouter()
 
+# Колонки parsing_logs и готовые наборы для ?fields= (или список через запятую)
+PARSING_LOG_COLUMNS = [
+    "id", "parsing_session_id", "started_at", "finished_at", "phone_number", "chat_id",
+    "chat_name", "messages_found", "messages_saved", "messages_skipped", "status",
+    "error_type", "error_message", "hours_back", "execution_time_seconds", "created_at",
+]
+PARSING_LOG_FIELD_SETS = {
+    "full": PARSING_LOG_COLUMNS,
+    "summary": [
+        "id", "started_at", "phone_number", "chat_id", "chat_name", "messages_found",
+        "messages_saved", "messages_skipped", "status", "execution_time_seconds",
+    ],
+    "errors": [
+        "id", "parsing_session_id", "started_at", "phone_number", "chat_id", "chat_name",
+        "status", "error_type", "error_message",
+    ],
+}
+MAX_PAGE_SIZE = 1000
+# compact=true: длинные error_message обрезаются до стольких символов
+COMPACT_ERROR_MESSAGE_CHARS = 200
+
 # Глобальный клиент Supabase (будет инициализирован в main.py)
 supabase_client: Optional[SupabaseClient] = None
 
@@ -11,28 +36,105 @@ def set_supabase_client(client: SupabaseClient):
     global supabase_client
     supabase_client = client
 
+def _select_columns(fields: Optional[str], default: str) -> List[str]:
+    """Колонки по ?fields=: имя набора или список через запятую.
+    started_at и id добавляются всегда — на них держится курсор."""
+    if not fields:
+        fields = default
+    if fields in PARSING_LOG_FIELD_SETS:
+        columns = list(PARSING_LOG_FIELD_SETS[fields])
+    else:
+        columns = [c.strip() for c in fields.split(",") if c.strip()]
+        unknown = [c for c in columns if c not in PARSING_LOG_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    for key in ("id", "started_at"):
+        if key not in columns:
+            columns.insert(0, key)
+    return columns
+
+
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["started_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        started_at, row_id = json.loads(raw)
+        return str(started_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _page_parsing_logs(query, columns: List[str], limit: int, cursor: Optional[str],
+                             compact: bool, key: str) -> dict:
+    """Страница parsing_logs по ключу (started_at, id), новые сверху.
+
+    Следующая страница — ?cursor=<next_cursor>: она начинается строго после
+    последней строки этой, без OFFSET, поэтому стоит одинаково на любой
+    глубине истории и не сбивается, когда сверху дописываются новые логи."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        started_at, row_id = _decode_cursor(cursor)
+        query = query.or_(f'started_at.lt."{started_at}",'
+                          f'and(started_at.eq."{started_at}",id.lt.{row_id})')
+    # На строку больше — чтобы знать, есть ли следующая страница
+    query = query.order('started_at', desc=True).order('id', desc=True).limit(limit + 1)
+    result = await run_blocking(query.execute)
+
+    rows = result.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    response = {
+        "success": True,
+        "count": len(rows),
+        "has_more": has_more,
+        "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+    }
+    if compact:
+        # Колонки один раз, строки — массивами; длинные тексты ошибок обрезаны
+        for row in rows:
+            message = row.get("error_message")
+            if message and len(message) > COMPACT_ERROR_MESSAGE_CHARS:
+                row["error_message"] = message[:COMPACT_ERROR_MESSAGE_CHARS] + "…"
+        response["columns"] = columns
+        response[key] = [[row.get(c) for c in columns] for row in rows]
+    else:
+        response[key] = rows
+    return response
+
+
 @router.get("/parsing-stats")
 async def get_parsing_stats(
     limit: int = 100,
     session_id: Optional[str] = None,
     phone_number: Optional[str] = None,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    compact: bool = False
 ):
     """
     Получает статистику парсинга
     
     Параметры:
-    - limit: количество записей (по умолчанию 100)
+    - limit: количество записей (по умолчанию 100, не больше 1000)
     - session_id: фильтр по ID сессии
     - phone_number: фильтр по номеру телефона
     - status: фильтр по статусу ('success', 'error', 'skipped')
+    - cursor: next_cursor предыдущей страницы
+    - fields: 'full' (по умолчанию), 'summary', 'errors' или колонки через запятую
+    - compact: columns + строки массивами, error_message обрезан
     """
     if not supabase_client or not supabase_client.client:
         raise HTTPException(status_code=503, detail="Supabase not available")
     
+    columns = _select_columns(fields, "full")
     try:
         # Базовый запрос
-        query = supabase_client.client.table('parsing_logs').select("*")
+        query = supabase_client.client.table('parsing_logs').select(",".join(columns))
         
         # Применяем фильтры
         if session_id:
@@ -42,109 +144,59 @@ async def get_parsing_stats(
         if status:
             query = query.eq('status', status)
         
-        # Сортировка по времени (новые сверху)
-        query = query.order('started_at', desc=True).limit(limit)
-        
-        result = query.execute()
-        
-        return {
-            "success": True,
-            "count": len(result.data),
-            "logs": result.data
-        }
+        return await _page_parsing_logs(query, columns, limit, cursor, compact, "logs")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting parsing stats: {e}", flush=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/parsing-sessions")
-async def get_parsing_sessions(limit: int = 50):
+async def get_parsing_sessions(request: Request, limit: int = 50):
     """
     Получает список уникальных сессий парсинга с агрегированной статистикой
+    (кэш + ETag: дашборды опрашивают каждые 30 с, Supabase — раз за TTL)
     """
     if not supabase_client or not supabase_client.client:
         raise HTTPException(status_code=503, detail="Supabase not available")
     
-    try:
-        # Получаем все логи
-        result = supabase_client.client.table('parsing_logs')\
-            .select("*")\
-            .order('started_at', desc=True)\
-            .limit(limit * 10)\
-            .execute()
-        
-        # Группируем по session_id
-        sessions_dict = {}
-        for log in result.data:
-            session_id = log['parsing_session_id']
-            if session_id not in sessions_dict:
-                sessions_dict[session_id] = {
-                    'session_id': session_id,
-                    'started_at': log['started_at'],
-                    'total_chats': 0,
-                    'total_messages': 0,
-                    'success_count': 0,
-                    'error_count': 0,
-                    'skipped_count': 0,
-                    'accounts': set(),
-                    'errors': []
-                }
+    async def produce():
+        try:
+            # Итоги прогонов из parsing_sessions — ровно limit готовых строк
+            sessions = await supabase_client.fetch_parsing_sessions_async(limit)
             
-            session = sessions_dict[session_id]
-            session['total_chats'] += 1
-            session['total_messages'] += log.get('messages_saved', 0)
-            session['accounts'].add(log['phone_number'])
-            
-            if log['status'] == 'success':
-                session['success_count'] += 1
-            elif log['status'] == 'error':
-                session['error_count'] += 1
-                session['errors'].append({
-                    'chat_name': log['chat_name'],
-                    'error_type': log.get('error_type'),
-                    'error_message': log.get('error_message')
-                })
-            elif log['status'] == 'skipped':
-                session['skipped_count'] += 1
-        
-        # Преобразуем set в list для JSON сериализации
-        sessions = []
-        for session in sessions_dict.values():
-            session['accounts'] = list(session['accounts'])
-            sessions.append(session)
-        
-        # Сортируем по времени
-        sessions.sort(key=lambda x: x['started_at'], reverse=True)
-        
-        return {
-            "success": True,
-            "count": len(sessions[:limit]),
-            "sessions": sessions[:limit]
-        }
-    except Exception as e:
-        print(f"Error getting parsing sessions: {e}", flush=True)
-        raise HTTPException(status_code=500, detail=str(e))
+            return {
+                "success": True,
+                "count": len(sessions),
+                "sessions": sessions
+            }
+        except Exception as e:
+            print(f"Error getting parsing sessions: {e}", flush=True)
+            raise HTTPException(status_code=500, detail=str(e))
+    return await response_cache.respond(request, produce, RESPONSE_CACHE_STATS_TTL_SECONDS, tags=("sessions",))
 
 @router.get("/parsing-stats/errors")
-async def get_parsing_errors(limit: int = 100):
+async def get_parsing_errors(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    compact: bool = False
+):
     """
-    Получает только записи с ошибками
+    Получает только записи с ошибками (cursor/fields/compact — как у /parsing-stats,
+    но fields по умолчанию 'errors')
     """
     if not supabase_client or not supabase_client.client:
         raise HTTPException(status_code=503, detail="Supabase not available")
     
+    columns = _select_columns(fields, "errors")
     try:
-        result = supabase_client.client.table('parsing_logs')\
-            .select("*")\
-            .in_('status', ['error', 'skipped'])\
-            .order('started_at', desc=True)\
-            .limit(limit)\
-            .execute()
-        
-        return {
-            "success": True,
-            "count": len(result.data),
-            "errors": result.data
-        }
+        query = supabase_client.client.table('parsing_logs')\
+            .select(",".join(columns))\
+            .in_('status', ['error', 'skipped'])
+        return await _page_parsing_logs(query, columns, limit, cursor, compact, "errors")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting parsing errors: {e}", flush=True)
         raise HTTPException(status_code=500, detail=str(e))
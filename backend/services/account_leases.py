@@ -0,0 +1,387 @@
+"""
+Account ownership leases between backend nodes.
+
+Every node restores the same accounts and session files from parser_state,
+so two replicas would both connect every account: duplicate realtime
+traffic and batch reads, and two live connections on one session. A node
+now only works an account while it holds that account's lease:
+
+- a lease is a parser_state row `lease:<phone>` whose content is
+  {"node": ..., "expires_at": ..., "heartbeat_at": ...};
+- it is created with a plain INSERT (the primary key decides a race) and
+  renewed or taken over with a compare-and-swap UPDATE (`content` must
+  still be what the node last read), so two nodes can never both win;
+- the holder renews its leases every ACCOUNT_LEASE_HEARTBEAT_SECONDS, a
+  lease not renewed for ACCOUNT_LEASE_TTL_SECONDS is free to take, which is
+  also how a dead node's accounts fail over; acquire() calls in between
+  (filter_accounts runs on every rebalance) skip the write while more than
+  ACCOUNT_LEASE_RENEW_BELOW_SECONDS of a held lease are left;
+- on every heartbeat a node also tries to claim unowned connected accounts;
+  whenever an acquire() — from the heartbeat or from filter_accounts() —
+  changes the node's set of accounts, its listeners (realtime restart /
+  worker rebalance) are told in the background, one change at a time;
+  shutdown releases the leases at once.
+
+Without SUPABASE_URL/KEY (or with ACCOUNT_LEASE_STORE=local) the rows live
+in a local JSON file under an flock instead — enough for several nodes
+sharing one volume. ACCOUNT_LEASES=0 turns leasing off: every account is
+worked, as before.
+
+The store being unreachable does not stop ingesting at once: a held lease
+is worked until the expires_at of its last successful renewal, then dropped
+(listeners are told), since by then another node may have taken it over. A
+node that never reached the store owns nothing, unless
+ACCOUNT_LEASE_FAIL_OPEN=1 — then all accounts count as its own until it
+does, for single-node setups that would rather duplicate than stall.
+"""
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from backend.database.db_executor import run_blocking
+from backend.database.file_lock import file_lock
+
+ACCOUNT_LEASES_ENABLED = os.getenv("ACCOUNT_LEASES", "1") != "0"
+ACCOUNT_LEASE_TTL_SECONDS = int(os.getenv("ACCOUNT_LEASE_TTL_SECONDS", "90"))
+ACCOUNT_LEASE_HEARTBEAT_SECONDS = max(1, ACCOUNT_LEASE_TTL_SECONDS // 3)
+# A held lease is rewritten only once less than this is left (2/3 of the TTL).
+ACCOUNT_LEASE_RENEW_BELOW_SECONDS = ACCOUNT_LEASE_TTL_SECONDS * 2 / 3
+ACCOUNT_LEASE_STORE = os.getenv("ACCOUNT_LEASE_STORE", "auto")  # auto | supabase | local
+ACCOUNT_LEASE_FAIL_OPEN = os.getenv("ACCOUNT_LEASE_FAIL_OPEN", "0") == "1"
+LOCAL_LEASES_FILE = "leases.json"
+NODE_ID = os.getenv("PARSER_NODE_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+LEASE_KEY_PREFIX = "lease:"
+
+
+def _log(msg: str) -> None:
+    print(f">>> [leases] {msg}", file=sys.stderr, flush=True)
+
+
+class LeaseStoreError(Exception):
+    """Хранилище аренд недоступно."""
+
+
+class _SupabaseLeaseStore:
+    """Строки parser_state; CAS через UPDATE ... WHERE content = old."""
+
+    def __init__(self):
+        from backend.database import state_persistence
+        self._persistence = state_persistence
+
+    def _table(self):
+        client = self._persistence._get_client()
+        if client is None:
+            raise LeaseStoreError("Supabase is not configured")
+        return client.table(self._persistence.TABLE)
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            rows = self._table().select("content").eq("key", key).limit(1).execute().data or []
+        except LeaseStoreError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            raise LeaseStoreError(str(e)) from e
+        return rows[0]["content"] if rows else None
+
+    def create(self, key: str, content: str) -> bool:
+        table = self._table()
+        try:
+            table.insert({"key": key, "content": content}).execute()
+            return True
+        except Exception as e:  # noqa: BLE001
+            if "duplicate" in str(e).lower() or "23505" in str(e):
+                return False
+            raise LeaseStoreError(str(e)) from e
+
+    def swap(self, key: str, old: str, new: str) -> bool:
+        table = self._table()
+        try:
+            rows = table.update({"content": new}).eq("key", key).eq("content", old).execute().data or []
+        except Exception as e:  # noqa: BLE001
+            raise LeaseStoreError(str(e)) from e
+        return bool(rows)
+
+    def delete(self, key: str, old: str) -> None:
+        table = self._table()
+        try:
+            table.delete().eq("key", key).eq("content", old).execute()
+        except Exception as e:  # noqa: BLE001
+            raise LeaseStoreError(str(e)) from e
+
+
+class _FileLeaseStore:
+    """Локальная замена parser_state: JSON-файл под flock."""
+
+    def __init__(self, path: str = LOCAL_LEASES_FILE):
+        self.path = path
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data: Dict[str, str]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[str]:
+        with file_lock(self.path):
+            return self._read().get(key)
+
+    def create(self, key: str, content: str) -> bool:
+        with file_lock(self.path):
+            data = self._read()
+            if key in data:
+                return False
+            data[key] = content
+            self._write(data)
+            return True
+
+    def swap(self, key: str, old: str, new: str) -> bool:
+        with file_lock(self.path):
+            data = self._read()
+            if data.get(key) != old:
+                return False
+            data[key] = new
+            self._write(data)
+            return True
+
+    def delete(self, key: str, old: str) -> None:
+        with file_lock(self.path):
+            data = self._read()
+            if data.get(key) == old:
+                del data[key]
+                self._write(data)
+
+
+def _make_store():
+    if ACCOUNT_LEASE_STORE == "local":
+        return _FileLeaseStore()
+    if ACCOUNT_LEASE_STORE == "supabase" or (os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY")):
+        return _SupabaseLeaseStore()
+    return _FileLeaseStore()
+
+
+def _safe_phone(phone: str) -> str:
+    return phone.replace("+", "").replace("-", "").replace(" ", "")
+
+
+def _expires_at(content: str) -> float:
+    try:
+        return json.loads(content).get("expires_at", 0)
+    except ValueError:
+        return 0
+
+
+class AccountLeases:
+    def __init__(self, node_id: str = NODE_ID, enabled: bool = ACCOUNT_LEASES_ENABLED):
+        self.node_id = node_id
+        self.enabled = enabled
+        self._store = None
+        # phone -> content строки аренды, как мы её записали
+        self._held: Dict[str, str] = {}
+        self._owners: Dict[str, Optional[str]] = {}  # phone -> узел-владелец (последнее чтение)
+        self._store_ok: Optional[bool] = None
+        self._reached_store = False
+        self._listeners: List[Callable[[Set[str]], Awaitable[None]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._notify_task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.takeovers = 0
+        self.lost = 0
+
+    def on_change(self, listener: Callable[[Set[str]], Awaitable[None]]) -> None:
+        """listener(lost) вызывается, когда меняется набор аккаунтов узла;
+        lost — телефоны, аренду которых узел потерял или отпустил."""
+        self._listeners.append(listener)
+
+    # ── one lease ────────────────────────────────────────────────────
+
+    def _content(self) -> str:
+        now = time.time()
+        return json.dumps({
+            "node": self.node_id,
+            "heartbeat_at": now,
+            "expires_at": now + ACCOUNT_LEASE_TTL_SECONDS,
+        })
+
+    def _claim_sync(self, phone: str) -> bool:
+        """Берёт или продлевает аренду. Бросает LeaseStoreError."""
+        key = LEASE_KEY_PREFIX + _safe_phone(phone)
+        mine = self._held.get(phone)
+        if mine is not None and _expires_at(mine) - time.time() > ACCOUNT_LEASE_RENEW_BELOW_SECONDS:
+            return True  # продлевали только что — CAS не нужен
+        if mine is not None and self._store.swap(key, mine, new := self._content()):
+            self._held[phone] = new
+            return True
+
+        current = self._store.get(key)
+        if current is None:
+            new = self._content()
+            if self._store.create(key, new):
+                self._held[phone] = new
+                self._owners[phone] = self.node_id
+                return True
+            current = self._store.get(key)
+            if current is None:
+                return False
+        try:
+            lease = json.loads(current)
+        except ValueError:
+            lease = {}
+        self._owners[phone] = lease.get("node")
+        if lease.get("node") != self.node_id and lease.get("expires_at", 0) > time.time():
+            return False
+        new = self._content()
+        if not self._store.swap(key, current, new):
+            return False
+        if lease.get("node") != self.node_id:
+            self.takeovers += 1
+            _log(f"{phone}: took over expired lease of {lease.get('node')}")
+        self._held[phone] = new
+        self._owners[phone] = self.node_id
+        return True
+
+    def _drop_expired(self) -> None:
+        """Хранилище недоступно: выбрасывает аренды, которые истекут раньше
+        следующего heartbeat — продлить их мы уже не успеем."""
+        deadline = time.time() + ACCOUNT_LEASE_HEARTBEAT_SECONDS
+        for phone, content in list(self._held.items()):
+            if _expires_at(content) <= deadline:
+                del self._held[phone]
+                self.lost += 1
+                _log(f"{phone}: lease not renewed since the store is unavailable — dropped")
+
+    def _release_sync(self, phone: str) -> None:
+        content = self._held.pop(phone, None)
+        if content is not None:
+            self._store.delete(LEASE_KEY_PREFIX + _safe_phone(phone), content)
+
+    # ── accounts ─────────────────────────────────────────────────────
+
+    async def acquire(self, phones: Iterable[str]) -> Set[str]:
+        """Пытается взять аренды на phones, отпускает аренды аккаунтов,
+        которых больше нет. Возвращает телефоны, которыми узел владеет."""
+        phones = [p for p in phones if p]
+        if not self.enabled:
+            return set(phones)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._store is None:
+                self._store = _make_store()
+            before = set(self._held)
+            wanted = set(phones)
+            try:
+                for phone in [p for p in self._held if p not in wanted]:
+                    await run_blocking(self._release_sync, phone)
+                for phone in phones:
+                    if not await run_blocking(self._claim_sync, phone):
+                        if phone in self._held:
+                            self.lost += 1
+                            _log(f"{phone}: lease lost to {self._owners.get(phone)}")
+                        self._held.pop(phone, None)
+                if self._store_ok is not True:
+                    _log(f"node {self.node_id} holds {len(self._held)} of {len(phones)} account lease(s)")
+                self._store_ok = True
+                self._reached_store = True
+            except LeaseStoreError as e:
+                if self._store_ok is not False:
+                    _log(f"lease store unavailable ({e}) — keeping leases until they expire")
+                self._store_ok = False
+                self._drop_expired()
+            after = set(self._held)
+        if after != before:
+            _log(f"accounts of node changed: {sorted(before)} -> {sorted(after)}")
+            self._notify(before - after)
+        if ACCOUNT_LEASE_FAIL_OPEN and not self._reached_store:
+            return set(phones)  # хранилище ни разу не ответило — работаем как один узел
+        return set(self._held) & set(phones)
+
+    def _notify(self, lost: Set[str]) -> None:
+        """Сообщает слушателям о смене набора аккаунтов. В фоне: слушатель
+        сам зовёт filter_accounts (restart / rebalance), а вызвавший acquire
+        ещё не закончил свою работу с результатом. Уведомления идут по одному."""
+        if not self._listeners:
+            return
+        self._notify_task = asyncio.create_task(self._run_listeners(self._notify_task, lost))
+
+    async def _run_listeners(self, previous: Optional[asyncio.Task], lost: Set[str]) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        for listener in self._listeners:
+            try:
+                await listener(lost)
+            except Exception as e:  # noqa: BLE001
+                _log(f"listener failed: {e}")
+
+    async def filter_accounts(self, accounts: List[dict]) -> List[dict]:
+        """Аккаунты, которые этот узел держит в аренде."""
+        if not self.enabled:
+            return accounts
+        owned = await self.acquire([a.get("phone_number") for a in accounts])
+        return [a for a in accounts if a.get("phone_number") in owned]
+
+    # ── heartbeat ────────────────────────────────────────────────────
+
+    def start(self, accounts: Callable[[], List[dict]]) -> None:
+        """Запускает продление аренд; accounts() — текущие подключённые аккаунты."""
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._heartbeat(accounts))
+
+    async def _heartbeat(self, accounts: Callable[[], List[dict]]) -> None:
+        while True:
+            await asyncio.sleep(ACCOUNT_LEASE_HEARTBEAT_SECONDS)
+            try:
+                await self.acquire([a.get("phone_number") for a in accounts()])
+            except Exception as e:  # noqa: BLE001
+                _log(f"heartbeat failed: {e}")
+
+    async def stop(self) -> None:
+        """Останавливает продление и сразу отпускает аренды."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._notify_task is not None:
+            self._notify_task.cancel()
+            await asyncio.gather(self._notify_task, return_exceptions=True)
+            self._notify_task = None
+        if self._store is None:
+            return
+        for phone in list(self._held):
+            try:
+                await run_blocking(self._release_sync, phone)
+            except LeaseStoreError as e:
+                _log(f"{phone}: release failed ({e}) — expires in {ACCOUNT_LEASE_TTL_SECONDS}s")
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "store": type(self._store).__name__.strip("_") if self._store is not None else None,
+            "store_ok": self._store_ok,
+            "fail_open": ACCOUNT_LEASE_FAIL_OPEN,
+            "held": sorted(self._held),
+            "owners": {phone: node for phone, node in self._owners.items() if phone not in self._held},
+            "ttl_seconds": ACCOUNT_LEASE_TTL_SECONDS,
+            "takeovers": self.takeovers,
+            "lost": self.lost,
+        }
+
+
+account_leases = AccountLeases()
@@ -0,0 +1,212 @@
+"""
+Activity-driven scheduling of chats for the batch parser.
+
+Every selected chat used to be read on every 30-minute tick, whether it
+produced 500 messages an hour or none for a week. The scheduler ticks more
+often and on each tick picks only the chats that are due:
+
+- activity comes from parsing_logs over the last PARSER_ACTIVITY_WINDOW_HOURS:
+  messages per hour (sum of messages_found) and the average cost of one read
+  (execution_time_seconds);
+- a chat is read again once about PARSER_TARGET_MESSAGES_PER_FETCH new
+  messages are expected, clamped to [PARSER_CHAT_MIN_INTERVAL_MINUTES,
+  PARSER_CHAT_MAX_INTERVAL_MINUTES] — busy chats every few minutes, dead ones
+  a few times a day;
+- due chats are taken most-overdue first until the account's API budget for
+  the tick (PARSER_ACCOUNT_BUDGET_SECONDS_PER_HOUR, spread over the ticks) is
+  used up; the rest stay due and only get more overdue, so nothing starves.
+
+High-water marks make a longer interval lossless: a rarely read chat is
+read back to its mark (up to the catch-up window), so the max interval must
+stay below PARSER_CATCHUP_MAX_HOURS.
+"""
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+PARSER_SCHEDULER_TICK_MINUTES = max(1, int(os.getenv("PARSER_SCHEDULER_TICK_MINUTES", "5")))
+ACTIVITY_WINDOW_HOURS = int(os.getenv("PARSER_ACTIVITY_WINDOW_HOURS", "24"))
+ACTIVITY_REFRESH_SECONDS = 900
+CHAT_MIN_INTERVAL_MINUTES = int(os.getenv("PARSER_CHAT_MIN_INTERVAL_MINUTES", "5"))
+CHAT_MAX_INTERVAL_MINUTES = int(os.getenv("PARSER_CHAT_MAX_INTERVAL_MINUTES", "360"))
+TARGET_MESSAGES_PER_FETCH = float(os.getenv("PARSER_TARGET_MESSAGES_PER_FETCH", "50"))
+ACCOUNT_BUDGET_SECONDS_PER_HOUR = float(os.getenv("PARSER_ACCOUNT_BUDGET_SECONDS_PER_HOUR", "600"))
+
+# Cost assumed for a chat with no logged reads yet.
+DEFAULT_CHAT_COST_SECONDS = 3.0
+# Weight of the newest read in the running cost average.
+COST_EMA_WEIGHT = 0.3
+
+
+def _log(msg: str) -> None:
+    print(f">>> [scheduler] {msg}", file=sys.stderr, flush=True)
+
+
+def _parse_ts(value) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class ChatActivity:
+    chat_id: int
+    messages_per_hour: float = 0.0
+    avg_cost_seconds: float = DEFAULT_CHAT_COST_SECONDS
+    last_parsed: Optional[float] = None  # unix time of the last finished read
+
+    def interval_seconds(self) -> float:
+        if self.messages_per_hour <= 0:
+            minutes = CHAT_MAX_INTERVAL_MINUTES
+        else:
+            minutes = TARGET_MESSAGES_PER_FETCH / self.messages_per_hour * 60
+        minutes = min(CHAT_MAX_INTERVAL_MINUTES, max(CHAT_MIN_INTERVAL_MINUTES, minutes))
+        return minutes * 60
+
+    def overdue(self, now: float) -> float:
+        """Доля интервала, прошедшая с последнего чтения (>= 1 — пора)."""
+        if self.last_parsed is None:
+            return math.inf
+        return (now - self.last_parsed) / self.interval_seconds()
+
+
+class ChatScheduler:
+    def __init__(self, supabase_client, tick_minutes: int = PARSER_SCHEDULER_TICK_MINUTES):
+        self.supabase_client = supabase_client
+        self.tick_minutes = tick_minutes
+        self._activity: Dict[str, Dict[int, ChatActivity]] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        self._last_selection: Dict[str, dict] = {}
+
+    @property
+    def budget_per_tick(self) -> float:
+        return ACCOUNT_BUDGET_SECONDS_PER_HOUR * self.tick_minutes / 60
+
+    async def _refresh(self, phone_number: str) -> None:
+        if time.time() - self._refreshed_at.get(phone_number, 0) < ACTIVITY_REFRESH_SECONDS:
+            return
+        now = time.time()
+        since = datetime.now(timezone.utc) - timedelta(hours=ACTIVITY_WINDOW_HOURS)
+        rows = await self.supabase_client.fetch_chat_activity_async(phone_number, since.isoformat())
+
+        grouped: Dict[int, list] = {}
+        for row in rows:
+            grouped.setdefault(row.get("chat_id"), []).append(row)
+
+        known = self._activity.get(phone_number, {})
+        activity: Dict[int, ChatActivity] = {}
+        for chat_id, chat_rows in grouped.items():
+            started = [ts for ts in (_parse_ts(r.get("started_at")) for r in chat_rows) if ts]
+            # Окно — с первого чтения в нём, чтобы новый чат не выглядел тихим
+            hours = (now - min(started)) / 3600 if started else ACTIVITY_WINDOW_HOURS
+            hours = min(ACTIVITY_WINDOW_HOURS, max(hours, self.tick_minutes / 60))
+            found = sum(r.get("messages_found") or 0 for r in chat_rows)
+            costs = [r["execution_time_seconds"] for r in chat_rows if r.get("execution_time_seconds")]
+            finished = [
+                ts for ts, r in zip((_parse_ts(r.get("started_at")) for r in chat_rows), chat_rows)
+                if ts and r.get("status") != "error"
+            ]
+            act = ChatActivity(
+                chat_id=chat_id,
+                messages_per_hour=found / hours,
+                avg_cost_seconds=sum(costs) / len(costs) if costs else DEFAULT_CHAT_COST_SECONDS,
+                last_parsed=max(finished) if finished else None,
+            )
+            previous = known.get(chat_id)
+            if previous and previous.last_parsed and (act.last_parsed or 0) < previous.last_parsed:
+                act.last_parsed = previous.last_parsed  # лог последнего чтения ещё не записан
+            activity[chat_id] = act
+        for chat_id, previous in known.items():
+            activity.setdefault(chat_id, previous)
+
+        self._activity[phone_number] = activity
+        self._refreshed_at[phone_number] = now
+        _log(f"{phone_number}: activity of {len(activity)} chat(s) from {len(rows)} log row(s)")
+
+    async def select(self, phone_number: str, chat_ids: List[int]) -> List[int]:
+        """Чаты аккаунта, которые пора читать в этом тике, по приоритету
+        и в пределах бюджета. Без логов активности — все чаты."""
+        try:
+            await self._refresh(phone_number)
+        except Exception as e:  # noqa: BLE001
+            _log(f"{phone_number}: could not load activity ({e}) — parsing all chats")
+            return list(chat_ids)
+
+        now = time.time()
+        activity = self._activity.get(phone_number, {})
+        due = []
+        for chat_id in chat_ids:
+            act = activity.get(chat_id) or ChatActivity(chat_id)
+            overdue = act.overdue(now)
+            if overdue >= 1:
+                due.append((overdue, act.messages_per_hour, act))
+        # Никогда не читанные — первыми, дальше самые просроченные, при
+        # равенстве — самые активные
+        due.sort(key=lambda item: (item[0], item[1]), reverse=True)
+
+        budget = self.budget_per_tick
+        selected: List[int] = []
+        spent = 0.0
+        for _, _, act in due:
+            if selected and spent + act.avg_cost_seconds > budget:
+                continue
+            selected.append(act.chat_id)
+            spent += act.avg_cost_seconds
+
+        self._last_selection[phone_number] = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "chats": len(chat_ids),
+            "due": len(due),
+            "selected": len(selected),
+            "estimated_cost_seconds": round(spent, 1),
+            "budget_seconds": round(budget, 1),
+        }
+        _log(f"{phone_number}: {len(selected)} of {len(due)} due chat(s) scheduled "
+             f"({len(chat_ids)} selected, ~{spent:.0f}s of {budget:.0f}s budget)")
+        return selected
+
+    def observe(self, phone_number: str, stat: dict) -> None:
+        """Учитывает только что законченное чтение чата (до того, как его
+        лог вернётся из parsing_logs при следующем обновлении)."""
+        activity = self._activity.setdefault(phone_number, {})
+        chat_id = stat.get("chat_id")
+        act = activity.get(chat_id)
+        if act is None:
+            act = activity[chat_id] = ChatActivity(chat_id)
+        if stat.get("status") != "error":
+            act.last_parsed = time.time()
+        cost = stat.get("execution_time_seconds")
+        if cost:
+            act.avg_cost_seconds = (1 - COST_EMA_WEIGHT) * act.avg_cost_seconds + COST_EMA_WEIGHT * cost
+
+    def status(self) -> dict:
+        now = time.time()
+        accounts = {}
+        for phone, activity in self._activity.items():
+            chats = sorted(activity.values(), key=lambda a: a.messages_per_hour, reverse=True)
+            accounts[phone] = {
+                "last_selection": self._last_selection.get(phone),
+                "chats": [
+                    {
+                        "chat_id": act.chat_id,
+                        "messages_per_hour": round(act.messages_per_hour, 2),
+                        "avg_cost_seconds": round(act.avg_cost_seconds, 2),
+                        "interval_minutes": round(act.interval_seconds() / 60, 1),
+                        "due_in_minutes": (
+                            None if act.last_parsed is None
+                            else round(max(0.0, act.last_parsed + act.interval_seconds() - now) / 60, 1)
+                        ),
+                    }
+                    for act in chats
+                ],
+            }
+        return {
+            "tick_minutes": self.tick_minutes,
+            "budget_seconds_per_hour": ACCOUNT_BUDGET_SECONDS_PER_HOUR,
+            "accounts": accounts,
+        }
@@ -0,0 +1,178 @@
+"""
+Process-wide pool of connected Telegram clients, one per session file.
+
+Batch parsing, the chat selector, status checks and the realtime listener
+used to open their own `Client` on the same `sessions/<phone>.session` file:
+a fresh TCP connect + auth handshake per call, and concurrent opens of one
+SQLite file ("database is locked"). The pool owns a single started client
+per phone and hands out leases to everyone; the client stays connected
+between uses.
+
+Clients are fully started (update dispatcher running), so RealtimeService
+can attach its MessageHandler to the same client the batch parser uses.
+The login flow (connect_account / verify_code / upload-session) must call
+`close(phone)` first — it replaces the session file underneath the client.
+Other callers close a client only when the session itself is dead
+(`is_auth_error`): FloodWaits and network errors leave it in the pool.
+
+Whoever attaches state to a pooled client (RealtimeService's handler)
+registers `on_replace` and is told when the phone's client is closed or
+replaced by a new connection.
+"""
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from pyrogram import Client, raw
+from pyrogram.errors import Unauthorized
+
+SESSIONS_DIR = "sessions"
+
+# Pooled clients keep pyrogram's default sleep_threshold, so unpaced calls
+# (get_me, resolve_peer, profile lookups, pyrogram's own update/difference
+# requests) sleep through short FloodWaits as before. Calls paced by
+# rate_limiter.flood_limiter pass this to invoke() instead: their FloodWaits
+# reach the limiter and the parser can move on to other chats.
+NO_FLOOD_SLEEP = 0
+
+
+def _log(msg: str) -> None:
+    print(f">>> [pool] {msg}", file=sys.stderr, flush=True)
+
+
+def session_path(phone_number: str) -> str:
+    """Путь к сессии БЕЗ .session — Pyrogram добавит сам."""
+    safe_phone = phone_number.replace("+", "").replace("-", "").replace(" ", "")
+    return os.path.join(SESSIONS_DIR, safe_phone)
+
+
+class SessionNotAuthorized(Exception):
+    """Файл сессии есть, но Telegram его больше не принимает."""
+
+
+def is_auth_error(error: BaseException) -> bool:
+    """Сессия мертва (отозвана, аккаунт удалён) — клиент пора закрыть.
+    FloodWait, сетевые ошибки и прочее — нет: клиент исправен."""
+    return isinstance(error, (Unauthorized, SessionNotAuthorized))
+
+
+def account_key(client) -> str:
+    """Аккаунт клиента из пула — ключ для rate_limiter.flood_limiter."""
+    return getattr(client, "phone_number", None) or getattr(client, "name", "")
+
+
+class TelegramClientPool:
+    def __init__(self):
+        self._clients: Dict[str, Client] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._leases: Dict[str, int] = {}
+        self._replace_listeners: List[Callable[[str, Optional[Client]], None]] = []
+
+    def on_replace(self, listener: Callable[[str, Optional[Client]], None]) -> None:
+        """listener(phone, client) — клиент аккаунта заменён новым
+        подключением (client) или закрыт (None)."""
+        self._replace_listeners.append(listener)
+
+    def _notify(self, phone: str, client: Optional[Client]) -> None:
+        for listener in self._replace_listeners:
+            try:
+                listener(phone, client)
+            except Exception as e:  # noqa: BLE001
+                _log(f"replace listener failed for {phone}: {e}")
+
+    def _lock_for(self, phone: str) -> asyncio.Lock:
+        if phone not in self._locks:
+            self._locks[phone] = asyncio.Lock()
+        return self._locks[phone]
+
+    async def get(self, api_id, api_hash: str, phone_number: str) -> Client:
+        """Возвращает подключённый клиент аккаунта, создавая его при первом
+        обращении. Никогда не запрашивает код: неавторизованная сессия —
+        ошибка."""
+        async with self._lock_for(phone_number):
+            client = self._clients.get(phone_number)
+            if client is not None and client.is_connected:
+                return client
+            replaced = client is not None
+            if replaced:
+                self._clients.pop(phone_number, None)
+                await self._stop_quietly(client)
+
+            path = session_path(phone_number)
+            if not os.path.exists(f"{path}.session"):
+                raise FileNotFoundError(f"Session file not found: {path}.session")
+
+            # phone_number is never used to log in here (no authorize()); it
+            # identifies the account for flood_limiter.
+            client = Client(path, api_id=int(api_id), api_hash=api_hash,
+                            phone_number=phone_number)
+            is_authorized = await client.connect()
+            if not is_authorized:
+                await self._stop_quietly(client)
+                if replaced:
+                    self._notify(phone_number, None)
+                raise SessionNotAuthorized(f"Session for {phone_number} is not authorized")
+            try:
+                # Same steps as Client.start() minus the interactive authorize():
+                # GetState subscribes the session to updates, initialize()
+                # starts the dispatcher that feeds MessageHandlers.
+                await client.invoke(raw.functions.updates.GetState())
+                client.me = await client.get_me()
+                await client.initialize()
+            except Exception:
+                await self._stop_quietly(client)
+                if replaced:
+                    self._notify(phone_number, None)
+                raise
+
+            self._clients[phone_number] = client
+            _log(f"connected {phone_number} ({len(self._clients)} client(s) in pool)")
+            if replaced:
+                self._notify(phone_number, client)
+            return client
+
+    @asynccontextmanager
+    async def lease(self, api_id, api_hash: str, phone_number: str):
+        """async with client_pool.lease(...) as client: — клиент остаётся
+        подключённым после выхода из блока."""
+        client = await self.get(api_id, api_hash, phone_number)
+        self._leases[phone_number] = self._leases.get(phone_number, 0) + 1
+        try:
+            yield client
+        finally:
+            self._leases[phone_number] -= 1
+
+    async def close(self, phone_number: str) -> None:
+        """Останавливает клиент аккаунта (перед заменой или удалением сессии,
+        или когда сессия оказалась невалидной)."""
+        async with self._lock_for(phone_number):
+            client = self._clients.pop(phone_number, None)
+            if client is not None:
+                await self._stop_quietly(client)
+                _log(f"closed {phone_number}")
+                self._notify(phone_number, None)
+
+    async def close_all(self) -> None:
+        for phone in list(self._clients):
+            await self.close(phone)
+
+    def status(self) -> dict:
+        return {
+            phone: {"connected": client.is_connected, "leases": self._leases.get(phone, 0)}
+            for phone, client in self._clients.items()
+        }
+
+    @staticmethod
+    async def _stop_quietly(client: Client) -> None:
+        try:
+            if client.is_initialized:
+                await client.stop()
+            elif client.is_connected:
+                await client.disconnect()
+        except Exception as e:  # noqa: BLE001
+            _log(f"error stopping client: {e}")
+
+
+client_pool = TelegramClientPool()
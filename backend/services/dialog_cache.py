@@ -0,0 +1,109 @@
+"""
+Per-account cache of the dialog (group/channel) list.
+
+Listing dialogs means paging through messages.GetDialogs 100 at a time. Every
+batch run did it just to warm Pyrogram's peer cache, and every
+`/api/chats/{account_id}` request did it again for the chat selector. The
+peers themselves already live in the session's SQLite storage (raw invoke
+stores the users/chats of every response), so the full walk is only needed
+once; after that the list is kept in `sessions/<phone>.dialogs.json` next to
+the session file and refreshed incrementally:
+
+- younger than DIALOG_CACHE_TTL_SECONDS        -> served as is, no API calls;
+- older, full walk done recently               -> only the first GetDialogs
+  page is re-read (dialogs are ordered by last activity, so newly joined or
+  newly active chats are on it) and merged over the cached list;
+- no cache / DIALOG_FULL_REFRESH_SECONDS passed -> full walk.
+
+Left and deleted chats drop out on the next full walk.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from backend.services.client_pool import session_path
+
+DIALOG_CACHE_TTL_SECONDS = int(os.getenv("DIALOG_CACHE_TTL_SECONDS", "600"))
+DIALOG_FULL_REFRESH_SECONDS = int(os.getenv("DIALOG_FULL_REFRESH_SECONDS", str(6 * 3600)))
+
+
+def _log(msg: str) -> None:
+    print(f">>> [dialogs] {msg}", file=sys.stderr, flush=True)
+
+
+def cache_path(phone_number: str) -> str:
+    return f"{session_path(phone_number)}.dialogs.json"
+
+
+class DialogCache:
+    def load(self, phone_number: str) -> Optional[dict]:
+        """{"chats": [...], "fetched_at": ts, "full_at": ts} или None."""
+        try:
+            with open(cache_path(phone_number), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not isinstance(entry.get("chats"), list):
+            return None
+        return entry
+
+    def refresh_mode(self, entry: Optional[dict], force: bool = False) -> str:
+        """"cached" | "head" | "full" — сколько нужно перечитать у Telegram."""
+        if entry is None or force:
+            return "full"
+        now = time.time()
+        if now - entry.get("full_at", 0) >= DIALOG_FULL_REFRESH_SECONDS:
+            return "full"
+        if now - entry.get("fetched_at", 0) >= DIALOG_CACHE_TTL_SECONDS:
+            return "head"
+        return "cached"
+
+    def is_fresh(self, entry: Optional[dict]) -> bool:
+        return self.refresh_mode(entry) == "cached"
+
+    def store(self, phone_number: str, chats: List[Dict], mode: str, previous: Optional[dict] = None) -> dict:
+        """Сохраняет результат обновления. Для "head" первая страница
+        накладывается поверх закэшированного списка."""
+        now = time.time()
+        if mode == "head" and previous:
+            head_ids = {c["id"] for c in chats}
+            chats = chats + [c for c in previous["chats"] if c.get("id") not in head_ids]
+            full_at = previous.get("full_at", 0)
+        else:
+            full_at = now
+        entry = {"chats": chats, "fetched_at": now, "full_at": full_at}
+        self._write(phone_number, entry)
+        _log(f"{phone_number}: {mode} refresh, {len(chats)} chats cached")
+        return entry
+
+    def invalidate(self, phone_number: str) -> None:
+        """Сессия заменена или удалена — список диалогов больше не её."""
+        try:
+            os.remove(cache_path(phone_number))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _log(f"could not remove cache for {phone_number}: {e}")
+
+    @staticmethod
+    def _write(phone_number: str, entry: dict) -> None:
+        path = cache_path(phone_number)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".dialogs.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+dialog_cache = DialogCache()
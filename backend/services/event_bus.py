@@ -0,0 +1,95 @@
+"""
+In-process event bus behind the live dashboard stream (/api/parser/events).
+
+ParserService (run started/finished, per-chat progress) and RealtimeService
+(messages received, batch writes, errors) publish small events here instead
+of the dashboard polling their status endpoints. Each SSE connection holds
+a Subscription:
+
+- events are coalesced per client by (event, key): while a client has not
+  been sent its pending events, a newer "realtime" snapshot replaces the
+  older one instead of queueing behind it, so a slow client costs one slot
+  per key, never a growing buffer;
+- the stream sends whatever is pending at most every EVENTS_MIN_INTERVAL_MS,
+  so a busy realtime feed turns into a few updates per second per tab;
+- publishing is a dict assignment per subscriber and never waits for a
+  client.
+
+In worker mode (PARSER_WORKERS > 0) each worker forwards its coalesced
+events to the coordinator, which republishes them with the worker index
+in the key, so one stream shows every worker.
+
+publish() must be called from the event loop thread.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+EVENTS_MIN_INTERVAL_MS = max(10, int(os.getenv("EVENTS_MIN_INTERVAL_MS", "250")))
+EVENTS_HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self):
+        self._pending: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+
+    def push(self, event: str, key: str, data: dict) -> None:
+        slot = (event, key)
+        if slot in self._pending:
+            self.coalesced += 1
+        self._pending[slot] = data
+        self._ready.set()
+
+    async def next(self, timeout: float) -> List[Tuple[str, str, dict]]:
+        """Все накопленные (event, key, data), по последнему на ключ;
+        [] — таймаут."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        events = [(event, key, data) for (event, key), data in self._pending.items()]
+        self._pending.clear()
+        self.sent += len(events)
+        return events
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: Set[Subscription] = set()
+        self.published = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data: dict, key: Optional[str] = None) -> None:
+        """event — имя SSE-события, key — что схлопывается (по умолчанию
+        само событие: каждый следующий снимок заменяет предыдущий)."""
+        self.published += 1
+        if not self._subscribers:
+            return
+        data = {**data, "ts": time.time()}
+        for subscription in self._subscribers:
+            subscription.push(event, key or event, data)
+
+    def status(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "sent": sum(s.sent for s in self._subscribers),
+            "coalesced": sum(s.coalesced for s in self._subscribers),
+        }
+
+
+# Process-wide bus.
+event_bus = EventBus()
@@ -0,0 +1,281 @@
+"""
+Size/latency-triggered write batching for real-time messages.
+
+RealtimeService used to append every message to a list and flush the whole
+list every 3 seconds in one call: a lone message waited up to 3 s, and a
+burst became one unbounded insert. MessageBatcher replaces that loop:
+
+- a batch is sent as soon as it has REALTIME_BATCH_SIZE messages or its
+  oldest message has waited REALTIME_BATCH_MAX_DELAY_MS, whichever is first;
+- if all flush slots are busy, messages keep collecting and the batch is
+  topped up when a slot frees, but never beyond REALTIME_BATCH_MAX_SIZE;
+- up to REALTIME_FLUSH_CONCURRENCY batches are written at the same time
+  (the DB pool has SUPABASE_IO_WORKERS threads). Each batch has a sequence
+  number and batches are acknowledged — logged, counted, reported through
+  `committed_seq` — strictly in that order, even if a later insert returns
+  first;
+- the queue in front of the batcher holds at most REALTIME_QUEUE_SIZE
+  messages. When the database is slower than the incoming stream, `put`
+  waits for room, which in turn holds back Pyrogram's update dispatcher
+  instead of growing memory without bound.
+
+With a MessageSpool every message is appended to the spool before `put`
+returns and removed once its batch is saved. A failed batch, a full queue
+or rows left over from a previous run switch the batcher to backlog mode:
+new messages only go to disk, and a single replay loop drains the spool
+oldest first, retrying with exponential backoff (REALTIME_RETRY_BASE_SECONDS
+up to REALTIME_RETRY_MAX_SECONDS) until it is empty.
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable, Callable, List, Optional, Set
+
+REALTIME_BATCH_SIZE = max(1, int(os.getenv("REALTIME_BATCH_SIZE", "100")))
+REALTIME_BATCH_MAX_DELAY_MS = max(1, int(os.getenv("REALTIME_BATCH_MAX_DELAY_MS", "500")))
+REALTIME_BATCH_MAX_SIZE = max(REALTIME_BATCH_SIZE, int(os.getenv("REALTIME_BATCH_MAX_SIZE", "500")))
+REALTIME_FLUSH_CONCURRENCY = max(1, int(os.getenv("REALTIME_FLUSH_CONCURRENCY", "2")))
+REALTIME_QUEUE_SIZE = max(REALTIME_BATCH_MAX_SIZE, int(os.getenv("REALTIME_QUEUE_SIZE", "5000")))
+REALTIME_RETRY_BASE_SECONDS = float(os.getenv("REALTIME_RETRY_BASE_SECONDS", "1"))
+REALTIME_RETRY_MAX_SECONDS = float(os.getenv("REALTIME_RETRY_MAX_SECONDS", "60"))
+
+
+def _log(msg: str) -> None:
+    print(f">>> [batcher] {msg}", file=sys.stderr, flush=True)
+
+
+class MessageBatcher:
+    def __init__(self, write: Callable[[List[dict]], Awaitable[bool]], name: str = "realtime", spool=None):
+        """write(batch) -> True, если пачка записана. spool — MessageSpool
+        или None (сообщения только в памяти)."""
+        self._write = write
+        self.name = name
+        self._spool = spool if spool is not None and spool.enabled else None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        # (enqueued_at, spool_id, message) — собираемая пачка, пока ждёт размера/времени/слота
+        self._collecting: List[tuple] = []
+        self._next_seq = 0
+        self._previous: Optional[asyncio.Future] = None  # подтверждение предыдущей пачки
+        self._backlog = self._spool is not None and self._spool.rows > 0
+        self.committed_seq = -1
+        self.enqueued = 0
+        self.saved = 0
+        self.failed = 0
+        self.replayed = 0
+        self.retries = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+        self.last_batch_size = 0
+        self.last_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    # ── producer side ────────────────────────────────────────────────
+
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=REALTIME_QUEUE_SIZE)
+            self._slots = asyncio.Semaphore(REALTIME_FLUSH_CONCURRENCY)
+            self._wake = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self._spool is not None and (self._replay_task is None or self._replay_task.done()):
+            self._replay_task = asyncio.create_task(self._replay())
+            if self._backlog:
+                self._wake.set()
+
+    async def put(self, message: dict) -> None:
+        """Ставит сообщение в очередь. Со спулом сообщение сохранено на
+        диск к моменту возврата; без спула — ждёт, если очередь заполнена."""
+        self.start()
+        spool_id = await self._spool.append_async(message) if self._spool is not None else None
+        self.enqueued += 1
+        if spool_id is not None and self._backlog:
+            return  # допишет replay
+        item = (time.monotonic(), spool_id, message)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if spool_id is not None:
+                # Память кончилась, но сообщение уже на диске
+                self._enter_backlog("write queue is full")
+                return
+            self.backpressure_waits += 1
+            await self._queue.put(item)
+
+    # ── batching loop ────────────────────────────────────────────────
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._collecting:
+                self._collecting.append(await self._queue.get())
+            deadline = self._collecting[0][0] + REALTIME_BATCH_MAX_DELAY_MS / 1000
+            while len(self._collecting) < REALTIME_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._collecting.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Все слоты заняты — пачка продолжает копиться (до потолка),
+            # а очередь за ней упирается в REALTIME_QUEUE_SIZE
+            await self._slots.acquire()
+            self._top_up()
+            if not self._collecting:
+                self._slots.release()  # пачку забрал backlog
+                continue
+            batch, self._collecting = self._collecting, []
+            self._dispatch(loop, batch)
+
+    def _top_up(self) -> None:
+        while len(self._collecting) < REALTIME_BATCH_MAX_SIZE and not self._queue.empty():
+            self._collecting.append(self._queue.get_nowait())
+
+    def _dispatch(self, loop, batch: List[tuple]) -> None:
+        seq = self._next_seq
+        self._next_seq += 1
+        previous, done = self._previous, loop.create_future()
+        self._previous = done
+        task = asyncio.create_task(self._flush(seq, batch, previous, done))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write_safe(self, messages: List[dict], label: str) -> bool:
+        try:
+            return bool(await self._write(messages))
+        except Exception as e:  # noqa: BLE001
+            _log(f"{self.name}: {label} of {len(messages)} failed: {e}")
+            return False
+
+    async def _flush(self, seq: int, batch: List[tuple], previous: Optional[asyncio.Future],
+                     done: asyncio.Future) -> None:
+        messages = [message for _, _, message in batch]
+        spool_ids = [spool_id for _, spool_id, _ in batch if spool_id is not None]
+        started = time.monotonic()
+        try:
+            ok = await self._write_safe(messages, f"batch #{seq}")
+        finally:
+            self._slots.release()
+        if ok and self._spool is not None:
+            await self._spool.remove_async(spool_ids)
+
+        # Подтверждаем строго по порядку пачек
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+        finally:
+            latency_ms = (time.monotonic() - batch[0][0]) * 1000
+            self.batches += 1
+            self.last_batch_size = len(messages)
+            self.last_latency_ms = latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            if ok:
+                self.saved += len(messages)
+            else:
+                # Строки из спула не потеряны — их допишет replay
+                self.failed += len(messages) - len(spool_ids)
+            self.committed_seq = seq
+            done.set_result(ok)
+        if ok:
+            print(f">>> RT: Saved {len(messages)} messages in real-time "
+                  f"(batch #{seq}, write {(time.monotonic() - started) * 1000:.0f} ms, "
+                  f"oldest waited {latency_ms:.0f} ms)", flush=True)
+        elif spool_ids:
+            self._enter_backlog(f"batch #{seq} failed")
+
+    # ── backlog replay ───────────────────────────────────────────────
+
+    def _enter_backlog(self, reason: str) -> None:
+        """Дальше пишем только через спул: всё, что ждёт в памяти и уже
+        лежит на диске, отдаём replay."""
+        if not self._backlog:
+            _log(f"{self.name}: {reason} — buffering to the spool until the database catches up")
+        self._backlog = True
+        self._collecting[:] = [item for item in self._collecting if item[1] is None]
+        kept = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item[1] is None:
+                kept.append(item)
+        for item in kept:
+            self._queue.put_nowait(item)
+        self._wake.set()
+
+    async def _replay(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            # Пачки, ушедшие до перехода в backlog, должны закончиться —
+            # иначе их строки спула уйдут в базу второй раз
+            while self._flushes:
+                await asyncio.gather(*list(self._flushes), return_exceptions=True)
+
+            delay = REALTIME_RETRY_BASE_SECONDS
+            while self._backlog:
+                rows = await self._spool.read_async(REALTIME_BATCH_MAX_SIZE)
+                if not rows:
+                    self._backlog = False
+                    _log(f"{self.name}: spool drained, back to direct writes")
+                    break
+                messages = [message for _, message in rows]
+                if await self._write_safe(messages, "replay"):
+                    await self._spool.remove_async([row_id for row_id, _ in rows])
+                    self.replayed += len(rows)
+                    self.saved += len(rows)
+                    delay = REALTIME_RETRY_BASE_SECONDS
+                    continue
+                self.retries += 1
+                _log(f"{self.name}: replay of {len(rows)} spooled message(s) failed, retry in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, REALTIME_RETRY_MAX_SECONDS)
+
+    # ── shutdown ─────────────────────────────────────────────────────
+
+    async def drain(self) -> None:
+        """Останавливает циклы и дописывает всё, что уже принято в память.
+        Недописанное из спула останется на диске до следующего запуска."""
+        for task in (self._task, self._replay_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._replay_task = None
+        if self._queue is not None:
+            loop = asyncio.get_running_loop()
+            while self._collecting or not self._queue.empty():
+                await self._slots.acquire()
+                self._top_up()
+                batch, self._collecting = self._collecting, []
+                self._dispatch(loop, batch)
+        if self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
+
+    def status(self) -> dict:
+        return {
+            "queued": (self._queue.qsize() if self._queue is not None else 0) + len(self._collecting),
+            "in_flight": len(self._flushes),
+            "backlog": self._backlog,
+            "enqueued": self.enqueued,
+            "saved": self.saved,
+            "failed": self.failed,
+            "replayed": self.replayed,
+            "retries": self.retries,
+            "batches": self.batches,
+            "committed_seq": self.committed_seq,
+            "backpressure_waits": self.backpressure_waits,
+            "last_batch_size": self.last_batch_size,
+            "last_latency_ms": round(self.last_latency_ms, 1),
+            "max_latency_ms": round(self.max_latency_ms, 1),
+            "spool": self._spool.stats() if self._spool is not None else None,
+        }
@@ -1,9 +1,21 @@
 import asyncio
-from typing import List
+import os
+from typing import Dict, List, Optional, Set
 from backend.services.telegram_service import TelegramService
+from backend.services.profile_cache import profile_cache
+from backend.services.account_leases import account_leases
+from backend.services.event_bus import event_bus
+from backend.services.response_cache import response_cache
+from backend.services.chat_scheduler import ChatScheduler
 from backend.database.account_storage import AccountStorage
+from backend.database.watermark_storage import WatermarkStorage
+from backend.database.checkpoint_storage import CheckpointStorage
+from backend.database import state_persistence
+from backend.database.db_executor import run_blocking
 from backend.database.supabase_client import SupabaseClient
 import uuid
+from contextlib import aclosing
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 
 # Hard cap per account scan. Defense-in-depth on top of the per-chat timeout
@@ -11,38 +23,213 @@ from datetime import datetime, timezone
 # timeout, 93 chats × 25s ≈ 39 min, so a generous outer cap is needed.
 PARSE_ACCOUNT_TIMEOUT_SECONDS = 1800  # 30 minutes
 
+# How many accounts are parsed at the same time. Each account runs over its
+# own Telegram session, so they don't share FloodWait budgets; the cap only
+# keeps CPU/network usage of one batch tick bounded.
+MAX_PARALLEL_ACCOUNTS = max(1, int(os.getenv("PARSER_MAX_PARALLEL_ACCOUNTS", "4")))
+
+# Streaming writer: a batch goes to Supabase once it has WRITE_BATCH_SIZE
+# messages or WRITE_FLUSH_SECONDS have passed, whichever comes first. At most
+# WRITE_QUEUE_SIZE batches wait for the writer before parsing is paused.
+WRITE_BATCH_SIZE = 200
+WRITE_FLUSH_SECONDS = 5
+WRITE_QUEUE_SIZE = 2
+
+
+@dataclass
+class _PendingBatch:
+    messages: List[dict] = field(default_factory=list)
+    stats: List[dict] = field(default_factory=list)
+    watermarks: List[dict] = field(default_factory=list)
+    progress: List[dict] = field(default_factory=list)
+    chat_ids: Set[int] = field(default_factory=set)  # чаты, чьи сообщения в пачке
+
+    def is_empty(self) -> bool:
+        return not (self.messages or self.stats or self.watermarks or self.progress)
+
+
+# Errors kept verbatim in a parsing_sessions row; the rest are only counted.
+RUN_SUMMARY_MAX_ERRORS = 50
+
+
+@dataclass
+class _RunSummary:
+    """Итоги одного прогона parse_all_accounts — одна строка parsing_sessions."""
+    session_id: str
+    started_at: datetime
+    scheduled: bool
+    accounts: Dict[str, dict] = field(default_factory=dict)
+    errors: List[dict] = field(default_factory=list)
+    error_count: int = 0
+
+    def _account(self, phone: str) -> dict:
+        return self.accounts.setdefault(phone, {
+            "chats": 0, "success": 0, "errors": 0, "skipped": 0,
+            "messages_found": 0, "messages_saved": 0, "messages_skipped": 0,
+            "status": "ok",
+        })
+
+    def _error(self, error: dict) -> None:
+        self.error_count += 1
+        if len(self.errors) < RUN_SUMMARY_MAX_ERRORS:
+            self.errors.append(error)
+
+    def add_stats(self, phone: str, stats: List[dict]) -> None:
+        acc = self._account(phone)
+        for stat in stats:
+            acc["chats"] += 1
+            acc["messages_found"] += stat.get("messages_found") or 0
+            acc["messages_saved"] += stat.get("messages_saved") or 0
+            acc["messages_skipped"] += stat.get("messages_skipped") or 0
+            if stat.get("status") == "error":
+                acc["errors"] += 1
+                self._error({
+                    "phone_number": phone,
+                    "chat_name": stat.get("chat_name"),
+                    "error_type": stat.get("error_type"),
+                    "error_message": stat.get("error_message"),
+                })
+            elif stat.get("status") == "skipped":
+                acc["skipped"] += 1
+            else:
+                acc["success"] += 1
+
+    def account_failed(self, phone: str, status: str, message: str) -> None:
+        """Аккаунт целиком: timeout / error (в логах чатов его не видно)."""
+        self._account(phone)["status"] = status
+        self._error({"phone_number": phone, "chat_name": None, "error_type": status, "error_message": message})
+
+    def progress(self) -> dict:
+        """Текущие итоги для живого дашборда (событие "parser")."""
+        per_account = self.accounts.values()
+        return {
+            "session_id": self.session_id,
+            "scheduled": self.scheduled,
+            "started_at": self.started_at.isoformat(),
+            "accounts": len(self.accounts),
+            "chats_done": sum(a["chats"] for a in per_account),
+            "messages_found": sum(a["messages_found"] for a in per_account),
+            "messages_saved": sum(a["messages_saved"] for a in per_account),
+            "error_count": self.error_count,
+        }
+
+    def to_row(self, status: str) -> dict:
+        finished_at = datetime.now(timezone.utc)
+        per_account = self.accounts.values()
+        return {
+            "session_id": self.session_id,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "scheduled": self.scheduled,
+            "status": status,
+            "accounts": sorted(self.accounts),
+            "total_chats": sum(a["chats"] for a in per_account),
+            "success_count": sum(a["success"] for a in per_account),
+            "error_count": self.error_count,
+            "skipped_count": sum(a["skipped"] for a in per_account),
+            "messages_found": sum(a["messages_found"] for a in per_account),
+            "total_messages": sum(a["messages_saved"] for a in per_account),
+            "messages_skipped": sum(a["messages_skipped"] for a in per_account),
+            "wall_time_seconds": round((finished_at - self.started_at).total_seconds(), 2),
+            "per_account": self.accounts,
+            "errors": self.errors,
+        }
+
+
+def _format_message(msg: dict) -> dict:
+    """Приводит сообщение из parse_messages к колонкам таблицы messages."""
+    return {
+        "message_time": msg["message_time"],
+        "chat_name": msg["chat_name"],
+        "user_id": msg.get("user_id"),
+        "first_name": msg["first_name"],
+        "last_name": msg["last_name"],
+        "username": msg["username"],
+        "bio": msg["bio"],
+        "profile_link": msg.get("profile_link"),
+        "message": msg["message"]
+    }
+
+
+def _format_log(stat: dict, phone_number: str, parsing_session_id: str, session_start_time: datetime) -> dict:
+    """Приводит статистику чата к колонкам таблицы parsing_logs."""
+    return {
+        "parsing_session_id": parsing_session_id,
+        "started_at": stat["started_at"].isoformat() if stat.get("started_at") else session_start_time.isoformat(),
+        "finished_at": stat["finished_at"].isoformat() if stat.get("finished_at") else None,
+        "phone_number": phone_number,
+        "chat_id": stat["chat_id"],
+        "chat_name": stat["chat_name"],
+        "messages_found": stat["messages_found"],
+        "messages_saved": stat["messages_saved"],
+        "messages_skipped": stat["messages_skipped"],
+        "status": stat["status"],
+        "error_type": stat.get("error_type"),
+        "error_message": stat.get("error_message"),
+        "hours_back": 1,
+        "execution_time_seconds": stat.get("execution_time_seconds", 0)
+    }
+
 class ParserService:
     def __init__(self, supabase_client: SupabaseClient):
         self.telegram_service = TelegramService()
         self.account_storage = AccountStorage()
+        self.watermark_storage = WatermarkStorage()
+        self.checkpoint_storage = CheckpointStorage()
         self.supabase_client = supabase_client
+        self.chat_scheduler = ChatScheduler(supabase_client)
         self._is_running = False
         self._should_stop = False
+        self._account_tasks: List[asyncio.Task] = []
         # Optional realtime service. Wired from main.py after construction
         # so the batch scheduler can recover the realtime listener when
         # accounts appear after the initial RealtimeService.start() call
         # (which silently exits if no accounts are connected yet).
         self._realtime_service = None
+        # Phones this process is responsible for (worker mode), None — all.
+        self.account_filter: Optional[Set[str]] = None
 
     def set_realtime_service(self, realtime_service):
         """Inject the RealtimeService so parse_all_accounts can revive it
         if accounts appeared after startup."""
         self._realtime_service = realtime_service
     
-    async def parse_all_accounts(self):
-        """Парсит сообщения для всех подключенных аккаунтов"""
-        print(f"\n>>> Starting parse_all_accounts", flush=True)
+    async def parse_scheduled(self):
+        """Тик планировщика: у каждого аккаунта читаются только чаты,
+        которые по активности пора читать (ChatScheduler)."""
+        await self.parse_all_accounts(scheduled=True)
+
+    async def parse_all_accounts(self, scheduled: bool = False):
+        """Парсит сообщения для всех подключенных аккаунтов
+        
+        scheduled=False (ручной запуск) — все выбранные чаты;
+        scheduled=True — только чаты, выбранные ChatScheduler.
+        """
+        print(f"\n>>> Starting parse_all_accounts (scheduled={scheduled})", flush=True)
+        if self._is_running:
+            # Ручной запуск поверх тика планировщика (или наоборот): второй
+            # прогон читал бы те же чаты и двигал те же отметки
+            print(">>> Parsing already in progress — skipped", flush=True)
+            return
         
         self._is_running = True
         self._should_stop = False
+        response_cache.invalidate("parser")
         
         # 🆔 Создаём уникальный ID сессии парсинга
         parsing_session_id = str(uuid.uuid4())
         session_start_time = datetime.now(timezone.utc)
         print(f">>> 📊 Parsing Session ID: {parsing_session_id}", flush=True)
+        run = _RunSummary(parsing_session_id, session_start_time, scheduled)
+        run_status = "failed"
+        self._publish_status(run)
         
         try:
             accounts = self.account_storage.get_all_connected_accounts()
+            if self.account_filter is not None:
+                accounts = [a for a in accounts if a.get("phone_number") in self.account_filter]
+            else:
+                accounts = await account_leases.filter_accounts(accounts)
             print(f">>> Found {len(accounts)} connected accounts", flush=True)
 
             if not accounts:
@@ -59,110 +246,297 @@ class ParserService:
                 except Exception as rt_err:
                     print(f">>> ⚠️ Could not start realtime: {rt_err}", flush=True)
             
-            for account in accounts:
-                # Проверяем флаг остановки
-                if self._should_stop:
-                    print(f">>> PARSING STOPPED BY USER", flush=True)
-                    break
-                
-                print(f">>> Processing account: {account.get('phone_number')}", flush=True)
-                try:
-                    selected_chats = self.account_storage.get_selected_chats(account["id"])
-                    print(f">>> Selected chats for account {account['id']}: {selected_chats}", flush=True)
-                    
-                    if not selected_chats:
-                        print(f">>> WARNING: No selected chats for account {account['id']}", flush=True)
-                        continue
-                    
-                    print(f">>> Parsing messages from {len(selected_chats)} chats...", flush=True)
-
-                    # 📊 Парсим сообщения (теперь возвращает Dict с messages и stats)
-                    try:
-                        result = await asyncio.wait_for(
-                            self.telegram_service.parse_messages(
-                                account["api_id"],
-                                account["api_hash"],
-                                account["phone_number"],
-                                selected_chats,
-                                hours_back=1
-                            ),
-                            timeout=PARSE_ACCOUNT_TIMEOUT_SECONDS
-                        )
-                    except asyncio.TimeoutError:
-                        print(
-                            f"⏱️ Account {account['phone_number']} exceeded "
-                            f"{PARSE_ACCOUNT_TIMEOUT_SECONDS}s — aborted, will retry next cycle",
-                            flush=True
-                        )
-                        continue
-                    
-                    messages = result.get("messages", [])
-                    stats = result.get("stats", [])
-                    
-                    print(f">>> Found {len(messages)} messages from {len(stats)} chats", flush=True)
-                    
-                    # Проверяем флаг остановки перед сохранением
+            # Bounded fan-out: each account gets its own task, at most
+            # MAX_PARALLEL_ACCOUNTS of them talk to Telegram at once. A cycle
+            # now takes roughly as long as the slowest account instead of the
+            # sum of all of them.
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_ACCOUNTS)
+            print(f">>> Parsing up to {MAX_PARALLEL_ACCOUNTS} account(s) in parallel", flush=True)
+
+            async def run_account(account: dict):
+                async with semaphore:
+                    # Проверяем флаг остановки
                     if self._should_stop:
-                        print(f">>> PARSING STOPPED BY USER (before saving)", flush=True)
-                        break
-                    
-                    # 💾 Сохраняем сообщения
-                    if messages:
-                        # Преобразуем datetime строки в формат для Supabase
-                        formatted_messages = []
-                        for msg in messages:
-                            formatted_messages.append({
-                                "message_time": msg["message_time"],
-                                "chat_name": msg["chat_name"],
-                                "user_id": msg.get("user_id"),
-                                "first_name": msg["first_name"],
-                                "last_name": msg["last_name"],
-                                "username": msg["username"],
-                                "bio": msg["bio"],
-                                "profile_link": msg.get("profile_link"),
-                                "message": msg["message"]
-                            })
-                        
-                        save_success = self.supabase_client.insert_messages_batch(formatted_messages)
-                        if save_success:
-                            print(f"✅ Saved {len(messages)} messages for account {account['phone_number']}")
-                        else:
-                            print(f"⚠️ WARNING: Failed to save {len(messages)} messages for account {account['phone_number']}! Check Supabase connection.")
-                    
-                    # 📊 Сохраняем статистику парсинга
-                    if stats:
-                        formatted_logs = []
-                        for stat in stats:
-                            formatted_logs.append({
-                                "parsing_session_id": parsing_session_id,
-                                "started_at": stat["started_at"].isoformat() if stat.get("started_at") else session_start_time.isoformat(),
-                                "finished_at": stat["finished_at"].isoformat() if stat.get("finished_at") else None,
-                                "phone_number": account["phone_number"],
-                                "chat_id": stat["chat_id"],
-                                "chat_name": stat["chat_name"],
-                                "messages_found": stat["messages_found"],
-                                "messages_saved": stat["messages_saved"],
-                                "messages_skipped": stat["messages_skipped"],
-                                "status": stat["status"],
-                                "error_type": stat.get("error_type"),
-                                "error_message": stat.get("error_message"),
-                                "hours_back": 1,
-                                "execution_time_seconds": stat.get("execution_time_seconds", 0)
-                            })
-                        
-                        logs_success = self.supabase_client.insert_parsing_logs_batch(formatted_logs)
-                        if logs_success:
-                            print(f"📊 Saved statistics for {len(stats)} chats")
-                        else:
-                            print(f"⚠️ WARNING: Failed to save parsing statistics for {len(stats)} chats!")
-                
-                except Exception as e:
-                    print(f"Error parsing account {account.get('phone_number', 'unknown')}: {e}")
-                    continue
+                        print(f">>> PARSING STOPPED BY USER — skipping {account.get('phone_number')}", flush=True)
+                        return
+                    await self._parse_account(account, parsing_session_id, session_start_time, scheduled, run)
+
+            self._account_tasks = [
+                asyncio.create_task(run_account(account)) for account in accounts
+            ]
+            results = await asyncio.gather(*self._account_tasks, return_exceptions=True)
+            for account, res in zip(accounts, results):
+                if isinstance(res, BaseException) and not isinstance(res, asyncio.CancelledError):
+                    print(f"Error parsing account {account.get('phone_number', 'unknown')}: {res}", flush=True)
+            run_status = "stopped" if self._should_stop else "completed"
+            await run_blocking(state_persistence.backup_watermarks)
+            await run_blocking(state_persistence.backup_checkpoints)
+            profile_cache.flush()
         finally:
+            # 📋 Одна строка итогов на прогон (пустые тики планировщика не пишем)
+            row = run.to_row(run_status)
+            if run.accounts:
+                await self.supabase_client.insert_parsing_session_async(row)
+            self._account_tasks = []
             self._is_running = False
             self._should_stop = False
-    
+            response_cache.invalidate("parser", "sessions")
+            if run.accounts:
+                event_bus.publish("run_finished", {
+                    key: row[key] for key in (
+                        "session_id", "status", "scheduled", "started_at", "finished_at", "accounts",
+                        "total_chats", "total_messages", "error_count", "wall_time_seconds",
+                    )
+                })
+            self._publish_status(run)
+
+    async def _parse_account(self, account: dict, parsing_session_id: str, session_start_time: datetime,
+                             scheduled: bool = False, run: Optional[_RunSummary] = None):
+        """Парсит и сохраняет один аккаунт. Ошибки и таймауты изолированы —
+        они не затрагивают аккаунты, которые парсятся параллельно."""
+        print(f">>> Processing account: {account.get('phone_number')}", flush=True)
+        try:
+            selected_chats = self.account_storage.get_selected_chats(account["id"])
+            print(f">>> Selected chats for account {account['id']}: {selected_chats}", flush=True)
+
+            if not selected_chats:
+                print(f">>> WARNING: No selected chats for account {account['id']}", flush=True)
+                return
+
+            if scheduled:
+                # 🗓️ Только чаты, которым пора, плюс недочитанные из прерванного прогона
+                phone = account["phone_number"]
+                due = await self.chat_scheduler.select(phone, selected_chats)
+                checkpoint = self.checkpoint_storage.get_account(phone) or {}
+                partial = {point.get("chat_id") for point in checkpoint.get("sources", {}).values()}
+                selected_chats = [c for c in selected_chats if c in partial and c not in due] + due
+                if not selected_chats:
+                    print(f">>> Nothing due for {phone} this tick", flush=True)
+                    return
+
+            print(f">>> Parsing messages from {len(selected_chats)} chats...", flush=True)
+
+            # 🌊 Сообщения стримятся в БД пачками по ходу парсинга, поэтому
+            # таймаут теряет максимум одну пачку, а не весь аккаунт.
+            try:
+                await asyncio.wait_for(
+                    self._stream_account(account, selected_chats, parsing_session_id, session_start_time, run),
+                    timeout=PARSE_ACCOUNT_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                print(
+                    f"⏱️ Account {account['phone_number']} exceeded "
+                    f"{PARSE_ACCOUNT_TIMEOUT_SECONDS}s — aborted, already written batches are kept",
+                    flush=True
+                )
+                if run is not None:
+                    run.account_failed(account["phone_number"], "timeout",
+                                       f"exceeded {PARSE_ACCOUNT_TIMEOUT_SECONDS}s")
+                return
+
+        except asyncio.CancelledError:
+            print(f">>> Account {account.get('phone_number')} cancelled", flush=True)
+            raise
+        except Exception as e:
+            print(f"Error parsing account {account.get('phone_number', 'unknown')}: {e}")
+            if run is not None:
+                run.account_failed(account.get("phone_number", "unknown"), "error", str(e))
+
+    async def _stream_account(self, account: dict, selected_chats: List[int],
+                              parsing_session_id: str, session_start_time: datetime,
+                              run: Optional[_RunSummary] = None):
+        """Producer → bounded queue → writer.
+
+        parse_messages отдаёт сообщения по одному; здесь они копятся в пачку,
+        которая уходит писателю по размеру (WRITE_BATCH_SIZE) или по времени
+        (WRITE_FLUSH_SECONDS). Писатель один и обрабатывает пачки по порядку,
+        так что отметки чата сдвигаются только после записи всех его сообщений.
+        """
+        phone = account["phone_number"]
+
+        # ♻️ Незавершённый прогон аккаунта — продолжаем его, а не начинаем заново
+        chats, resume = selected_chats, {}
+        checkpoint = self.checkpoint_storage.get_account(phone)
+        if checkpoint:
+            chats, resume = self._resume_order(selected_chats, checkpoint)
+            print(f">>> ♻️ Resuming interrupted run for {phone}: {len(resume)} partial source(s), "
+                  f"{len(chats)} chat(s) left of {len(selected_chats)}", flush=True)
+            if not chats:
+                self.checkpoint_storage.finish(phone, selected_chats)
+                return
+        else:
+            self.checkpoint_storage.start(phone, parsing_session_id)
+
+        write_queue: asyncio.Queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        pending = _PendingBatch()
+        totals = {"messages": 0, "chats": 0}
+        # Чаты, у которых в этом прогоне не записалась хоть одна пачка: их
+        # отметки и чекпоинт не двигаются до конца прогона
+        failed_chats: Set[int] = set()
+
+        async def flush_pending():
+            nonlocal pending
+            if pending.is_empty():
+                return
+            batch, pending = pending, _PendingBatch()
+            await write_queue.put(batch)
+
+        async def ticker():
+            while True:
+                await asyncio.sleep(WRITE_FLUSH_SECONDS)
+                await flush_pending()
+
+        async def writer():
+            while True:
+                batch = await write_queue.get()
+                if batch is None:
+                    return
+                await self._write_batch(account, batch, parsing_session_id, session_start_time, run, failed_chats)
+
+        writer_task = asyncio.create_task(writer())
+        ticker_task = asyncio.create_task(ticker())
+        try:
+            stream = self.telegram_service.parse_messages(
+                account["api_id"],
+                account["api_hash"],
+                phone,
+                chats,
+                hours_back=1,
+                should_stop=lambda: self._should_stop,
+                watermarks=self.watermark_storage.get_account_marks(phone),
+                resume=resume
+            )
+            async with aclosing(stream):
+                async for item in stream:
+                    if item["type"] == "message":
+                        pending.messages.append(_format_message(item["data"]))
+                        pending.chat_ids.add(item["data"].get("chat_id"))
+                        totals["messages"] += 1
+                    elif item["type"] == "chat_done":
+                        pending.stats.append(item["stat"])
+                        pending.watermarks.extend(item["watermarks"])
+                        totals["chats"] += 1
+                    elif item["type"] == "progress":
+                        pending.progress.append(item["checkpoint"])
+                    if len(pending.messages) >= WRITE_BATCH_SIZE:
+                        await flush_pending()
+                    if writer_task.done():
+                        # Писатель упал — не копим сообщения в никуда
+                        writer_task.result()
+
+            ticker_task.cancel()
+            await flush_pending()
+            await write_queue.put(None)
+            await writer_task
+            print(f">>> Streamed {totals['messages']} messages from {totals['chats']} chats for {phone}", flush=True)
+            if self.checkpoint_storage.finish(phone, selected_chats):
+                print(f">>> ✅ Run complete for {phone}, checkpoint cleared", flush=True)
+            else:
+                print(f">>> 💾 Run for {phone} incomplete — next run resumes from checkpoint", flush=True)
+        finally:
+            ticker_task.cancel()
+            if not writer_task.done():
+                writer_task.cancel()
+
+    @staticmethod
+    def _resume_order(selected_chats: List[int], checkpoint: dict):
+        """Порядок чатов для продолжения прогона: сначала недочитанные
+        источники, затем не начатые чаты; дочитанные пропускаются.
+        Returns (chat_ids, resume) — resume для parse_messages."""
+        selected = set(selected_chats)
+        done = set(checkpoint.get("done", []))
+        sources = {
+            key: point for key, point in checkpoint.get("sources", {}).items()
+            if point.get("chat_id") in selected and point.get("chat_id") not in done
+        }
+        partial = []
+        for point in sources.values():
+            if point["chat_id"] not in partial:
+                partial.append(point["chat_id"])
+        rest = [chat_id for chat_id in selected_chats if chat_id not in done and chat_id not in partial]
+        return partial + rest, sources
+
+    async def _write_batch(self, account: dict, batch: "_PendingBatch",
+                     parsing_session_id: str, session_start_time: datetime,
+                     run: Optional[_RunSummary] = None, failed_chats: Optional[Set[int]] = None):
+        """Пишет одну пачку: сообщения → high-water marks → статистика.
+
+        failed_chats — чаты аккаунта, чья пачка уже не записалась в этом
+        прогоне (пополняется здесь). Сообщения чата могут лежать в нескольких
+        пачках, а отметку несёт последняя: если не записалась более ранняя,
+        сдвиг отметки по следующей перепрыгнул бы несохранённые сообщения."""
+        phone = account["phone_number"]
+
+        if failed_chats is None:
+            failed_chats = set()
+
+        # 💾 Сохраняем сообщения
+        save_success = True
+        if batch.messages:
+            # Профили, разрешённые в фоне пока пачка копилась
+            profile_cache.fill_missing(batch.messages)
+            counts = await self.supabase_client.insert_messages_batch_counts_async(batch.messages)
+            # Любая ошибка записи держит отметки на месте: пачку перечитаем
+            save_success = counts["errors"] == 0
+            if save_success:
+                print(f"✅ Saved batch for account {phone}: {counts['inserted']} new, "
+                      f"{counts['duplicates']} duplicates")
+            else:
+                print(f"⚠️ WARNING: Failed to save {counts['errors']} of {len(batch.messages)} messages for account {phone}! Check Supabase connection.")
+                failed_chats.update(batch.chat_ids)
+
+        # 📍 Сдвигаем high-water marks только после успешной записи всех
+        # пачек чата — иначе несохранённые сообщения больше не перечитаются.
+        if save_success:
+            marks = [m for m in batch.watermarks if m["chat_id"] not in failed_chats]
+            if marks:
+                changed = self.watermark_storage.update(phone, marks)
+                print(f"📍 Advanced {changed} high-water mark(s) for {phone}", flush=True)
+            held = len(batch.watermarks) - len(marks)
+            if held:
+                print(f"📍 Kept {held} high-water mark(s) for {phone}: earlier batch of the chat failed", flush=True)
+
+        # ♻️ Чекпоинт прогона — по тому же правилу: только записанное.
+        # Чат, упёршийся в лимит чтения (partial), не дочитан: его позиция
+        # остаётся в чекпоинте до следующего прогона.
+        if save_success and (batch.progress or batch.stats):
+            self.checkpoint_storage.record(
+                phone,
+                [point for point in batch.progress if point["chat_id"] not in failed_chats],
+                [stat["chat_id"] for stat in batch.stats
+                 if stat["chat_id"] not in failed_chats and not stat.get("partial")],
+            )
+
+        # 📊 Сохраняем статистику парсинга
+        for stat in batch.stats:
+            self.chat_scheduler.observe(phone, stat)
+        if run is not None and batch.stats:
+            run.add_stats(phone, batch.stats)
+            # 📡 Живой прогресс: последний чат аккаунта + общие итоги прогона
+            for stat in batch.stats:
+                event_bus.publish("chat", {
+                    "phone_number": phone,
+                    "chat_id": stat.get("chat_id"),
+                    "chat_name": stat.get("chat_name"),
+                    "status": stat.get("status"),
+                    "messages_found": stat.get("messages_found"),
+                    "messages_saved": stat.get("messages_saved"),
+                }, key=phone)
+            self._publish_status(run)
+        if batch.stats:
+            formatted_logs = [
+                _format_log(stat, phone, parsing_session_id, session_start_time)
+                for stat in batch.stats
+            ]
+            logs_success = await self.supabase_client.insert_parsing_logs_batch_async(formatted_logs)
+            if logs_success:
+                print(f"📊 Saved statistics for {len(batch.stats)} chats")
+            else:
+                print(f"⚠️ WARNING: Failed to save parsing statistics for {len(batch.stats)} chats!")
+
+    def _publish_status(self, run: Optional[_RunSummary] = None) -> None:
+        event_bus.publish("parser", {"is_running": self._is_running, **(run.progress() if run else {})})
+
     def stop_parsing(self):
         """Останавливает текущий парсинг"""
         if self._is_running:
@@ -0,0 +1,227 @@
+"""
+Shared cache of user bios / channel descriptions.
+
+Every message row carries the sender's bio, which costs one `get_chat(uid)`
+per unseen sender — one of the most frequent FloodWait sources. The batch
+parser used to build a fresh dict per run and RealtimeService kept its own
+dict that never evicted anything, so the same active users were looked up
+again on every run and from every account.
+
+One ProfileCache per process now serves both paths:
+
+- entries expire after PROFILE_CACHE_TTL_SECONDS, so bios do get refreshed;
+- at most PROFILE_CACHE_MAX_SIZE entries, least recently used evicted first;
+- results are kept apart: "no bio" is a real answer and cached for the full
+  TTL, a failed lookup (privacy, invalid peer) for PROFILE_CACHE_ERROR_TTL,
+  and a FloodWait only until the wait is over — it says nothing about the
+  user, so it must not stick as "no bio";
+- concurrent lookups of the same id share one request;
+- resolved entries are written to a local SQLite file (PROFILE_CACHE_DB,
+  empty to disable) and loaded back on start.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram.errors import FloodWait
+
+from backend.services.client_pool import account_key
+from backend.services.rate_limiter import flood_limiter
+
+PROFILE_CACHE_MAX_SIZE = int(os.getenv("PROFILE_CACHE_MAX_SIZE", "50000"))
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", str(24 * 3600)))
+PROFILE_CACHE_ERROR_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_ERROR_TTL_SECONDS", str(3600)))
+PROFILE_CACHE_DB = os.getenv("PROFILE_CACHE_DB", "profile_cache.sqlite3")
+
+# Resolved entries are written to SQLite in small batches, not per lookup.
+PERSIST_BATCH_SIZE = 50
+
+FULL_USER_METHOD = "users.GetFullUser"
+
+# Entry status
+STATUS_OK = "ok"          # bio известно (в том числе None — био нет)
+STATUS_ERROR = "error"    # запрос не удался: приватность, невалидный пир
+STATUS_FLOOD = "flood"    # FloodWait — повторить после ожидания
+
+
+def _log(msg: str) -> None:
+    print(f">>> [profiles] {msg}", file=sys.stderr, flush=True)
+
+
+class ProfileCache:
+    def __init__(self, max_size: int = PROFILE_CACHE_MAX_SIZE, db_path: Optional[str] = PROFILE_CACHE_DB):
+        self.max_size = max(1, max_size)
+        # uid -> (status, bio, expires_at, fetched_at)
+        self._entries: "OrderedDict[int, Tuple[str, Optional[str], float, float]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._pending_writes: List[tuple] = []
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.flood_waits = 0
+        self.loaded = 0
+        if db_path:
+            self._open_db(db_path)
+
+    # ── lookups ──────────────────────────────────────────────────────
+
+    def get(self, uid: int, count: bool = False) -> Tuple[bool, Optional[str]]:
+        """(найдено в кэше, bio). Просроченные записи считаются промахом.
+        count=True — учесть обращение в hits/misses."""
+        entry = self._entries.get(uid)
+        if entry is not None and time.time() >= entry[2]:
+            del self._entries[uid]
+            entry = None
+        if count:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return False, None
+        self._entries.move_to_end(uid)
+        return True, entry[1]
+
+    async def resolve(self, client, uid: int, is_channel: bool = False, limiter=None) -> Optional[str]:
+        """Bio пользователя или описание канала: из кэша или одним get_chat().
+        Никогда не бросает исключений — при ошибке возвращает None.
+        limiter (AdaptiveConcurrencyLimiter) получает обратную связь о FloodWait."""
+        found, bio = self.get(uid, count=True)
+        if found:
+            return bio
+
+        pending = self._inflight.get(uid)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[uid] = future
+        bio = None
+        try:
+            bio = await self._fetch(client, uid, is_channel, limiter)
+        finally:
+            self._inflight.pop(uid, None)
+            future.set_result(bio)
+        return bio
+
+    async def _fetch(self, client, uid: int, is_channel: bool, limiter=None) -> Optional[str]:
+        account = account_key(client)
+        try:
+            # Фоновый путь может подождать свой токен сколько нужно
+            await flood_limiter.acquire(account, FULL_USER_METHOD, max_wait=None)
+            full = await client.get_chat(uid)
+        except FloodWait as e:
+            self.flood_waits += 1
+            flood_limiter.on_flood_wait(account, FULL_USER_METHOD, e.value)
+            self.put(uid, None, STATUS_FLOOD, ttl=max(1, int(e.value)))
+            if limiter is not None:
+                limiter.on_flood_wait(e.value)
+            return None
+        except Exception:
+            self.put(uid, None, STATUS_ERROR)
+            return None
+        if is_channel:
+            bio = getattr(full, 'description', None) or None
+        else:
+            bio = getattr(full, 'bio', None) or getattr(full, 'about', None) or None
+        self.put(uid, bio, STATUS_OK)
+        flood_limiter.on_success(account, FULL_USER_METHOD)
+        if limiter is not None:
+            limiter.on_success()
+        return bio
+
+    def put(self, uid: int, bio: Optional[str], status: str = STATUS_OK, ttl: Optional[int] = None) -> None:
+        if ttl is None:
+            ttl = PROFILE_CACHE_TTL_SECONDS if status == STATUS_OK else PROFILE_CACHE_ERROR_TTL_SECONDS
+        now = time.time()
+        self._entries[uid] = (status, bio, now + ttl, now)
+        self._entries.move_to_end(uid)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        if status == STATUS_OK and self._db is not None:
+            self._pending_writes.append((uid, bio, now))
+            if len(self._pending_writes) >= PERSIST_BATCH_SIZE:
+                self.flush()
+
+    def fill_missing(self, rows: List[dict]) -> int:
+        """Проставляет bio строкам, у которых его нет, если профиль уже
+        известен (разрешён в фоне, пока строка ждала записи)."""
+        filled = 0
+        for row in rows:
+            if row.get("bio") is None and row.get("user_id") is not None:
+                found, bio = self.get(row["user_id"])
+                if found and bio is not None:
+                    row["bio"] = bio
+                    filled += 1
+        return filled
+
+    # ── persistence ──────────────────────────────────────────────────
+
+    def _open_db(self, path: str) -> None:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                " uid INTEGER PRIMARY KEY, bio TEXT, fetched_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+            self._load()
+        except sqlite3.Error as e:
+            _log(f"persistence disabled ({path}): {e}")
+            self._db = None
+
+    def _load(self) -> None:
+        cutoff = time.time() - PROFILE_CACHE_TTL_SECONDS
+        with self._db_lock:
+            self._db.execute("DELETE FROM profiles WHERE fetched_at < ?", (cutoff,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT uid, bio, fetched_at FROM profiles ORDER BY fetched_at DESC LIMIT ?",
+                (self.max_size,),
+            ).fetchall()
+        # Самые старые первыми — они первыми и вытесняются
+        for uid, bio, fetched_at in reversed(rows):
+            self._entries[uid] = (STATUS_OK, bio, fetched_at + PROFILE_CACHE_TTL_SECONDS, fetched_at)
+        self.loaded = len(rows)
+        if rows:
+            _log(f"loaded {len(rows)} cached profile(s)")
+
+    def flush(self) -> None:
+        """Записывает накопленные записи в SQLite."""
+        if self._db is None or not self._pending_writes:
+            return
+        rows, self._pending_writes = self._pending_writes, []
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO profiles (uid, bio, fetched_at) VALUES (?, ?, ?)", rows
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            _log(f"could not persist {len(rows)} profile(s): {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "flood_waits": self.flood_waits,
+            "loaded": self.loaded,
+            "persistent": self._db is not None,
+        }
+
+
+# Process-wide instance shared by the batch parser and RealtimeService.
+profile_cache = ProfileCache()
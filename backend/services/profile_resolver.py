@@ -0,0 +1,154 @@
+"""
+Background resolution of sender profiles (bio / channel description).
+
+A bio needs one full-user request per sender, so resolving it inline made
+message ingestion wait on Telegram latency and FloodWaits. The hot path now
+only looks at ProfileCache: on a hit the bio goes into the row, on a miss the
+row is saved with bio = NULL and the sender is handed to this resolver.
+
+The resolver collects unresolved ids, works through them in batches
+(PROFILE_RESOLVE_BATCH_SIZE ids or PROFILE_RESOLVE_BATCH_WAIT_SECONDS,
+whichever comes first) under a per-client AdaptiveConcurrencyLimiter, and
+then back-fills `bio` on already-saved rows (user_id match, bio IS NULL).
+Rows still waiting in a write queue pick the bio up from the cache via
+ProfileCache.fill_missing before they are inserted.
+
+Each id is resolved through the client that saw the message: that client
+has the sender's access hash in its session storage.
+"""
+import asyncio
+import os
+import sys
+import weakref
+from typing import Dict, Optional, Set, Tuple
+
+from backend.services.profile_cache import profile_cache
+from backend.services.rate_limiter import AdaptiveConcurrencyLimiter
+
+PROFILE_RESOLVE_BATCH_SIZE = int(os.getenv("PROFILE_RESOLVE_BATCH_SIZE", "50"))
+PROFILE_RESOLVE_BATCH_WAIT_SECONDS = float(os.getenv("PROFILE_RESOLVE_BATCH_WAIT_SECONDS", "2"))
+PROFILE_RESOLVE_CONCURRENCY = max(1, int(os.getenv("PROFILE_RESOLVE_CONCURRENCY", "2")))
+
+# Beyond this many waiting ids new ones are dropped: their rows keep
+# bio = NULL and the sender is queued again the next time they post.
+PROFILE_RESOLVE_QUEUE_SIZE = 10000
+
+
+def _log(msg: str) -> None:
+    print(f">>> [profile-resolver] {msg}", file=sys.stderr, flush=True)
+
+
+class ProfileResolver:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[int] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self._limiters: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._supabase_client = None
+        self.resolved = 0
+        self.backfilled = 0
+        self.dropped = 0
+
+    def attach(self, supabase_client) -> None:
+        """SupabaseClient для back-fill уже сохранённых строк."""
+        self._supabase_client = supabase_client
+
+    # ── hot path ─────────────────────────────────────────────────────
+
+    def lookup(self, client, uid: int, is_channel: bool = False) -> Optional[str]:
+        """Bio из кэша без обращения к Telegram. При промахе ставит id в
+        очередь на фоновое разрешение и возвращает None."""
+        found, bio = profile_cache.get(uid, count=True)
+        if found:
+            return bio
+        self.enqueue(client, uid, is_channel)
+        return None
+
+    def enqueue(self, client, uid: int, is_channel: bool = False) -> None:
+        if uid in self._pending:
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((client, uid, is_channel))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self._pending.add(uid)
+
+    # ── worker ───────────────────────────────────────────────────────
+
+    def _ensure_worker(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=PROFILE_RESOLVE_QUEUE_SIZE)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PROFILE_RESOLVE_BATCH_WAIT_SECONDS
+        while len(batch) < PROFILE_RESOLVE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._resolve_batch(batch)
+            except Exception as e:  # noqa: BLE001
+                _log(f"batch of {len(batch)} failed: {e}")
+            finally:
+                for _, uid, _ in batch:
+                    self._pending.discard(uid)
+
+    def _limiter_for(self, client) -> AdaptiveConcurrencyLimiter:
+        limiter = self._limiters.get(client)
+        if limiter is None:
+            limiter = AdaptiveConcurrencyLimiter(PROFILE_RESOLVE_CONCURRENCY)
+            self._limiters[client] = limiter
+        return limiter
+
+    async def _resolve_one(self, client, uid: int, is_channel: bool) -> Tuple[int, Optional[str]]:
+        limiter = self._limiter_for(client)
+        async with limiter:
+            bio = await profile_cache.resolve(client, uid, is_channel=is_channel, limiter=limiter)
+        return uid, bio
+
+    async def _resolve_batch(self, batch: list) -> None:
+        results = await asyncio.gather(
+            *(self._resolve_one(client, uid, is_channel) for client, uid, is_channel in batch)
+        )
+        self.resolved += len(results)
+        bios: Dict[int, str] = {uid: bio for uid, bio in results if bio}
+        profile_cache.flush()
+        if bios and self._supabase_client is not None:
+            updated = await self._supabase_client.backfill_bios_async(bios)
+            self.backfilled += updated
+            _log(f"resolved {len(results)} profile(s), {len(bios)} with bio, back-filled {updated} row(s)")
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def status(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "resolved": self.resolved,
+            "backfilled": self.backfilled,
+            "dropped": self.dropped,
+        }
+
+
+profile_resolver = ProfileResolver()
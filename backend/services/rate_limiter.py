@@ -0,0 +1,253 @@
+"""
+FloodWait-aware concurrency and rate control for Telegram calls.
+
+One Telegram session can serve several requests at once, but Telegram
+answers over-eager clients with FloodWait. The limiter below lets the chat
+workers of a single account run in parallel and backs off automatically:
+every FloodWait halves the allowed parallelism and pauses all workers for the
+requested time, and a streak of clean calls grows parallelism back one slot
+at a time (AIMD, the same idea TCP uses for congestion control).
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+
+class AdaptiveConcurrencyLimiter:
+    """Concurrency gate shared by all workers that use one Telegram client."""
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self._limit = self.max_concurrency
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._clean_streak = 0
+        self._flood_waits = 0
+        self._cond = asyncio.Condition()
+
+    # ── gate ─────────────────────────────────────────────────────────
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self._in_flight < self._limit:
+                    self._in_flight += 1
+                    return
+                await self._cond.wait()
+
+    async def release(self) -> None:
+        async with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+        return False
+
+    # ── feedback ─────────────────────────────────────────────────────
+
+    def on_success(self) -> None:
+        """A call finished without throttling — slowly widen the gate."""
+        self._clean_streak += 1
+        if self._limit < self.max_concurrency and self._clean_streak >= self._limit:
+            self._limit += 1
+            self._clean_streak = 0
+
+    def on_flood_wait(self, seconds: float) -> None:
+        """Telegram asked us to slow down — halve parallelism and pause
+        every worker until the wait is over."""
+        self._flood_waits += 1
+        self._clean_streak = 0
+        self._limit = max(self.min_concurrency, self._limit // 2)
+        if seconds and seconds > 0:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def status(self) -> dict:
+        return {
+            "limit": self._limit,
+            "max": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "flood_waits": self._flood_waits,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
+
+
+# ── per (account, method) token buckets ─────────────────────────────────
+#
+# Telegram's flood limits are per session and per API method: a FloodWait on
+# messages.GetReplies says nothing about messages.GetHistory. Each pair gets
+# its own token bucket that paces calls below the limit and learns from the
+# FloodWaits Telegram still returns: the rate is halved and the bucket is
+# blocked for the requested time, then the rate creeps back up after a run
+# of clean calls. Callers that would have to wait longer than they can
+# afford get RateLimited and move on to other work instead of sleeping.
+
+# method -> (calls per second, burst). Conservative defaults; the buckets
+# adapt downwards from here on FloodWait.
+METHOD_RATES = {
+    "messages.GetHistory": (3.0, 5),
+    "messages.GetReplies": (3.0, 5),
+    "messages.GetDialogs": (1.0, 3),
+    "channels.GetForumTopics": (1.0, 2),
+    "channels.GetFullChannel": (2.0, 4),
+    "users.GetFullUser": (1.0, 3),
+}
+DEFAULT_METHOD_RATE = (2.0, 4)
+
+MIN_RATE = 0.05               # never slower than one call per 20 s
+RATE_RECOVERY_STREAK = 20     # clean calls before the rate grows again
+RATE_RECOVERY_STEP = 0.1      # ... by this share of the default rate
+
+# How long a caller waits in place for a token or a short FloodWait before
+# getting RateLimited.
+INLINE_WAIT_SECONDS = float(os.getenv("TG_RATE_INLINE_WAIT_SECONDS", "5"))
+
+
+class RateLimited(Exception):
+    """The (account, method) bucket is blocked for longer than the caller
+    agreed to wait. retry_after — seconds until it opens again."""
+
+    def __init__(self, account: str, method: str, retry_after: float):
+        self.account = account
+        self.method = method
+        self.retry_after = retry_after
+        super().__init__(f"{method} rate-limited for {account}: retry in {retry_after:.0f}s")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.default_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._clean_streak = 0
+        self.calls = 0
+        self.flood_waits = 0
+        self.last_flood_wait = 0
+        self.max_flood_wait = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a call may be made (0 — right now)."""
+        now = time.monotonic()
+        self._refill(now)
+        blocked = self._blocked_until - now
+        deficit = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        return max(blocked, deficit, 0.0)
+
+    async def acquire(self, max_wait: Optional[float] = None) -> None:
+        """Takes a token, sleeping up to max_wait (None — without limit);
+        raises RateLimited if the wait would be longer."""
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self._tokens -= 1
+                self.calls += 1
+                return
+            if max_wait is not None and wait > max_wait:
+                raise RateLimited("", "", wait)
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        self._clean_streak += 1
+        if self.rate < self.default_rate and self._clean_streak >= RATE_RECOVERY_STREAK:
+            self.rate = min(self.default_rate, self.rate + self.default_rate * RATE_RECOVERY_STEP)
+            self._clean_streak = 0
+
+    def on_flood_wait(self, seconds: float) -> None:
+        self.flood_waits += 1
+        self.last_flood_wait = seconds
+        self.max_flood_wait = max(self.max_flood_wait, seconds)
+        self._clean_streak = 0
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self._tokens = 0.0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + max(0.0, seconds))
+
+    def status(self) -> dict:
+        return {
+            "rate_per_sec": round(self.rate, 3),
+            "default_rate_per_sec": self.default_rate,
+            "burst": self.burst,
+            "tokens": round(min(self.burst, self._tokens), 2),
+            "blocked_for": round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            "calls": self.calls,
+            "flood_waits": self.flood_waits,
+            "last_flood_wait": self.last_flood_wait,
+            "max_flood_wait": self.max_flood_wait,
+        }
+
+
+class FloodLimiter:
+    """Registry of TokenBuckets keyed by (account, method)."""
+
+    def __init__(self):
+        self._buckets: dict = {}
+
+    def bucket(self, account: str, method: str) -> TokenBucket:
+        key = (account or "", method)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = METHOD_RATES.get(method, DEFAULT_METHOD_RATE)
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    async def acquire(self, account: str, method: str, max_wait: float = INLINE_WAIT_SECONDS) -> None:
+        try:
+            await self.bucket(account, method).acquire(max_wait)
+        except RateLimited as e:
+            raise RateLimited(account, method, e.retry_after) from None
+
+    def on_success(self, account: str, method: str) -> None:
+        self.bucket(account, method).on_success()
+
+    def on_flood_wait(self, account: str, method: str, seconds: float) -> None:
+        self.bucket(account, method).on_flood_wait(seconds)
+        print(f">>> [limits] FloodWait {seconds}s on {method} for {account}", flush=True)
+
+    async def call(self, account: str, method: str, fn, max_wait: float = INLINE_WAIT_SECONDS):
+        """Runs `await fn()` paced by the (account, method) bucket.
+
+        A FloodWait is recorded and the call retried once if the wait fits
+        into max_wait; otherwise RateLimited is raised so the caller can
+        switch to other work.
+        """
+        from pyrogram.errors import FloodWait
+
+        for _ in range(2):
+            await self.acquire(account, method, max_wait)
+            try:
+                result = await fn()
+            except FloodWait as e:
+                self.on_flood_wait(account, method, e.value)
+                continue
+            self.on_success(account, method)
+            return result
+        raise RateLimited(account, method, self.bucket(account, method).delay())
+
+    def status(self) -> dict:
+        accounts: dict = {}
+        for (account, method), bucket in sorted(self._buckets.items()):
+            accounts.setdefault(account, {})[method] = bucket.status()
+        return accounts
+
+
+# Process-wide: every client of an account shares its buckets.
+flood_limiter = FloodLimiter()
@@ -1,33 +1,50 @@
 from pyrogram import Client, filters
-from pyrogram.errors import FloodWait, AuthKeyUnregistered
+from pyrogram.errors import AuthKeyUnregistered
 from pyrogram.handlers import MessageHandler
 from backend.database.account_storage import AccountStorage
 from backend.database.supabase_client import SupabaseClient
+from backend.database.message_spool import MessageSpool, default_spool
+from backend.database.seen_messages import seen_messages
+from backend.services.account_leases import account_leases
+from backend.services.client_pool import client_pool
+from backend.services.event_bus import event_bus
+from backend.services.message_batcher import MessageBatcher
+from backend.services.profile_cache import profile_cache
+from backend.services.profile_resolver import profile_resolver
+from backend.services.response_cache import response_cache
 from datetime import datetime, timezone
 import asyncio
-import os
 import sys
 
 
 class RealtimeService:
     """Persistent Telegram clients that receive messages in real-time via event handlers."""
 
-    def __init__(self, supabase_client: SupabaseClient):
+    def __init__(self, supabase_client: SupabaseClient, spool: MessageSpool | None = None):
         self.supabase_client = supabase_client
         self.account_storage = AccountStorage()
-        self.sessions_dir = "sessions"
 
         self._clients: dict[str, Client] = {}
+        self._handlers: dict[str, MessageHandler] = {}
         self._running = False
+        # start/stop/restart come from the API, the batch run and lease
+        # changes at once; one at a time, or two starts attach two handlers.
+        self._lifecycle_lock = asyncio.Lock()
         self._msg_count = 0
         self._errors: list[str] = []
         self._started_at: datetime | None = None
+        self._last_flush: dict | None = None
 
-        self._bio_cache: dict[int, str | None] = {}
         self._chat_title_cache: dict[int, tuple[str, str | None]] = {}
 
-        self._save_queue: list[dict] = []
-        self._flush_task: asyncio.Task | None = None
+        # Phones this process listens for (worker mode), None — all.
+        self.account_filter: set[str] | None = None
+
+        self._batcher = MessageBatcher(self._write_batch, name="realtime",
+                                       spool=spool if spool is not None else default_spool())
+
+        # The pool may close or reconnect a client we listen on.
+        client_pool.on_replace(self._on_client_replaced)
 
     # ── public status ────────────────────────────────────────────────
 
@@ -39,14 +56,43 @@ class RealtimeService:
             "running": self._running,
             "accounts": len(self._clients),
             "messages_received": self._msg_count,
-            "queue_size": len(self._save_queue),
+            "queue_size": self._batcher.status()["queued"],
+            "batcher": self._batcher.status(),
             "started_at": self._started_at.isoformat() if self._started_at else None,
             "recent_errors": self._errors[-5:],
+            "dedup_cache": seen_messages.stats(),
+            "profile_cache": profile_cache.stats(),
+            "profile_resolver": profile_resolver.status(),
         }
 
+    def _publish_status(self) -> None:
+        """Лёгкий снимок для живого дашборда (событие "realtime")."""
+        event_bus.publish("realtime", {
+            "running": self._running,
+            "accounts": len(self._clients),
+            "messages_received": self._msg_count,
+            "errors": len(self._errors),
+            "last_error": self._errors[-1] if self._errors else None,
+            "last_flush": self._last_flush,
+        })
+
     # ── lifecycle ────────────────────────────────────────────────────
 
     async def start(self):
+        async with self._lifecycle_lock:
+            await self._start()
+
+    async def stop(self):
+        async with self._lifecycle_lock:
+            await self._stop()
+
+    async def restart(self):
+        async with self._lifecycle_lock:
+            await self._stop()
+            await asyncio.sleep(1)
+            await self._start()
+
+    async def _start(self):
         if self._running:
             return
 
@@ -54,14 +100,22 @@ class RealtimeService:
         print(">>> REALTIME SERVICE STARTING <<<", flush=True)
         print("=" * 60, flush=True)
 
+        # Replays messages spooled by a previous run even if no account
+        # is connected now.
+        self._batcher.start()
+
         accounts = self.account_storage.get_all_connected_accounts()
+        if self.account_filter is not None:
+            accounts = [a for a in accounts if a.get("phone_number") in self.account_filter]
+        else:
+            # Только аккаунты, аренду которых держит этот узел
+            accounts = await account_leases.filter_accounts(accounts)
         if not accounts:
             print(">>> No connected accounts, realtime not started", flush=True)
             return
 
         self._running = True
         self._started_at = datetime.now(timezone.utc)
-        self._flush_task = asyncio.create_task(self._flush_loop())
 
         for account in accounts:
             try:
@@ -72,38 +126,35 @@ class RealtimeService:
                 self._errors.append(err)
 
         total = len(self._clients)
+        response_cache.invalidate("schedule")
+        self._publish_status()
         print(f">>> REALTIME SERVICE STARTED — {total} client(s) connected", flush=True)
 
-    async def stop(self):
+    async def _stop(self):
         if not self._running:
             return
 
         print("\n>>> REALTIME SERVICE STOPPING...", flush=True)
         self._running = False
 
-        if self._flush_task:
-            self._flush_task.cancel()
-            try:
-                await self._flush_task
-            except asyncio.CancelledError:
-                pass
-
-        await self._flush_queue()
-
+        # Clients belong to the shared pool (batch parsing and the API keep
+        # using them) — only detach our handlers here.
         for phone, client in list(self._clients.items()):
+            handler = self._handlers.pop(phone, None)
             try:
-                await client.stop()
-                print(f">>> Disconnected {phone}", flush=True)
+                if handler is not None:
+                    client.remove_handler(handler)
+                print(f">>> Detached realtime handler from {phone}", flush=True)
             except Exception as e:
-                print(f">>> Error disconnecting {phone}: {e}", flush=True)
+                print(f">>> Error detaching {phone}: {e}", flush=True)
 
         self._clients.clear()
-        print(">>> REALTIME SERVICE STOPPED", flush=True)
+        response_cache.invalidate("schedule")
+        self._publish_status()
 
-    async def restart(self):
-        await self.stop()
-        await asyncio.sleep(1)
-        await self.start()
+        # Handlers are detached, nothing new comes in — write what is queued.
+        await self._batcher.drain()
+        print(">>> REALTIME SERVICE STOPPED", flush=True)
 
     # ── client management ────────────────────────────────────────────
 
@@ -113,36 +164,45 @@ class RealtimeService:
         api_hash = account["api_hash"]
         account_id = account["id"]
 
-        safe_phone = phone.replace("+", "").replace("-", "").replace(" ", "")
-        session_path = os.path.join(self.sessions_dir, safe_phone)
-
-        if not os.path.exists(f"{session_path}.session"):
-            raise FileNotFoundError(f"Session file not found: {session_path}.session")
-
         selected_chats = self.account_storage.get_selected_chats(account_id)
         if not selected_chats:
             print(f">>> No selected chats for {phone}, skipping realtime", flush=True)
             return
 
-        client = Client(
-            session_path,
-            api_id=api_id,
-            api_hash=api_hash,
-        )
+        # Shared, already-started client — the same one batch parsing leases.
+        client = await client_pool.get(api_id, api_hash, phone)
 
         chat_filter = filters.chat(selected_chats) & (filters.text | filters.caption)
 
         async def on_message(c: Client, message):
             await self._handle_message(c, message, phone)
 
-        client.add_handler(MessageHandler(on_message, chat_filter))
-
-        await client.start()
+        handler = MessageHandler(on_message, chat_filter)
+        client.add_handler(handler)
+        self._handlers[phone] = handler
         self._clients[phone] = client
 
         chat_count = len(selected_chats)
         print(f">>> Client {phone} connected, listening to {chat_count} chats", flush=True)
 
+    def _on_client_replaced(self, phone: str, client: Client | None):
+        handler = self._handlers.get(phone)
+        if phone not in self._clients or handler is None:
+            return
+        if client is None:
+            # Сессию закрыли (перелогин, невалидная сессия) — аккаунт больше не слушаем
+            self._clients.pop(phone, None)
+            self._handlers.pop(phone, None)
+            err = f"Client {phone} closed by pool, realtime detached"
+            print(f">>> {err}", flush=True)
+            self._errors.append(err)
+        else:
+            # Пул переподключил аккаунт — вешаем обработчик на новый клиент
+            client.add_handler(handler)
+            self._clients[phone] = client
+            print(f">>> Client {phone} reconnected, realtime handler re-attached", flush=True)
+        self._publish_status()
+
     # ── message handler ──────────────────────────────────────────────
 
     async def _handle_message(self, client: Client, message, phone: str):
@@ -185,13 +245,16 @@ class RealtimeService:
                 "message": message_text,
             }
 
-            self._save_queue.append(msg_data)
+            # Waits here when the write queue is full (database too slow)
+            await self._batcher.put(msg_data)
             self._msg_count += 1
+            self._publish_status()
 
         except Exception as e:
             err = f"handle_message error: {e}"
             print(f">>> RT: {err}", file=sys.stderr, flush=True)
             self._errors.append(err)
+            self._publish_status()
 
     async def _extract_user_info(self, client: Client, message) -> dict | None:
         if message.from_user:
@@ -202,7 +265,7 @@ class RealtimeService:
                 "last_name": message.from_user.last_name,
                 "username": message.from_user.username,
             }
-            info["bio"] = await self._get_bio(client, uid, is_channel=False)
+            info["bio"] = self._get_bio(client, uid, is_channel=False)
             return info
 
         if hasattr(message, 'sender_chat') and message.sender_chat:
@@ -213,29 +276,15 @@ class RealtimeService:
                 "last_name": None,
                 "username": getattr(message.sender_chat, 'username', None),
             }
-            info["bio"] = await self._get_bio(client, sid, is_channel=True)
+            info["bio"] = self._get_bio(client, sid, is_channel=True)
             return info
 
         return None
 
-    async def _get_bio(self, client: Client, uid: int, is_channel: bool) -> str | None:
-        if uid in self._bio_cache:
-            return self._bio_cache[uid]
-
-        try:
-            full = await client.get_chat(uid)
-            if is_channel:
-                bio = getattr(full, 'description', None)
-            else:
-                bio = getattr(full, 'bio', None) or getattr(full, 'about', None)
-            self._bio_cache[uid] = bio
-            return bio
-        except FloodWait:
-            self._bio_cache[uid] = None
-            return None
-        except Exception:
-            self._bio_cache[uid] = None
-            return None
+    def _get_bio(self, client: Client, uid: int, is_channel: bool) -> str | None:
+        # Never blocks on Telegram: unknown senders are resolved in the
+        # background and their saved rows back-filled.
+        return profile_resolver.lookup(client, uid, is_channel=is_channel)
 
     @staticmethod
     def _build_profile_link(user_info: dict, chat_title: str,
@@ -248,28 +297,26 @@ class RealtimeService:
             return f'Профиль скрыт. Сообщение в чате "{chat_title}": {link}'
         return f'Профиль скрыт. Сообщение в приватном чате "{chat_title}" (ID сообщения: {msg_id})'
 
-    # ── queue flush ──────────────────────────────────────────────────
-
-    async def _flush_loop(self):
-        """Flush accumulated messages every 3 seconds."""
-        while self._running:
-            await asyncio.sleep(3)
-            await self._flush_queue()
-
-    async def _flush_queue(self):
-        if not self._save_queue:
-            return
-
-        batch = self._save_queue[:]
-        self._save_queue.clear()
+    # ── batch writes ─────────────────────────────────────────────────
 
+    async def _write_batch(self, batch: list[dict]) -> bool:
+        """Called by MessageBatcher, possibly for several batches at once."""
+        profile_cache.fill_missing(batch)
+        success = False
         try:
-            success = self.supabase_client.insert_messages_batch(batch)
-            if success:
-                print(f">>> RT: Saved {len(batch)} messages in real-time", flush=True)
-            else:
-                self._errors.append(f"Failed to save batch of {len(batch)} messages")
+            # Пачку подтверждаем (и удаляем из спула), только если записано
+            # всё: повтор частично записанной пачки отсекут дубликаты
+            counts = await self.supabase_client.insert_messages_batch_counts_async(batch)
+            success = counts["errors"] == 0
+            if not success:
+                self._errors.append(f"Failed to save {counts['errors']} of {len(batch)} messages")
+            return success
         except Exception as e:
             err = f"flush error: {e}"
             print(f">>> RT: {err}", file=sys.stderr, flush=True)
             self._errors.append(err)
+            return False
+        finally:
+            self._last_flush = {"size": len(batch), "ok": bool(success),
+                                "at": datetime.now(timezone.utc).isoformat()}
+            self._publish_status()
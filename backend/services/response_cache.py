@@ -0,0 +1,143 @@
+"""
+In-process cache for the polled status and stats endpoints.
+
+Every open dashboard polls /api/parser/status and /api/parser/schedule/status
+every 5 s and /api/stats/parsing-sessions every 30 s, and each stats poll
+went to Supabase. With the cache:
+
+- a response is built once per RESPONSE_CACHE_*_TTL_SECONDS (per path and
+  query) and served from memory to every tab until it expires; concurrent
+  misses share one build, so Supabase sees one query per TTL however many
+  dashboards are open;
+- entries carry tags ("parser", "schedule", "sessions"). ParserService,
+  RealtimeService, WorkerPool and the control endpoints call `invalidate`
+  when what they report changes (a run starts or ends, realtime starts or
+  stops, the schedule is paused), so the TTL only bounds staleness of
+  counters nobody announces;
+- every response has an ETag (hash of the body). A poll that sends it back
+  in If-None-Match gets an empty 304 while the body is unchanged — browsers
+  do that on their own for `Cache-Control: no-cache` responses.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+RESPONSE_CACHE_STATUS_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_STATUS_TTL_SECONDS", "2"))
+RESPONSE_CACHE_STATS_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_STATS_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+
+class _Entry:
+    __slots__ = ("body", "etag", "stored_at", "ttl", "tags")
+
+    def __init__(self, body: bytes, ttl: float, tags: Tuple[str, ...]):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.stored_at = time.monotonic()
+        self.ttl = ttl
+        self.tags = tags
+
+    def fresh(self) -> bool:
+        return time.monotonic() - self.stored_at < self.ttl
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._building: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(request: Request) -> str:
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"{request.url.path}?{query}"
+
+    async def respond(self, request: Request, produce: Callable[[], Awaitable[Any]],
+                      ttl: float, tags: Iterable[str] = ()) -> Response:
+        """Ответ из кэша или produce(); 304, если If-None-Match совпал.
+        Исключения produce (HTTPException) не кэшируются."""
+        key = self._key(request)
+        entry = self._entries.get(key)
+        if entry is not None and entry.fresh():
+            self.hits += 1
+        else:
+            entry = await self._build(key, produce, ttl, tuple(tags))
+
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        # W/ — слабый ETag, если ответ по дороге сжимали
+        if_none_match = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+        if entry.etag in if_none_match:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    async def _build(self, key: str, produce, ttl: float, tags: Tuple[str, ...]) -> _Entry:
+        pending = self._building.get(key)
+        if pending is not None:
+            # Тот же ответ уже строится для другой вкладки — ждём его
+            self.hits += 1
+            await asyncio.wait([pending])
+            if pending.cancelled():  # запрос, который строил ответ, оборвался
+                return await self._build(key, produce, ttl, tags)
+            return pending.result()
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            data = await produce()
+            body = json.dumps(jsonable_encoder(data), ensure_ascii=False).encode("utf-8")
+            entry = _Entry(body, ttl, tags)
+            # invalidate() во время сборки: ответ отдаём, но не кэшируем
+            if self._building.get(key) is future:
+                if len(self._entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+                    self._evict()
+                self._entries[key] = entry
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # не логировать "never retrieved", если никто не ждал
+            raise
+        finally:
+            if self._building.get(key) is future:
+                del self._building[key]
+
+    def _evict(self) -> None:
+        for key in [k for k, e in self._entries.items() if not e.fresh()]:
+            del self._entries[key]
+        while len(self._entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, *tags: str) -> None:
+        """Сбрасывает ответы с любым из тегов (без тегов — все)."""
+        wanted = set(tags)
+        for key in [k for k, e in self._entries.items() if not wanted or wanted & set(e.tags)]:
+            del self._entries[key]
+        for key in list(self._building):
+            del self._building[key]  # строящиеся ответы уже могут быть устаревшими
+        self.invalidations += 1
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+        }
+
+
+# Process-wide cache shared by the routers.
+response_cache = ResponseCache()
@@ -2,8 +2,14 @@ from pyrogram import Client
 from pyrogram.errors import PhoneCodeInvalid, PhoneNumberInvalid, SessionPasswordNeeded, PhoneCodeExpired, FloodWait, PeerIdInvalid
 import asyncio
 import os
-from typing import Optional, Dict, List
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, Dict, List
 import json
+from backend.services.rate_limiter import AdaptiveConcurrencyLimiter, RateLimited, flood_limiter
+from backend.database.watermark_storage import watermark_key
+from backend.services.client_pool import NO_FLOOD_SLEEP, account_key, client_pool, is_auth_error
+from backend.services.dialog_cache import DIALOG_CACHE_TTL_SECONDS, dialog_cache
+from backend.services.profile_resolver import profile_resolver
 
 # Hard cap per single chat. pyrofork's internal FloodWait handler silently sleeps
 # 20+ seconds per channels.GetMessages, so without an outer cancel one stuck
@@ -11,12 +17,49 @@ import json
 # cancels that sleep and lets us move to the next chat.
 PER_CHAT_TIMEOUT_SECONDS = 25
 
+# How many chats of one account are fetched at the same time over its single
+# client. The shared AdaptiveConcurrencyLimiter shrinks this on FloodWait.
+PARSE_CHAT_CONCURRENCY = max(1, int(os.getenv("PARSER_CHAT_CONCURRENCY", "4")))
+
+# Incremental parsing. A source (chat or forum topic) with a saved high-water
+# mark is read back to that mark, but never further than the catch-up window,
+# so a long outage is filled in without replaying weeks of history. A read
+# that stops at HISTORY_MAX_MESSAGES first keeps its mark and leaves a
+# checkpoint at the oldest message read; the next run continues from there.
+CATCHUP_MAX_HOURS = int(os.getenv("PARSER_CATCHUP_MAX_HOURS", "72"))
+HISTORY_PAGE_SIZE = 100  # Telegram max for messages.GetHistory / GetReplies
+HISTORY_MAX_MESSAGES = int(os.getenv("PARSER_HISTORY_MAX_MESSAGES", "2000"))
+
+# Forum topics are listed with channels.GetForumTopics, a page at a time and
+# most recently active first. A topic whose last message is not newer than
+# its high-water mark (or is outside its window) is skipped without a history
+# request; the active ones are read this many at a time, paced per account by
+# flood_limiter like any other history read.
+FORUM_TOPICS_PAGE_SIZE = 100  # Telegram max for channels.GetForumTopics
+FORUM_MAX_TOPICS = int(os.getenv("PARSER_FORUM_MAX_TOPICS", "1000"))
+FORUM_TOPIC_CONCURRENCY = max(1, int(os.getenv("PARSER_FORUM_TOPIC_CONCURRENCY", "3")))
+
+# A partially read source reports its position (for resumable runs) every
+# this many messages — about once per history page.
+CHECKPOINT_EVERY_MESSAGES = HISTORY_PAGE_SIZE
+
+# A chat whose (account, method) bucket is blocked is put aside and retried
+# after the other chats, once the wait is over — if the wait is at most this
+# long. Longer FloodWaits skip the chat until the next run.
+RATE_LIMIT_DEFER_MAX_SECONDS = int(os.getenv("PARSER_RATE_LIMIT_DEFER_MAX_SECONDS", "120"))
+
+# Capacity of the queue between the chat workers and the consumer of
+# parse_messages. Bounds memory to roughly this many prepared messages.
+STREAM_QUEUE_SIZE = 500
+_STREAM_END = object()
+
 class TelegramService:
     def __init__(self):
         self.sessions_dir = "sessions"
         os.makedirs(self.sessions_dir, exist_ok=True)
         # Храним активные клиенты в памяти
         self._active_clients = {}  # {phone_number: client}
+        self._dialog_refreshes: Dict[str, asyncio.Task] = {}  # фоновые обновления DialogCache
     
     def get_session_path(self, phone_number: str) -> str:
         """Получает путь к файлу сессии (БЕЗ .session - Pyrogram добавит сам)"""
@@ -63,6 +106,10 @@ class TelegramService:
         client = None
         session_path = self.get_session_path(phone_number)
         
+        # Пул держит файл сессии открытым — освобождаем его перед перелогином
+        await client_pool.close(phone_number)
+        dialog_cache.invalidate(phone_number)
+        
         # СНАЧАЛА удаляем старую сессию если есть - это решает AUTH_KEY_UNREGISTERED
         for path in [session_path, f"{session_path}.session"]:
             if os.path.exists(path):
@@ -274,32 +321,34 @@ class TelegramService:
                     pass
             raise Exception(f"Verification error: {str(e)}")
     
-    async def _get_chats_raw(self, client) -> List[Dict]:
-        """Получает группы/каналы через raw Telegram API, минуя баг pyrofork с is_bot."""
+    async def _get_chats_raw(self, client, max_pages: Optional[int] = None) -> List[Dict]:
+        """Получает группы/каналы через raw Telegram API, минуя баг pyrofork с is_bot.
+        
+        max_pages ограничивает число страниц GetDialogs (по 100 диалогов);
+        None — весь список.
+        """
         from pyrogram.raw import functions, types
         
         chats = []
         offset_date = 0
         offset_id = 0
         offset_peer = types.InputPeerEmpty()
+        pages = 0
         
         while True:
-            try:
-                r = await client.invoke(
-                    functions.messages.GetDialogs(
-                        offset_date=offset_date,
-                        offset_id=offset_id,
-                        offset_peer=offset_peer,
-                        limit=100,
-                        hash=0,
-                    )
-                )
-            except FloodWait as fw:
-                import sys
-                print(f"⏳ Raw API FloodWait: waiting {fw.value}s...", file=sys.stderr, flush=True)
-                await asyncio.sleep(fw.value + 1)
-                continue
+            if max_pages is not None and pages >= max_pages:
+                break
+            # Темп задаёт flood_limiter; долгий FloodWait — RateLimited наверх
+            query = functions.messages.GetDialogs(
+                offset_date=offset_date,
+                offset_id=offset_id,
+                offset_peer=offset_peer,
+                limit=100,
+                hash=0,
+            )
+            r = await flood_limiter.call(account_key(client), "messages.GetDialogs", lambda: client.invoke(query, sleep_threshold=NO_FLOOD_SLEEP))
             
+            pages += 1
             raw_chats = {c.id: c for c in getattr(r, 'chats', [])}
             
             for d in r.dialogs:
@@ -353,13 +402,64 @@ class TelegramService:
                 break
         
         import sys
-        print(f"Raw API found {len(chats)} group/channel chats", file=sys.stderr, flush=True)
+        print(f"Raw API found {len(chats)} group/channel chats ({pages} page(s))", file=sys.stderr, flush=True)
         return chats
 
-    async def get_chats(self, api_id: str, api_hash: str, phone_number: str) -> List[Dict]:
-        """Получает список чатов для аккаунта"""
+    async def _load_dialogs(self, client, phone_number: str, force: bool = False,
+                            required_ids: Optional[List[int]] = None) -> List[Dict]:
+        """Список групп/каналов аккаунта через DialogCache: свежий кэш — ноль
+        запросов, устаревший — одна страница GetDialogs, полный обход только
+        без кэша, по force или раз в DIALOG_FULL_REFRESH_SECONDS.
+        
+        required_ids: чаты, которые должны быть в кэше пиров (выбранные для
+        парсинга). Если какого-то нет — полный обход, но не чаще раза в TTL,
+        чтобы покинутый чат не вызывал полный обход на каждом запуске.
+        """
+        entry = dialog_cache.load(phone_number)
+        mode = dialog_cache.refresh_mode(entry, force)
+        if mode != "full" and required_ids:
+            known = {c.get("id") for c in entry["chats"]}
+            missing = [cid for cid in required_ids if cid not in known]
+            if missing and time.time() - entry.get("full_at", 0) >= DIALOG_CACHE_TTL_SECONDS:
+                print(f">>> 🔎 {len(missing)} selected chat(s) not in dialog cache, full refresh", flush=True)
+                mode = "full"
+        if mode == "cached":
+            return entry["chats"]
+        
+        chats = await self._get_chats_raw(client, max_pages=1 if mode == "head" else None)
+        return dialog_cache.store(phone_number, chats, mode, previous=entry)["chats"]
+
+    def _schedule_dialog_refresh(self, api_id: str, api_hash: str, phone_number: str) -> None:
+        """Фоновое обновление устаревшего кэша: селектор чатов уже получил
+        закэшированный список и не ждёт Telegram."""
+        task = self._dialog_refreshes.get(phone_number)
+        if task is not None and not task.done():
+            return
+        
+        async def refresh():
+            try:
+                async with client_pool.lease(api_id, api_hash, phone_number) as client:
+                    await self._load_dialogs(client, phone_number)
+            except Exception as e:
+                print(f">>> ⚠️ Background dialog refresh failed for {phone_number}: {e}", flush=True)
+        
+        self._dialog_refreshes[phone_number] = asyncio.create_task(refresh())
+
+    async def get_chats(self, api_id: str, api_hash: str, phone_number: str, force_refresh: bool = False) -> List[Dict]:
+        """Получает список чатов для аккаунта
+        
+        Отвечает из DialogCache сразу; устаревший кэш обновляется в фоне.
+        force_refresh — полный обход диалогов в Telegram.
+        """
         import sys
-        import sqlite3
+        
+        if not force_refresh:
+            entry = dialog_cache.load(phone_number)
+            if entry is not None:
+                if not dialog_cache.is_fresh(entry):
+                    self._schedule_dialog_refresh(api_id, api_hash, phone_number)
+                print(f"GET_CHATS for {phone_number}: {len(entry['chats'])} chats from cache", file=sys.stderr, flush=True)
+                return entry["chats"]
         
         print(f"\n{'='*50}", file=sys.stderr, flush=True)
         print(f"GET_CHATS for {phone_number}", file=sys.stderr, flush=True)
@@ -378,99 +478,33 @@ class TelegramService:
             except Exception as e:
                 print(f"Error closing stale client: {e}", file=sys.stderr, flush=True)
         
-        # Retry logic для "database is locked" ошибки
-        max_retries = 5
-        retry_delay = 3  # секунды
+        # Клиент берётся из общего пула: он уже подключён (или подключится
+        # один раз) и не конкурирует с realtime за файл сессии. Темп GetDialogs
+        # задаёт flood_limiter — здесь не спим и не повторяем.
+        try:
+            async with client_pool.lease(api_id, api_hash, phone_number) as client:
+                print(f"Leased pooled client, getting dialogs via raw API...", file=sys.stderr, flush=True)
+                chats = await self._load_dialogs(client, phone_number, force=force_refresh)
+            
+            print(f"SUCCESS! Returning {len(chats)} chats", file=sys.stderr, flush=True)
+            return chats
         
-        # Попробуем включить WAL mode для сессии
-        session_path = self.get_session_path(phone_number)
-        session_file = f"{session_path}.session"
-        print(f"Session file: {session_file}", file=sys.stderr, flush=True)
-        print(f"Session exists: {os.path.exists(session_file)}", file=sys.stderr, flush=True)
+        except RateLimited as e:
+            print(f"Rate limited: {e}", file=sys.stderr, flush=True)
+            # Лучше устаревший список, чем никакого
+            entry = dialog_cache.load(phone_number)
+            if entry is not None:
+                return entry["chats"]
+            raise Exception(f"FloodWait: Please wait {e.retry_after:.0f} seconds and try again")
         
-        if os.path.exists(session_file):
-            try:
-                conn = sqlite3.connect(session_file, timeout=30)
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.close()
-                print(f"WAL mode enabled", file=sys.stderr, flush=True)
-            except Exception as wal_err:
-                print(f"Could not set WAL mode: {wal_err}", file=sys.stderr, flush=True)
-        
-        for attempt in range(max_retries):
-            client = None
-            try:
-                # Небольшая задержка перед попыткой (даёт время освободить файл)
-                if attempt > 0:
-                    await asyncio.sleep(1)
-                
-                print(f"Attempt {attempt + 1}/{max_retries}", file=sys.stderr, flush=True)
-                
-                # Используем существующую сессию без попытки переавторизации
-                client = await self.create_client(api_id, api_hash, phone_number, use_existing_session=True)
-                
-                if not client:
-                    raise Exception("Failed to create client")
-                
-                print(f"Client created, connecting...", file=sys.stderr, flush=True)
-                await client.connect()
-                
-                if not client.is_connected:
-                    raise Exception("Not connected")
-                
-                print(f"Connected! Getting dialogs via raw API...", file=sys.stderr, flush=True)
-                
-                chats = await self._get_chats_raw(client)
-                
-                print(f"Found {len(chats)} chats", file=sys.stderr, flush=True)
-                
-                await client.disconnect()
-                
-                # Даём время на освобождение файла
-                await asyncio.sleep(0.5)
-                
-                print(f"SUCCESS! Returning {len(chats)} chats", file=sys.stderr, flush=True)
-                return chats
-                
-            except FloodWait as fw:
-                # FloodWait - Telegram просит подождать
-                wait_time = fw.value
-                print(f"FloodWait: Telegram asks to wait {wait_time} seconds", file=sys.stderr, flush=True)
-                
-                if client:
-                    try:
-                        await client.disconnect()
-                    except:
-                        pass
-                
-                if attempt < max_retries - 1:
-                    print(f"Waiting {wait_time}s before retry...", file=sys.stderr, flush=True)
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    raise Exception(f"FloodWait: Please wait {wait_time} seconds and try again")
-                
-            except Exception as e:
-                error_msg = str(e)
-                print(f"Error: {error_msg}", file=sys.stderr, flush=True)
-                
-                # Закрываем клиент если открыт
-                if client:
-                    try:
-                        if client.is_connected:
-                            await client.disconnect()
-                        await asyncio.sleep(0.5)
-                    except:
-                        pass
-                
-                # Если "database is locked" - пробуем снова
-                if "database is locked" in error_msg.lower() and attempt < max_retries - 1:
-                    wait_time = retry_delay * (attempt + 1)
-                    print(f"Database locked, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr, flush=True)
-                    await asyncio.sleep(wait_time)
-                    continue
-                
-                raise Exception(f"Error getting chats: {error_msg}")
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Error: {error_msg}", file=sys.stderr, flush=True)
+            # Мёртвую сессию не оставляем в пуле; FloodWait и сетевые ошибки
+            # клиент не ломают — на нём может слушать realtime
+            if is_auth_error(e):
+                await client_pool.close(phone_number)
+            raise Exception(f"Error getting chats: {error_msg}")
     
     async def parse_messages(
         self, 
@@ -478,463 +512,688 @@ class TelegramService:
         api_hash: str, 
         phone_number: str, 
         chat_ids: List[int],
-        hours_back: int = 1
-    ) -> Dict:
-        """Парсит сообщения за последние N часов из указанных чатов
-        
-        Returns:
-            Dict with:
-                - messages: List[Dict] - список спарсенных сообщений
-                - stats: List[Dict] - статистика по каждому чату
+        hours_back: int = 1,
+        should_stop: Optional[Callable[[], bool]] = None,
+        watermarks: Optional[Dict[str, dict]] = None,
+        resume: Optional[Dict[str, dict]] = None
+    ) -> AsyncIterator[Dict]:
+        """Стримит новые сообщения из указанных чатов (async generator)
+        
+        Args:
+            hours_back: окно для источников без high-water mark (первый запуск)
+            should_stop: опциональный колбэк; проверяется перед каждым чатом,
+                         чтобы /api/parser/stop прерывал парсинг между чатами.
+            watermarks: отметки аккаунта из WatermarkStorage.get_account_marks;
+                        для источника с отметкой читаются только сообщения новее неё
+            resume: позиции недочитанных источников прерванного прогона
+                    (CheckpointStorage, ключ watermark_key); такой источник
+                    дочитывается с места остановки плюс то, что пришло после
+        
+        Yields:
+            {"type": "message", "data": Dict} - сообщение, готовое к записи
+            {"type": "chat_done", "stat": Dict, "watermarks": List[Dict]} -
+                чат дочитан: статистика чата и его новые отметки (chat_id,
+                topic_id, message_id, message_time). Все сообщения чата
+                выдаются ДО его chat_done; отметки сохранять только после
+                записи этих сообщений.
+            {"type": "progress", "checkpoint": Dict} - позиция недочитанного
+                источника; все сообщения до неё уже выданы. Фиксировать
+                тоже только после записи этих сообщений.
+        
+        Воркеры пишут в ограниченную очередь, поэтому память не зависит от
+        числа чатов. Генератор нужно закрывать (contextlib.aclosing), чтобы
+        при таймауте воркеры гарантированно остановились и аренда клиента
+        вернулась в пул.
         """
         from datetime import datetime, timedelta, timezone
-        import time
         
-        # Используем существующую сессию без попытки переавторизации
-        client = await self.create_client(api_id, api_hash, phone_number, use_existing_session=True)
+        try:
+            # Клиент из общего пула — без connect/handshake на каждый запуск;
+            # после парсинга он остаётся подключённым для realtime и API.
+            async with client_pool.lease(api_id, api_hash, phone_number) as client:
+                # 🔥 Пиры чатов должны быть в кэше Pyrogram - исправляет "Peer id invalid".
+                # Они хранятся в сессии, поэтому диалоги перечитываются только
+                # когда устарел DialogCache (обычно 0 или 1 запрос GetDialogs).
+                print(f"\n>>> 🔄 Checking dialog cache...", flush=True)
+                try:
+                    raw_chats = await self._load_dialogs(client, phone_number, required_ids=chat_ids)
+                    dialog_count = len(raw_chats)
+                    print(f">>> ✅ {dialog_count} chats known to Pyrogram cache", flush=True)
+                except Exception as e:
+                    print(f">>> ⚠️ Warning: Could not load dialogs: {e}", flush=True)
+
+                # Используем UTC время для сравнения
+                current_time = datetime.now(timezone.utc)
+                time_limit = current_time - timedelta(hours=hours_back)
+                catchup_limit = current_time - timedelta(hours=CATCHUP_MAX_HOURS)
+                watermarks = watermarks or {}
+
+                print(f"\n>>> CURRENT TIME: {current_time.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
+                print(f">>> TIME LIMIT: {time_limit.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
+                print(f">>> Will ONLY save messages AFTER {time_limit.strftime('%H:%M:%S')} "
+                      f"(or after the saved high-water mark, {len(watermarks)} known)", flush=True)
+
+                # 👷 Пул воркеров: несколько чатов читаются параллельно через один
+                # клиент. Лимитер общий для всех воркеров аккаунта — FloodWait в
+                # одном чате притормаживает всех, а не только его.
+                limiter = AdaptiveConcurrencyLimiter(PARSE_CHAT_CONCURRENCY)
+                chat_queue: asyncio.Queue = asyncio.Queue()
+                for chat_id in chat_ids:
+                    chat_queue.put_nowait((0.0, chat_id))
+
+                # 🌊 Ограниченная очередь к потребителю: если запись в БД не
+                # успевает, воркеры встают на put() и память не растёт.
+                out_queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+                async def emit(message_data: Dict):
+                    await out_queue.put({"type": "message", "data": message_data})
+
+                async def checkpoint(point: Dict):
+                    await out_queue.put({"type": "progress", "checkpoint": point})
+
+                resume = resume or {}
+
+                # ⏳ Чаты, упёршиеся в лимит: (когда можно повторить, chat_id).
+                # Воркеры не спят на FloodWait, а берут следующий чат; отложенные
+                # читаются вторым проходом после остальных.
+                loop = asyncio.get_running_loop()
+                deferred: List[tuple] = []
+
+                async def chat_worker(final_pass: bool):
+                    while True:
+                        try:
+                            retry_at, chat_id = chat_queue.get_nowait()
+                        except asyncio.QueueEmpty:
+                            return
+                        if should_stop and should_stop():
+                            print(f">>> STOP SIGNAL — leaving {phone_number} before chat {chat_id}", flush=True)
+                            return
+                        if retry_at > loop.time():
+                            await asyncio.sleep(retry_at - loop.time())
+                        chat_stat = await self._parse_chat(
+                            client, chat_id, time_limit, catchup_limit, watermarks,
+                            resume, limiter, emit, checkpoint
+                        )
+                        retry_after = chat_stat.pop("retry_after", None)
+                        if chat_stat["status"] == "rate_limited":
+                            if not final_pass and retry_after <= RATE_LIMIT_DEFER_MAX_SECONDS:
+                                print(f"⏳ Chat {chat_id} rate-limited, deferring {retry_after:.0f}s — moving on", flush=True)
+                                deferred.append((loop.time() + retry_after, chat_id))
+                                continue
+                            chat_stat["status"] = "error"
+                        await out_queue.put({
+                            "type": "chat_done",
+                            "stat": chat_stat,
+                            "watermarks": chat_stat.pop("watermarks", []),
+                        })
+
+                async def run_workers():
+                    try:
+                        worker_count = min(PARSE_CHAT_CONCURRENCY, len(chat_ids)) or 1
+                        print(f">>> Parsing {len(chat_ids)} chats with {worker_count} worker(s)", flush=True)
+                        await asyncio.gather(*(chat_worker(False) for _ in range(worker_count)))
+                        if deferred and not (should_stop and should_stop()):
+                            print(f">>> Retrying {len(deferred)} rate-limited chat(s) for {phone_number}", flush=True)
+                            for item in sorted(deferred):
+                                chat_queue.put_nowait(item)
+                            await asyncio.gather(*(chat_worker(True) for _ in range(min(worker_count, len(deferred)))))
+                        print(f">>> Limiter state for {phone_number}: {limiter.status()}", flush=True)
+                    finally:
+                        await out_queue.put(_STREAM_END)
+
+                producer = asyncio.create_task(run_workers())
+                try:
+                    while True:
+                        item = await out_queue.get()
+                        if item is _STREAM_END:
+                            break
+                        yield item
+                    # Пробрасываем исключение продюсера, если оно было
+                    await producer
+                finally:
+                    # Потребитель ушёл (таймаут, стоп, ошибка записи) — гасим воркеры
+                    if not producer.done():
+                        producer.cancel()
+                        try:
+                            await producer
+                        except (asyncio.CancelledError, Exception):
+                            pass
+        except Exception as e:
+            raise Exception(f"Error parsing messages: {str(e)}")
+
+    async def _parse_chat(self, client, chat_id: int, time_limit, catchup_limit, watermarks: Dict[str, dict],
+                          resume: Dict[str, dict], limiter: AdaptiveConcurrencyLimiter,
+                          emit: Callable[[Dict], Awaitable[None]],
+                          checkpoint: Callable[[Dict], Awaitable[None]]) -> Dict:
+        """Парсит один чат под лимитером, сообщения отдаёт через emit.
+        Возвращает chat_stat.
         
-        if not client:
-            raise Exception("Failed to create client")
+        Не спит на FloodWait: темп запросов задаёт flood_limiter, а если
+        бакет метода закрыт надолго, чат возвращается со статусом
+        "rate_limited" и chat_stat["retry_after"] — воркер отложит его и
+        возьмёт следующий.
+        """
+        from datetime import datetime, timezone
+        import time
         
+        chat_start_time = time.time()  # ⏱️ Время начала парсинга чата
+        chat_stat = {
+            "chat_id": chat_id,
+            "chat_name": f"Chat {chat_id}",
+            "messages_found": 0,
+            "messages_saved": 0,
+            "messages_skipped": 0,
+            "status": "success",
+            "error_type": None,
+            "error_message": None,
+            "started_at": datetime.now(timezone.utc),
+            "execution_time_seconds": 0,
+            "watermarks": []
+        }
         try:
-            await client.connect()
-            
-            if not client.is_connected:
-                raise Exception("Not connected")
-            
-            # 🔥 ЗАГРУЖАЕМ ВСЕ ЧАТЫ В КЭШ - исправляет "Peer id invalid"
-            print(f"\n>>> 🔄 Loading chats into Pyrogram cache...", flush=True)
+            async with limiter:
+                await self._fetch_chat(
+                    client, chat_id, chat_stat, time_limit, catchup_limit,
+                    watermarks, resume, emit, checkpoint
+                )
+            if chat_stat["status"] == "timeout":
+                # Залипание на __anext__ — сужаем параллелизм аккаунта
+                limiter.on_flood_wait(0)
+            else:
+                limiter.on_success()
+        except (RateLimited, FloodWait) as e:
+            # FloodWait сюда доходит от вызовов вне flood_limiter (resolve_peer и т.п.)
+            retry_after = e.retry_after if isinstance(e, RateLimited) else e.value
+            # Остальные чаты аккаунта ждут столько же — им ответили бы так же
+            limiter.on_flood_wait(retry_after)
+            chat_stat["status"] = "rate_limited"
+            chat_stat["retry_after"] = retry_after
+            chat_stat["watermarks"] = []  # чат дочитан не полностью
+            chat_stat["error_type"] = "FLOOD_WAIT"
+            chat_stat["error_message"] = f"Rate limited: {e}; retry in {retry_after:.0f}s"
+        except PeerIdInvalid:
+            # ⚠️ Чат недоступен (выгнали, удален, или нет прав)
+            print(f"⚠️ Chat {chat_id} is not accessible (kicked, deleted, or no access). Skipping.", flush=True)
+            chat_stat["status"] = "skipped"
+            chat_stat["error_type"] = "PeerIdInvalid"
+            chat_stat["error_message"] = "Chat not accessible (kicked, deleted, or no access)"
+        except Exception as e:
+            print(f"❌ Error parsing chat {chat_id}: {e}", flush=True)
+            chat_stat["status"] = "error"
+            chat_stat["error_type"] = "Other"
+            chat_stat["error_message"] = str(e)
+        
+        # ✅ Финализируем статистику
+        chat_stat["execution_time_seconds"] = time.time() - chat_start_time
+        chat_stat["finished_at"] = datetime.now(timezone.utc)
+        return chat_stat
+
+    async def _iter_history(self, client, chat_id: int, topic_id: Optional[int], min_id: int, offset_id: int = 0,
+                            state: Optional[Dict] = None):
+        """История чата или топика от новых к старым, только id > min_id
+        (и id < offset_id, если он задан — продолжение прерванного чтения).
+        Если чтение остановил HISTORY_MAX_MESSAGES, а не конец истории,
+        ставит state["capped"] = True.
+        
+        Аналог get_chat_history / get_discussion_replies, но min_id уходит
+        прямо в messages.GetHistory / messages.GetReplies: для чата без новых
+        сообщений Telegram отвечает пустой страницей, а не сотней уже
+        сохранённых сообщений.
+        """
+        from pyrogram import utils
+        from pyrogram.raw import functions
+        
+        peer = await client.resolve_peer(chat_id)
+        yielded = 0
+        while yielded < HISTORY_MAX_MESSAGES:
+            limit = min(HISTORY_PAGE_SIZE, HISTORY_MAX_MESSAGES - yielded)
+            if topic_id:
+                query = functions.messages.GetReplies(
+                    peer=peer, msg_id=topic_id, offset_id=offset_id, offset_date=0,
+                    add_offset=0, limit=limit, max_id=0, min_id=min_id, hash=0
+                )
+            else:
+                query = functions.messages.GetHistory(
+                    peer=peer, offset_id=offset_id, offset_date=0,
+                    add_offset=0, limit=limit, max_id=0, min_id=min_id, hash=0
+                )
+            method = "messages.GetReplies" if topic_id else "messages.GetHistory"
+            r = await flood_limiter.call(account_key(client), method, lambda: client.invoke(query, sleep_threshold=NO_FLOOD_SLEEP))
+            messages = await utils.parse_messages(client, r, replies=0)
+            if not messages:
+                return
+            for message in messages:
+                yield message
+            yielded += len(messages)
+            offset_id = messages[-1].id
+        if state is not None:
+            state["capped"] = True
+    
+    async def _iter_resumed(self, client, chat_id: int, topic_id: Optional[int], point: Dict,
+                            state: Optional[Dict] = None):
+        """Продолжение прерванного чтения источника: новые сообщения сверх
+        point["newest_id"], затем хвост ниже point["offset_id"]. Если новых
+        больше HISTORY_MAX_MESSAGES, хвост не читается (state["capped"])."""
+        async for message in self._iter_history(client, chat_id, topic_id, point["newest_id"], state=state):
+            yield message
+        if state is not None and state.get("capped"):
+            return
+        async for message in self._iter_history(client, chat_id, topic_id, point["min_id"], point["offset_id"], state=state):
+            yield message
+    
+    async def _fetch_chat(self, client, chat_id: int, chat_stat: Dict, time_limit, catchup_limit,
+                          watermarks: Dict[str, dict], resume: Dict[str, dict],
+                          emit: Callable[[Dict], Awaitable[None]],
+                          checkpoint: Callable[[Dict], Awaitable[None]]) -> None:
+        """Читает новые сообщения одного чата (или всех активных топиков форума).
+        
+        Источник с high-water mark читается до отметки (но не дальше
+        catchup_limit), без отметки — до time_limit. Заполняет chat_stat по
+        ходу, новые отметки кладёт в chat_stat["watermarks"], каждое
+        сообщение сразу отдаёт через emit, позицию чтения — через checkpoint;
+        источник из resume дочитывается с сохранённой позиции. Топики форума
+        без новых сообщений пропускаются без запроса истории, активные
+        читаются параллельно (до FORUM_TOPIC_CONCURRENCY). FloodWait /
+        PeerIdInvalid пробрасываются наверх в _parse_chat.
+        """
+        account = account_key(client)
+        chat = await flood_limiter.call(account, "channels.GetFullChannel", lambda: client.get_chat(chat_id))
+        chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
+        chat_username = chat.username if hasattr(chat, 'username') else None
+        
+        # Проверяем является ли чат форумом (с топиками)
+        is_forum = getattr(chat, 'is_forum', False)
+        
+        # Обновляем название чата в статистике
+        chat_stat["chat_name"] = chat_title
+        
+        # Счётчики по всему чату (все источники)
+        totals = {"checked": 0, "saved": 0, "skipped": 0}
+        
+        print(f"\n>>> Fetching history for chat '{chat_title}' (username: {chat_username})...", flush=True)
+        
+        if not is_forum:
+            # Обычный чат - один источник
+            await self._fetch_source(
+                client, chat_id, None, None, chat_title, chat_username, chat_stat, totals,
+                time_limit, catchup_limit, watermarks, resume, emit, checkpoint
+            )
+        else:
+            print(f"    📁 This is a FORUM with topics!", flush=True)
             try:
-                raw_chats = await self._get_chats_raw(client)
-                dialog_count = len(raw_chats)
-                print(f">>> ✅ Loaded {dialog_count} chats into cache via raw API", flush=True)
-            except Exception as e:
-                print(f">>> ⚠️ Warning: Could not load dialogs: {e}", flush=True)
+                topics = await self._get_forum_topics(client, chat_id, catchup_limit.timestamp())
+            except RateLimited:
+                raise
+            except Exception as forum_err:
+                print(f"    ⚠️ Could not get forum topics: {forum_err}", flush=True)
+                print(f"    📝 Will try to parse General topic only", flush=True)
+                topics = None
             
-            messages_data = []
-            parsing_stats = []  # 📊 Статистика по каждому чату
-            user_bio_cache = {}  # 🔄 Кэш био пользователей чтобы не вызывать get_chat() повторно
+            if topics is None:
+                sources = [{'id': None, 'title': None}]
+            else:
+                sources = self._active_topics(chat_id, topics, time_limit, catchup_limit, watermarks, resume)
+                print(f"    📋 Found {len(topics)} topics in forum, {len(sources)} with new messages", flush=True)
             
-            # Используем UTC время для сравнения
-            current_time = datetime.now(timezone.utc)
-            time_limit = current_time - timedelta(hours=hours_back)
+            semaphore = asyncio.Semaphore(FORUM_TOPIC_CONCURRENCY)
             
-            print(f"\n>>> CURRENT TIME: {current_time.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
-            print(f">>> TIME LIMIT: {time_limit.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
-            print(f">>> Will ONLY save messages AFTER {time_limit.strftime('%H:%M:%S')}", flush=True)
+            async def fetch_topic(topic: Dict) -> None:
+                async with semaphore:
+                    await self._fetch_source(
+                        client, chat_id, topic['id'], topic['title'], chat_title, chat_username,
+                        chat_stat, totals, time_limit, catchup_limit, watermarks, resume, emit, checkpoint
+                    )
             
-            for chat_id in chat_ids:
-                chat_start_time = time.time()  # ⏱️ Время начала парсинга чата
-                chat_stat = {
-                    "chat_id": chat_id,
-                    "chat_name": f"Chat {chat_id}",
-                    "messages_found": 0,
-                    "messages_saved": 0,
-                    "messages_skipped": 0,
-                    "status": "success",
-                    "error_type": None,
-                    "error_message": None,
-                    "started_at": datetime.now(timezone.utc),
-                    "execution_time_seconds": 0
-                }
-                try:
-                    chat = await client.get_chat(chat_id)
-                    chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
-                    chat_username = chat.username if hasattr(chat, 'username') else None
-                    
-                    # Проверяем является ли чат форумом (с топиками)
-                    is_forum = getattr(chat, 'is_forum', False)
-                    
-                    # Обновляем название чата в статистике
-                    chat_stat["chat_name"] = chat_title
-                    
-                    # Получаем сообщения с ограничением по времени
-                    messages_in_chat = 0
-                    skipped_old = 0
-                    total_checked = 0
-                    
-                    print(f"\n>>> Fetching history for chat '{chat_title}' (username: {chat_username})...", flush=True)
-                    
-                    if is_forum:
-                        print(f"    📁 This is a FORUM with topics!", flush=True)
-                    
-                    # Для форумов парсим все топики, для обычных чатов - обычная история
-                    message_sources = []
-                    
-                    if is_forum:
-                        # Получаем список топиков форума
-                        try:
-                            from pyrogram.raw import functions, types
-                            
-                            # Получаем топики через raw API
-                            result = await client.invoke(
-                                functions.channels.GetForumTopics(
-                                    channel=await client.resolve_peer(chat_id),
-                                    offset_date=0,
-                                    offset_id=0,
-                                    offset_topic=0,
-                                    limit=100
-                                )
-                            )
-                            
-                            topics = []
-                            if hasattr(result, 'topics'):
-                                for topic in result.topics:
-                                    if hasattr(topic, 'id'):
-                                        topic_title = getattr(topic, 'title', f'Topic {topic.id}')
-                                        topics.append({'id': topic.id, 'title': topic_title})
-                            
-                            print(f"    📋 Found {len(topics)} topics in forum", flush=True)
-                            
-                            # Добавляем каждый топик как источник сообщений
-                            for topic in topics:
-                                print(f"       - Topic: {topic['title']} (id: {topic['id']})", flush=True)
-                                message_sources.append({
-                                    'topic_id': topic['id'],
-                                    'topic_title': topic['title']
-                                })
-                                
-                        except Exception as forum_err:
-                            print(f"    ⚠️ Could not get forum topics: {forum_err}", flush=True)
-                            print(f"    📝 Will try to parse General topic only", flush=True)
-                            message_sources.append({'topic_id': None, 'topic_title': None})
-                    else:
-                        # Обычный чат - один источник
-                        message_sources.append({'topic_id': None, 'topic_title': None})
-                    
-                    # Парсим сообщения из всех источников (топиков или обычного чата)
-                    for source in message_sources:
-                        topic_id = source['topic_id']
-                        topic_title = source['topic_title']
-                        
-                        if topic_title:
-                            print(f"\n    >>> Parsing topic: '{topic_title}'...", flush=True)
-                        
-                        # Выбираем правильный метод для получения сообщений
-                        if topic_id:
-                            # Для топиков используем get_discussion_replies()
-                            # get_chat_history НЕ поддерживает reply_to_message_id в Pyrogram 2.0.106
-                            message_iterator = client.get_discussion_replies(chat_id, topic_id)
-                        else:
-                            # Для обычных чатов - стандартная история
-                            message_iterator = client.get_chat_history(chat_id, limit=1000)
-
-                        # Manual iteration so we can wrap __anext__ in wait_for.
-                        # Plain `async for` cannot be cancelled while pyrofork is
-                        # silently sleeping on a FloodWait inside the iterator.
-                        chat_timed_out = False
-                        message_iter = message_iterator.__aiter__()
-                        while True:
-                            try:
-                                message = await asyncio.wait_for(
-                                    message_iter.__anext__(),
-                                    timeout=PER_CHAT_TIMEOUT_SECONDS
-                                )
-                            except StopAsyncIteration:
-                                break
-                            except asyncio.TimeoutError:
-                                print(
-                                    f"    ⏱️ Chat '{chat_title}' stuck > {PER_CHAT_TIMEOUT_SECONDS}s "
-                                    f"(likely FloodWait inside pyrofork) — skipping",
-                                    flush=True
-                                )
-                                chat_stat["status"] = "timeout"
-                                chat_stat["error_type"] = "PER_CHAT_TIMEOUT"
-                                chat_stat["error_message"] = (
-                                    f"Stuck > {PER_CHAT_TIMEOUT_SECONDS}s waiting for next message "
-                                    f"(pyrofork internal FloodWait sleep)"
-                                )
-                                chat_timed_out = True
-                                break
-
-                            total_checked += 1
-                            
-                            # ИСПОЛЬЗУЕМ TIMESTAMP для точного определения времени
-                            # Pyrogram возвращает time в локальном часовом поясе БЕЗ TZ info
-                            # Поэтому используем timestamp (UNIX time - всегда UTC)
-                            original_date = message.date
-                            
-                            # Получаем timestamp (секунды с 1970-01-01 UTC)
-                            if hasattr(original_date, 'timestamp'):
-                                timestamp = original_date.timestamp()
-                            else:
-                                # Fallback для старых версий
-                                import calendar
-                                timestamp = calendar.timegm(original_date.timetuple())
-                            
-                            # Преобразуем timestamp обратно в UTC datetime
-                            msg_date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                            
-                            # Логируем первые 5 сообщений для отладки
-                            if total_checked <= 5:
-                                print(f"    Checking message #{total_checked}:", flush=True)
-                                print(f"      Original datetime: {original_date.strftime('%Y-%m-%d %H:%M:%S')} (TZ: {original_date.tzinfo})", flush=True)
-                                print(f"      Timestamp: {timestamp}", flush=True)
-                                print(f"      UTC datetime: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
-                                print(f"      Time limit: {time_limit.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
-                            
-                            # Проверяем что сообщение в пределах времени
-                            if msg_date < time_limit:
-                                skipped_old += 1
-                                chat_stat["messages_skipped"] += 1  # 📊 Счётчик пропущенных сообщений
-                                # Логируем первое пропущенное сообщение
-                                if skipped_old == 1:
-                                    print(f"    ✗ STOP: Message too old: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} < {time_limit.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
-                                break  # Старые сообщения - прекращаем (история идет от новых к старым)
-                            
-                            chat_stat["messages_found"] += 1  # 📊 Счётчик найденных сообщений
-                            
-                            # Получаем информацию о пользователе
-                            user_info = {}
-                            
-                            # Логируем для отладки
-                            if total_checked <= 3:
-                                print(f"    Message #{total_checked} from_user: {message.from_user}", flush=True)
-                                if hasattr(message, 'sender_chat'):
-                                    print(f"    Message #{total_checked} sender_chat: {message.sender_chat}", flush=True)
-                            
-                            if message.from_user:
-                                # Обычное сообщение от пользователя
-                                uid = message.from_user.id
-                                user_info = {
-                                    "user_id": uid,  # Уникальный ID - всегда доступен
-                                    "first_name": message.from_user.first_name,
-                                    "last_name": message.from_user.last_name,
-                                    "username": message.from_user.username,  # Может быть None
-                                }
-                                
-                                # Пытаемся получить био пользователя (с кэшированием)
-                                if uid in user_bio_cache:
-                                    user_info["bio"] = user_bio_cache[uid]
-                                else:
-                                    try:
-                                        user_full = await client.get_chat(uid)
-                                        bio = None
-                                        if hasattr(user_full, 'bio') and user_full.bio:
-                                            bio = user_full.bio
-                                        elif hasattr(user_full, 'about') and user_full.about:
-                                            bio = user_full.about
-                                        user_bio_cache[uid] = bio
-                                        user_info["bio"] = bio
-                                    except FloodWait as e:
-                                        # Rate limit при получении био - просто пропускаем
-                                        if total_checked <= 3:
-                                            print(f"    Rate limit getting bio, skipping (wait {e.value}s)", flush=True)
-                                        user_bio_cache[uid] = None
-                                        user_info["bio"] = None
-                                    except Exception as e:
-                                        if total_checked <= 3:
-                                            print(f"    Could not get bio: {e}", flush=True)
-                                        user_bio_cache[uid] = None
-                                        user_info["bio"] = None
-                            elif hasattr(message, 'sender_chat') and message.sender_chat:
-                                # Сообщение от канала или группы
-                                sender_id = message.sender_chat.id
-                                user_info = {
-                                    "user_id": sender_id,
-                                    "first_name": message.sender_chat.title,  # Название канала/группы
-                                    "last_name": None,
-                                    "username": message.sender_chat.username if hasattr(message.sender_chat, 'username') else None,
-                                }
-                                
-                                # Пытаемся получить описание канала (с кэшированием)
-                                if sender_id in user_bio_cache:
-                                    user_info["bio"] = user_bio_cache[sender_id]
-                                else:
-                                    try:
-                                        chat_full = await client.get_chat(sender_id)
-                                        bio = None
-                                        if hasattr(chat_full, 'description') and chat_full.description:
-                                            bio = chat_full.description
-                                        user_bio_cache[sender_id] = bio
-                                        user_info["bio"] = bio
-                                    except FloodWait as e:
-                                        # Rate limit при получении описания - просто пропускаем
-                                        if total_checked <= 3:
-                                            print(f"    Rate limit getting description, skipping (wait {e.value}s)", flush=True)
-                                        user_bio_cache[sender_id] = None
-                                        user_info["bio"] = None
-                                    except Exception as e:
-                                        if total_checked <= 3:
-                                            print(f"    Could not get channel description: {e}", flush=True)
-                                        user_bio_cache[sender_id] = None
-                                        user_info["bio"] = None
-                            else:
-                                # Служебное сообщение или анонимный админ
-                                if total_checked <= 3:
-                                    print(f"    ⚠️ Message #{total_checked} has no from_user or sender_chat - skipping", flush=True)
-                                continue  # Пропускаем такие сообщения
-                            
-                            message_text = ""
-                            if message.text:
-                                message_text = message.text
-                            elif message.caption:
-                                message_text = message.caption
-                            
-                            if message_text:  # Сохраняем только текстовые сообщения
-                                # Логируем время сообщения для первых нескольких
-                                if messages_in_chat < 5:
-                                    print(f"    ✓ SAVING message #{messages_in_chat + 1}: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} (WITHIN time limit)", flush=True)
-                                
-                                # Создаем ссылку на профиль или сообщение
-                                profile_link = None
-                                if user_info.get("username"):
-                                    # Если есть username - используем прямую ссылку на профиль
-                                    profile_link = f"https://t.me/{user_info.get('username')}"
-                                else:
-                                    # Если нет username - создаём deep link на само сообщение
-                                    if chat_username:
-                                        # Публичный канал/группа - ссылка на сообщение
-                                        message_link = f"https://t.me/{chat_username}/{message.id}"
-                                        profile_link = f"Профиль скрыт. Сообщение в чате \"{chat_title}\": {message_link}"
-                                    else:
-                                        # Приватный чат - только описание
-                                        profile_link = f"Профиль скрыт. Сообщение в приватном чате \"{chat_title}\" (ID сообщения: {message.id})"
-                                
-                                # Подготавливаем данные для сохранения
-                                message_data = {
-                                    "message_time": msg_date.isoformat(),  # Используем правильное UTC время
-                                    "chat_name": chat_title,
-                                    "user_id": user_info.get("user_id"),  # Уникальный ID пользователя
-                                    "first_name": user_info.get("first_name"),
-                                    "last_name": user_info.get("last_name"),
-                                    "username": user_info.get("username"),  # Может быть пустым
-                                    "bio": user_info.get("bio"),
-                                    "profile_link": profile_link,  # Ссылка на профиль
-                                    "message": message_text
-                                }
-                                
-                                # Логируем первые несколько сообщений для отладки
-                                if messages_in_chat < 3:
-                                    print(f"    📦 Prepared data for saving:", flush=True)
-                                    print(f"       user_id: {message_data['user_id']}", flush=True)
-                                    print(f"       profile_link: {message_data['profile_link']}", flush=True)
-                                    print(f"       first_name: {message_data['first_name']}", flush=True)
-                                
-                                messages_data.append(message_data)
-                                messages_in_chat += 1
-                                chat_stat["messages_saved"] += 1  # 📊 Счётчик сохранённых сообщений
-
-                        # If the inner timeout fired, stop trying further topics
-                        # for this chat — same session, same FloodWait will hit again.
-                        if chat_timed_out:
-                            break
+            # Таймаут одного топика не мешает остальным; RateLimited /
+            # FloodWait отменяют соседей и уходят наверх — чат отложат целиком
+            tasks = [asyncio.create_task(fetch_topic(topic)) for topic in sources]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-                    print(f">>> RESULT for '{chat_title}':", flush=True)
-                    print(f"    - Checked: {total_checked} messages", flush=True)
-                    print(f"    - Saved: {messages_in_chat} messages (within last hour)", flush=True)
-                    print(f"    - Skipped: {skipped_old} messages (too old)", flush=True)
-                    
-                    # ✅ Финализируем статистику
-                    chat_stat["execution_time_seconds"] = time.time() - chat_start_time
-                    chat_stat["finished_at"] = datetime.now(timezone.utc)
-                    parsing_stats.append(chat_stat)
-                
-                except FloodWait as e:
-                    # 🔥 АВТОМАТИЧЕСКОЕ ОЖИДАНИЕ при rate limit
-                    wait_seconds = e.value
-                    print(f"⏳ Rate limit for chat {chat_id}: waiting {wait_seconds} seconds...", flush=True)
-                    await asyncio.sleep(wait_seconds)
-                    print(f"✅ Wait complete, retrying chat {chat_id}...", flush=True)
-                    
-                    # 🔄 Пробуем этот же чат ещё раз после ожидания
-                    try:
-                        retry_chat = await client.get_chat(chat_id)
-                        retry_title = retry_chat.title if hasattr(retry_chat, 'title') else f"Chat {chat_id}"
-                        
-                        async for message in client.get_chat_history(chat_id, limit=1000):
-                            total_checked += 1
-                            original_date = message.date
-                            if hasattr(original_date, 'timestamp'):
-                                timestamp = original_date.timestamp()
-                            else:
-                                import calendar
-                                timestamp = calendar.timegm(original_date.timetuple())
-                            msg_date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                            
-                            if msg_date < time_limit:
-                                break
-                            
-                            chat_stat["messages_found"] += 1
-                            
-                            if not message.from_user and not (hasattr(message, 'sender_chat') and message.sender_chat):
-                                continue
-                            
-                            message_text = message.text or message.caption or ""
-                            if message_text:
-                                # Минимальная обработка при retry
-                                uid = message.from_user.id if message.from_user else message.sender_chat.id
-                                uname = message.from_user.username if message.from_user else getattr(message.sender_chat, 'username', None)
-                                fname = message.from_user.first_name if message.from_user else getattr(message.sender_chat, 'title', None)
-                                lname = message.from_user.last_name if message.from_user else None
-                                
-                                profile_link = f"https://t.me/{uname}" if uname else f"Профиль скрыт. Сообщение в чате \"{retry_title}\" (ID: {message.id})"
-                                
-                                messages_data.append({
-                                    "message_time": msg_date.isoformat(),
-                                    "chat_name": retry_title,
-                                    "user_id": uid,
-                                    "first_name": fname,
-                                    "last_name": lname,
-                                    "username": uname,
-                                    "bio": user_bio_cache.get(uid),
-                                    "profile_link": profile_link,
-                                    "message": message_text
-                                })
-                                messages_in_chat += 1
-                                chat_stat["messages_saved"] += 1
-                        
-                        chat_stat["status"] = "success"
-                        chat_stat["error_type"] = None
-                        chat_stat["error_message"] = f"Retried after FloodWait({wait_seconds}s)"
-                        print(f"✅ Retry successful: saved {messages_in_chat} messages from {retry_title}", flush=True)
-                    except Exception as retry_err:
-                        print(f"❌ Retry failed for chat {chat_id}: {retry_err}", flush=True)
-                        chat_stat["status"] = "error"
-                        chat_stat["error_type"] = "FLOOD_WAIT"
-                        chat_stat["error_message"] = f"Rate limit: waited {wait_seconds}s, retry failed: {retry_err}"
-                    
-                    chat_stat["execution_time_seconds"] = time.time() - chat_start_time
-                    chat_stat["finished_at"] = datetime.now(timezone.utc)
-                    parsing_stats.append(chat_stat)
+        print(f">>> RESULT for '{chat_title}':", flush=True)
+        print(f"    - Checked: {totals['checked']} messages", flush=True)
+        print(f"    - Saved: {totals['saved']} messages (new since last run)", flush=True)
+        print(f"    - Skipped: {totals['skipped']} messages (too old)", flush=True)
+    
+    async def _get_forum_topics(self, client, chat_id: int, active_since: float) -> List[Dict]:
+        """Топики форума: [{"id", "title", "top_message", "top_date"}], от
+        недавно активных к давно молчащим (top_date — unix time последнего
+        сообщения, 0 если неизвестно).
+        
+        channels.GetForumTopics отдаёт топики по последней активности, по
+        FORUM_TOPICS_PAGE_SIZE за запрос. Листаем страницы, пока следующая
+        может содержать топик, активный после active_since.
+        """
+        from pyrogram.raw import functions
+        
+        account = account_key(client)
+        peer = await client.resolve_peer(chat_id)
+        topics: List[Dict] = []
+        seen = set()
+        offset_date, offset_id, offset_topic = 0, 0, 0
+        while len(topics) < FORUM_MAX_TOPICS:
+            query = functions.channels.GetForumTopics(
+                channel=peer,
+                offset_date=offset_date,
+                offset_id=offset_id,
+                offset_topic=offset_topic,
+                limit=FORUM_TOPICS_PAGE_SIZE
+            )
+            result = await flood_limiter.call(account, "channels.GetForumTopics", lambda: client.invoke(query, sleep_threshold=NO_FLOOD_SLEEP))
+            page = list(getattr(result, 'topics', []))
+            dates = {m.id: m.date for m in getattr(result, 'messages', []) if getattr(m, 'date', None)}
+            
+            added = 0
+            for topic in page:
+                # ForumTopicDeleted — только id, читать нечего
+                if not hasattr(topic, 'top_message') or topic.id in seen:
                     continue
-                except PeerIdInvalid:
-                    # ⚠️ Чат недоступен (выгнали, удален, или нет прав)
-                    print(f"⚠️ Chat {chat_id} is not accessible (kicked, deleted, or no access). Skipping.", flush=True)
-                    
-                    # 📊 Сохраняем статистику с ошибкой
-                    chat_stat["status"] = "skipped"
-                    chat_stat["error_type"] = "PeerIdInvalid"
-                    chat_stat["error_message"] = "Chat not accessible (kicked, deleted, or no access)"
-                    chat_stat["execution_time_seconds"] = time.time() - chat_start_time
-                    chat_stat["finished_at"] = datetime.now(timezone.utc)
-                    parsing_stats.append(chat_stat)
+                seen.add(topic.id)
+                added += 1
+                topics.append({
+                    'id': topic.id,
+                    'title': getattr(topic, 'title', f'Topic {topic.id}'),
+                    'top_message': topic.top_message,
+                    'top_date': dates.get(topic.top_message, 0),
+                })
+            
+            last = page[-1] if page else None
+            if (not added or len(page) < FORUM_TOPICS_PAGE_SIZE
+                    or len(topics) >= getattr(result, 'count', 0)
+                    or not hasattr(last, 'top_message')):
+                break
+            last_date = dates.get(last.top_message, 0)
+            if last_date and last_date < active_since:
+                break  # дальше только топики, молчащие дольше окна
+            offset_date, offset_id, offset_topic = last_date, last.top_message, last.id
+        
+        # Закреплённые топики API отдаёт первыми — упорядочиваем по активности
+        topics.sort(key=lambda t: t['top_date'], reverse=True)
+        return topics
+    
+    @staticmethod
+    def _active_topics(chat_id: int, topics: List[Dict], time_limit, catchup_limit,
+                       watermarks: Dict[str, dict], resume: Dict[str, dict]) -> List[Dict]:
+        """Топики, которые есть смысл читать: последнее сообщение новее
+        high-water mark и окна источника. Прерванные в прошлом прогоне
+        топики берутся всегда (в том числе пропавшие из списка)."""
+        active = []
+        idle = 0
+        for topic in topics:
+            key = watermark_key(chat_id, topic['id'])
+            if key not in resume:
+                mark = watermarks.get(key)
+                if mark and topic['top_message'] <= mark["message_id"]:
+                    idle += 1
                     continue
-                except Exception as e:
-                    print(f"❌ Error parsing chat {chat_id}: {e}", flush=True)
-                    
-                    # 📊 Сохраняем статистику с ошибкой
-                    chat_stat["status"] = "error"
-                    chat_stat["error_type"] = "Other"
-                    chat_stat["error_message"] = str(e)
-                    chat_stat["execution_time_seconds"] = time.time() - chat_start_time
-                    chat_stat["finished_at"] = datetime.now(timezone.utc)
-                    parsing_stats.append(chat_stat)
+                source_limit = catchup_limit if mark else time_limit
+                if topic['top_date'] and topic['top_date'] < source_limit.timestamp():
+                    idle += 1
                     continue
+            active.append(topic)
+        
+        listed = {topic['id'] for topic in topics}
+        for point in resume.values():
+            if point["chat_id"] == chat_id and point.get("topic_id") and point["topic_id"] not in listed:
+                active.append({'id': point["topic_id"], 'title': f'Topic {point["topic_id"]}'})
+        
+        if idle:
+            print(f"    💤 Skipping {idle} idle topic(s) without new messages", flush=True)
+        for topic in active:
+            print(f"       - Topic: {topic['title']} (id: {topic['id']})", flush=True)
+        return active
+    
+    async def _fetch_source(self, client, chat_id: int, topic_id: Optional[int], topic_title: Optional[str],
+                            chat_title: str, chat_username: Optional[str], chat_stat: Dict, totals: Dict,
+                            time_limit, catchup_limit, watermarks: Dict[str, dict], resume: Dict[str, dict],
+                            emit: Callable[[Dict], Awaitable[None]],
+                            checkpoint: Callable[[Dict], Awaitable[None]]) -> None:
+        """Читает один источник — чат или топик форума — см. _fetch_chat.
+        Отметку источника добавляет в chat_stat["watermarks"] только если он
+        дочитан до конца (без таймаута и без упора в HISTORY_MAX_MESSAGES).
+        Упёршийся в лимит источник оставляет checkpoint на самом старом
+        прочитанном сообщении и помечает чат chat_stat["partial"]."""
+        from datetime import datetime, timezone
+        
+        if topic_title:
+            print(f"\n    >>> Parsing topic: '{topic_title}'...", flush=True)
+        
+        # 📍 High-water mark: читаем только то, что новее последнего
+        # сохранённого сообщения. Для топиков — messages.GetReplies
+        # (get_chat_history НЕ поддерживает reply_to_message_id).
+        mark = watermarks.get(watermark_key(chat_id, topic_id))
+        min_id = mark["message_id"] if mark else 0
+        newest_id = None
+        newest_time = None
+        resume_from = None
+        history: Dict = {}  # capped — чтение остановил HISTORY_MAX_MESSAGES
+        point = resume.get(watermark_key(chat_id, topic_id))
+        if point:
+            # ♻️ Прерванный прогон: сначала новое с прошлого раза (id >
+            # newest_id), затем недочитанный хвост (min_id, offset_id).
+            # Вместе это по-прежнему один поток от новых к старым.
+            min_id = point["min_id"]
+            resume_from = point["offset_id"]
+            newest_id = point["newest_id"]
+            newest_time = datetime.fromisoformat(point["newest_time"])
+            print(f"    ♻️ Resuming interrupted read below message {resume_from} (down to {min_id})", flush=True)
+            message_iterator = self._iter_resumed(client, chat_id, topic_id, point, history)
+        else:
+            if mark:
+                print(f"    📍 Resuming after message {min_id} ({mark.get('message_time')})", flush=True)
+            message_iterator = self._iter_history(client, chat_id, topic_id, min_id, state=history)
+        source_limit = catchup_limit if min_id else time_limit
+        source_checked = 0
+        prev_id = None
+
+        # Manual iteration so we can wrap __anext__ in wait_for.
+        # Plain `async for` cannot be cancelled while pyrofork is
+        # silently sleeping on a FloodWait inside the iterator.
+        chat_timed_out = False
+        message_iter = message_iterator.__aiter__()
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    message_iter.__anext__(),
+                    timeout=PER_CHAT_TIMEOUT_SECONDS
+                )
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                print(
+                    f"    ⏱️ Chat '{chat_title}' stuck > {PER_CHAT_TIMEOUT_SECONDS}s "
+                    f"(likely FloodWait inside pyrofork) — skipping",
+                    flush=True
+                )
+                chat_stat["status"] = "timeout"
+                chat_stat["error_type"] = "PER_CHAT_TIMEOUT"
+                chat_stat["error_message"] = (
+                    f"Stuck > {PER_CHAT_TIMEOUT_SECONDS}s waiting for next message "
+                    f"(pyrofork internal FloodWait sleep)"
+                )
+                chat_timed_out = True
+                break
+
+            totals["checked"] += 1
+            source_checked += 1
             
-            await client.disconnect()
+            # 💾 Позиция для возобновления: всё до prev_id уже выдано.
+            # В продолжении — только в хвосте, ниже сохранённой позиции.
+            if (prev_id is not None and source_checked % CHECKPOINT_EVERY_MESSAGES == 0
+                    and (resume_from is None or prev_id < resume_from)):
+                await checkpoint({
+                    "chat_id": chat_id,
+                    "topic_id": topic_id,
+                    "min_id": min_id,
+                    "offset_id": prev_id,
+                    "newest_id": newest_id,
+                    "newest_time": newest_time.isoformat(),
+                })
+            prev_id = message.id
             
-            # 📊 Возвращаем сообщения и статистику
-            return {
-                "messages": messages_data,
-                "stats": parsing_stats
-            }
+            # ИСПОЛЬЗУЕМ TIMESTAMP для точного определения времени
+            # Pyrogram возвращает time в локальном часовом поясе БЕЗ TZ info
+            # Поэтому используем timestamp (UNIX time - всегда UTC)
+            original_date = message.date
             
-        except Exception as e:
-            if client and client.is_connected:
-                try:
-                    await client.disconnect()
-                except:
-                    pass
-            raise Exception(f"Error parsing messages: {str(e)}")
+            # Получаем timestamp (секунды с 1970-01-01 UTC)
+            if hasattr(original_date, 'timestamp'):
+                timestamp = original_date.timestamp()
+            else:
+                # Fallback для старых версий
+                import calendar
+                timestamp = calendar.timegm(original_date.timetuple())
+            
+            # Преобразуем timestamp обратно в UTC datetime
+            msg_date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            
+            # Логируем первые 5 сообщений для отладки
+            if totals["checked"] <= 5:
+                print(f"    Checking message #{totals['checked']}:", flush=True)
+                print(f"      Original datetime: {original_date.strftime('%Y-%m-%d %H:%M:%S')} (TZ: {original_date.tzinfo})", flush=True)
+                print(f"      Timestamp: {timestamp}", flush=True)
+                print(f"      UTC datetime: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
+                print(f"      Time limit: {source_limit.strftime('%Y-%m-%d %H:%M:%S')} UTC", flush=True)
+            
+            if newest_id is None or message.id > newest_id:
+                newest_id = message.id
+                newest_time = msg_date
+            
+            # Проверяем что сообщение в пределах времени
+            if msg_date < source_limit:
+                totals["skipped"] += 1
+                chat_stat["messages_skipped"] += 1  # 📊 Счётчик пропущенных сообщений
+                # Логируем сообщение, на котором источник остановился
+                print(f"    ✗ STOP: Message too old: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} < {source_limit.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
+                break  # Старые сообщения - прекращаем (история идет от новых к старым)
+            
+            chat_stat["messages_found"] += 1  # 📊 Счётчик найденных сообщений
+            
+            # Получаем информацию о пользователе
+            user_info = {}
+            
+            # Логируем для отладки
+            if totals["checked"] <= 3:
+                print(f"    Message #{totals['checked']} from_user: {message.from_user}", flush=True)
+                if hasattr(message, 'sender_chat'):
+                    print(f"    Message #{totals['checked']} sender_chat: {message.sender_chat}", flush=True)
+            
+            if message.from_user:
+                # Обычное сообщение от пользователя
+                uid = message.from_user.id
+                user_info = {
+                    "user_id": uid,  # Уникальный ID - всегда доступен
+                    "first_name": message.from_user.first_name,
+                    "last_name": message.from_user.last_name,
+                    "username": message.from_user.username,  # Может быть None
+                }
+                
+                # Био пользователя — только из кэша профилей; при промахе
+                # строка пишется с bio = NULL, а профиль разрешается в фоне
+                user_info["bio"] = profile_resolver.lookup(client, uid, is_channel=False)
+            elif hasattr(message, 'sender_chat') and message.sender_chat:
+                # Сообщение от канала или группы
+                sender_id = message.sender_chat.id
+                user_info = {
+                    "user_id": sender_id,
+                    "first_name": message.sender_chat.title,  # Название канала/группы
+                    "last_name": None,
+                    "username": message.sender_chat.username if hasattr(message.sender_chat, 'username') else None,
+                }
+                
+                # Описание канала — так же, через кэш и фоновое разрешение
+                user_info["bio"] = profile_resolver.lookup(client, sender_id, is_channel=True)
+            else:
+                # Служебное сообщение или анонимный админ
+                if totals["checked"] <= 3:
+                    print(f"    ⚠️ Message #{totals['checked']} has no from_user or sender_chat - skipping", flush=True)
+                continue  # Пропускаем такие сообщения
+            
+            message_text = ""
+            if message.text:
+                message_text = message.text
+            elif message.caption:
+                message_text = message.caption
+            
+            if message_text:  # Сохраняем только текстовые сообщения
+                # Логируем время сообщения для первых нескольких
+                if totals["saved"] < 5:
+                    print(f"    ✓ SAVING message #{totals['saved'] + 1}: {msg_date.strftime('%Y-%m-%d %H:%M:%S')} (WITHIN time limit)", flush=True)
+                
+                # Создаем ссылку на профиль или сообщение
+                profile_link = None
+                if user_info.get("username"):
+                    # Если есть username - используем прямую ссылку на профиль
+                    profile_link = f"https://t.me/{user_info.get('username')}"
+                else:
+                    # Если нет username - создаём deep link на само сообщение
+                    if chat_username:
+                        # Публичный канал/группа - ссылка на сообщение
+                        message_link = f"https://t.me/{chat_username}/{message.id}"
+                        profile_link = f"Профиль скрыт. Сообщение в чате \"{chat_title}\": {message_link}"
+                    else:
+                        # Приватный чат - только описание
+                        profile_link = f"Профиль скрыт. Сообщение в приватном чате \"{chat_title}\" (ID сообщения: {message.id})"
+                
+                # Подготавливаем данные для сохранения
+                message_data = {
+                    "chat_id": chat_id,  # не колонка messages — по нему парсер ведёт отметки
+                    "message_time": msg_date.isoformat(),  # Используем правильное UTC время
+                    "chat_name": chat_title,
+                    "user_id": user_info.get("user_id"),  # Уникальный ID пользователя
+                    "first_name": user_info.get("first_name"),
+                    "last_name": user_info.get("last_name"),
+                    "username": user_info.get("username"),  # Может быть пустым
+                    "bio": user_info.get("bio"),
+                    "profile_link": profile_link,  # Ссылка на профиль
+                    "message": message_text
+                }
+                
+                # Логируем первые несколько сообщений для отладки
+                if totals["saved"] < 3:
+                    print(f"    📦 Prepared data for saving:", flush=True)
+                    print(f"       user_id: {message_data['user_id']}", flush=True)
+                    print(f"       profile_link: {message_data['profile_link']}", flush=True)
+                    print(f"       first_name: {message_data['first_name']}", flush=True)
+                
+                await emit(message_data)
+                totals["saved"] += 1
+                chat_stat["messages_saved"] += 1  # 📊 Счётчик сохранённых сообщений
+
+        # The mark is NOT advanced after a timeout: the unread tail must be
+        # fetched next run. Other topics of the forum are not affected.
+        if chat_timed_out:
+            return
+        
+        # Упёрлись в HISTORY_MAX_MESSAGES, не дойдя до отметки или окна:
+        # между min_id и prev_id остались непрочитанные сообщения. Отметку не
+        # трогаем — иначе они пропадут навсегда, — а следующий прогон
+        # дочитает источник с этой позиции. (Хвост прерванного чтения ниже
+        # resume_from при упоре в новых сообщениях тоже попадает в (min_id,
+        # prev_id): уже записанное оттуда отсекут дубликаты.)
+        if history.get("capped") and prev_id is not None:
+            print(f"    📚 Read limit of {HISTORY_MAX_MESSAGES} messages reached at message {prev_id} — "
+                  f"continuing from there next run", flush=True)
+            await checkpoint({
+                "chat_id": chat_id,
+                "topic_id": topic_id,
+                "min_id": min_id,
+                "offset_id": prev_id,
+                "newest_id": newest_id,
+                "newest_time": newest_time.isoformat(),
+            })
+            chat_stat["partial"] = True
+            return
+        
+        if newest_id is not None and newest_id > min_id:
+            chat_stat["watermarks"].append({
+                "chat_id": chat_id,
+                "topic_id": topic_id,
+                "message_id": newest_id,
+                "message_time": newest_time.isoformat(),
+            })
 
@@ -0,0 +1,578 @@
+"""
+Optional multi-process mode: accounts sharded across parser worker processes.
+
+By default (PARSER_WORKERS=0) everything runs inside the uvicorn process, as
+before: all Pyrogram clients, TgCrypto work, JSON serialization and Supabase
+writes share one core. With PARSER_WORKERS=N the FastAPI process becomes a
+coordinator and N worker processes do the Telegram work:
+
+- each connected account belongs to exactly one worker, chosen by
+  consistent hashing of its phone number (HashRing, WORKER_VNODES virtual
+  nodes per worker), so a phone's session file is only ever opened by one
+  process and adding accounts moves nothing else;
+- a worker runs its own RealtimeService and ParserService restricted to its
+  phones (account_filter), its own client pool, flood limiters, profile
+  resolver and real-time spool (worker 0 keeps the default spool file, so
+  rows left by an in-process run are replayed too);
+- the coordinator assigns accounts, fans scheduler ticks and API commands
+  out to the workers, routes per-account calls (chat list, session check,
+  releasing a session) to the owning worker, caches each worker's status
+  every WORKER_STATUS_INTERVAL_SECONDS and restarts dead workers with
+  backoff. A restarted worker resumes interrupted batch runs from
+  checkpoints.json and replays its spool.
+
+Coordinator and workers talk over a multiprocessing Pipe:
+{"id", "cmd", "args"} requests and {"id", "ok", "result"|"error"} replies.
+Workers also push {"events": [[event, key, data], ...]} — their event_bus
+output, coalesced — which the coordinator republishes for /events.
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from backend.database.account_storage import AccountStorage
+from backend.services.account_leases import account_leases
+from backend.services.event_bus import EVENTS_HEARTBEAT_SECONDS, EVENTS_MIN_INTERVAL_MS, event_bus
+from backend.services.response_cache import response_cache
+
+PARSER_WORKERS = max(0, int(os.getenv("PARSER_WORKERS", "0")))
+WORKER_VNODES = 160
+WORKER_STATUS_INTERVAL_SECONDS = 5
+WORKER_CALL_TIMEOUT_SECONDS = 60
+WORKER_SHUTDOWN_TIMEOUT_SECONDS = 30
+WORKER_RESTART_BACKOFF_MAX_SECONDS = 60
+
+
+def _log(msg: str) -> None:
+    print(f">>> [workers] {msg}", file=sys.stderr, flush=True)
+
+
+class WorkerUnavailable(Exception):
+    """Воркер не запущен или умер, не ответив."""
+
+
+class WorkerError(Exception):
+    """Команда в воркере завершилась исключением."""
+
+
+class HashRing:
+    def __init__(self, nodes: List[int], vnodes: int = WORKER_VNODES):
+        self._ring = sorted((self._hash(f"worker-{node}#{v}"), node) for node in nodes for v in range(vnodes))
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> int:
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+
+def _spool_path(index: int) -> str:
+    """Файл спула воркера: у каждого процесса свой, иначе при старте один
+    воркер переиграл бы строки, которые другой ещё пишет."""
+    from backend.database.message_spool import DEFAULT_REALTIME_SPOOL_PATH
+    path = os.getenv("REALTIME_SPOOL_PATH", DEFAULT_REALTIME_SPOOL_PATH)
+    if index == 0 or not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+
+# ── worker process ───────────────────────────────────────────────────
+
+def _worker_main(index: int, conn) -> None:
+    """Точка входа процесса-воркера (multiprocessing, spawn)."""
+    try:
+        asyncio.run(_WorkerRuntime(index, conn).run())
+    except KeyboardInterrupt:
+        pass
+
+
+class _WorkerRuntime:
+    def __init__(self, index: int, conn):
+        from backend.database.message_spool import MessageSpool
+        from backend.database.supabase_client import SupabaseClient
+        from backend.services.parser_service import ParserService
+        from backend.services.realtime_service import RealtimeService
+
+        self.index = index
+        self.conn = conn
+        self.phones: set = set()
+        self.realtime_wanted = True
+        self.supabase_client = SupabaseClient()
+        self.parser_service = ParserService(self.supabase_client)
+        self.spool = MessageSpool(_spool_path(index))
+        self.realtime_service = RealtimeService(self.supabase_client, spool=self.spool)
+        self.parser_service.set_realtime_service(self.realtime_service)
+        self.parser_service.account_filter = self.phones
+        self.realtime_service.account_filter = self.phones
+        self._send_lock = threading.Lock()
+        self._recv_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}-ipc")
+        self._tasks: set = set()
+
+    def _send(self, message: dict) -> None:
+        with self._send_lock:
+            self.conn.send(message)
+
+    async def run(self) -> None:
+        from backend.database.db_executor import run_in_background
+        from backend.services.profile_resolver import profile_resolver
+
+        profile_resolver.attach(self.supabase_client)
+        run_in_background(self.supabase_client.warm_seen_cache)
+        forwarder = asyncio.create_task(self._forward_events())
+        self._tasks.add(forwarder)
+        print(f">>> Worker {self.index} started (pid {os.getpid()})", flush=True)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                message = await loop.run_in_executor(self._recv_executor, self.conn.recv)
+            except (EOFError, OSError):
+                break  # координатор закрыл канал
+            if message.get("cmd") == "shutdown":
+                await self._shutdown()
+                self._send({"id": message.get("id"), "ok": True, "result": None})
+                return
+            task = asyncio.create_task(self._handle(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        await self._shutdown()
+
+    async def _forward_events(self) -> None:
+        """События воркера → координатор, схлопнутые так же, как для SSE-клиента."""
+        subscription = event_bus.subscribe()
+        while True:
+            events = await subscription.next(EVENTS_HEARTBEAT_SECONDS)
+            if events:
+                try:
+                    self._send({"events": [list(item) for item in events]})
+                except (OSError, ValueError):
+                    return
+            await asyncio.sleep(EVENTS_MIN_INTERVAL_MS / 1000)
+
+    async def _handle(self, message: dict) -> None:
+        handler = getattr(self, f"_cmd_{message.get('cmd')}", None)
+        try:
+            if handler is None:
+                raise ValueError(f"unknown command {message.get('cmd')!r}")
+            reply = {"id": message.get("id"), "ok": True, "result": await handler(**message.get("args", {}))}
+        except Exception as e:  # noqa: BLE001
+            reply = {"id": message.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+        try:
+            self._send(reply)
+        except (OSError, ValueError):
+            pass
+
+    async def _shutdown(self) -> None:
+        from backend.services.client_pool import client_pool
+        from backend.services.profile_cache import profile_cache
+        from backend.services.profile_resolver import profile_resolver
+
+        self.parser_service.stop_parsing()
+        for task in list(self._tasks):
+            task.cancel()
+        await self.realtime_service.stop()
+        await profile_resolver.stop()
+        await client_pool.close_all()
+        profile_cache.flush()
+        print(f">>> Worker {self.index} stopped", flush=True)
+
+    # ── commands ─────────────────────────────────────────────────────
+
+    async def _cmd_assign(self, phones: List[str]) -> dict:
+        from backend.services.client_pool import client_pool
+
+        new = set(phones)
+        removed = self.phones - new
+        changed = new != self.phones
+        self.phones.clear()
+        self.phones.update(new)
+        if changed and self.realtime_service.is_running():
+            await self.realtime_service.stop()
+        for phone in removed:
+            await client_pool.close(phone)
+        if self.realtime_wanted and not self.realtime_service.is_running():
+            await self.realtime_service.start()
+        return {"phones": sorted(self.phones)}
+
+    async def _cmd_parse(self, scheduled: bool = False) -> dict:
+        if self.parser_service.is_running():
+            return {"skipped": True}
+        await self.parser_service.parse_all_accounts(scheduled=scheduled)
+        return {"skipped": False}
+
+    async def _cmd_stop_parsing(self) -> bool:
+        return self.parser_service.stop_parsing()
+
+    async def _cmd_realtime(self, action: str) -> dict:
+        self.realtime_wanted = action != "stop"
+        if action == "start":
+            await self.realtime_service.start()
+        elif action == "stop":
+            await self.realtime_service.stop()
+        elif action == "restart":
+            await self.realtime_service.restart()
+        return self.realtime_service.status()
+
+    async def _cmd_release(self, phone: str) -> None:
+        """Закрывает сессию аккаунта (файл сессии сейчас заменят или удалят).
+        Realtime поднимется снова при следующем assign."""
+        from backend.services.client_pool import client_pool
+
+        if self.realtime_service.is_running():
+            await self.realtime_service.stop()
+        await client_pool.close(phone)
+
+    async def _cmd_get_chats(self, api_id, api_hash, phone: str, force_refresh: bool = False) -> list:
+        return await self.parser_service.telegram_service.get_chats(
+            api_id, api_hash, phone, force_refresh=force_refresh
+        )
+
+    async def _cmd_get_me(self, api_id, api_hash, phone: str) -> dict:
+        from backend.services.client_pool import client_pool, is_auth_error
+
+        try:
+            async with client_pool.lease(api_id, api_hash, phone) as client:
+                me = await client.get_me()
+        except Exception as e:
+            if is_auth_error(e):
+                await client_pool.close(phone)
+            raise
+        return {"first_name": me.first_name}
+
+    async def _cmd_limits(self) -> dict:
+        from backend.services.rate_limiter import flood_limiter
+        return flood_limiter.status()
+
+    async def _cmd_schedule(self) -> dict:
+        return self.parser_service.chat_scheduler.status()
+
+    async def _cmd_status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "phones": sorted(self.phones),
+            "parser_running": self.parser_service.is_running(),
+            "realtime": self.realtime_service.status(),
+        }
+
+
+# ── coordinator ──────────────────────────────────────────────────────
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.reader: Optional[asyncio.Task] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.phones: Optional[List[str]] = None  # None — назначение нужно отправить заново
+        self.status: dict = {}
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 1.0
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class _RealtimeFacade:
+    """То, что роутеры ждут от RealtimeService, но по всем воркерам.
+    status() синхронный — из последнего опроса воркеров."""
+
+    def __init__(self, pool: "WorkerPool"):
+        self._pool = pool
+
+    def _statuses(self) -> List[dict]:
+        return [w.status.get("realtime") or {} for w in self._pool.workers]
+
+    def is_running(self) -> bool:
+        return any(s.get("running") for s in self._statuses())
+
+    def status(self) -> dict:
+        statuses = self._statuses()
+        started = [s["started_at"] for s in statuses if s.get("started_at")]
+        errors = [e for s in statuses for e in s.get("recent_errors", [])]
+        return {
+            "running": any(s.get("running") for s in statuses),
+            "accounts": sum(s.get("accounts", 0) for s in statuses),
+            "messages_received": sum(s.get("messages_received", 0) for s in statuses),
+            "queue_size": sum(s.get("queue_size", 0) for s in statuses),
+            "started_at": min(started) if started else None,
+            "recent_errors": errors[-5:],
+            "workers": statuses,
+        }
+
+    async def _command(self, action: str) -> None:
+        await self._pool.broadcast("realtime", action=action)
+        await self._pool.refresh_status()
+        response_cache.invalidate("schedule")
+
+    async def start(self):
+        await self._command("start")
+
+    async def stop(self):
+        await self._command("stop")
+
+    async def restart(self):
+        await self._command("restart")
+
+
+class WorkerPool:
+    def __init__(self, count: int = PARSER_WORKERS):
+        self.count = count
+        self.workers = [_Worker(i) for i in range(count)]
+        self.realtime = _RealtimeFacade(self)
+        self._ring = HashRing(list(range(count))) if count else None
+        self._account_storage = AccountStorage()
+        self._ids = itertools.count(1)
+        self._monitor: Optional[asyncio.Task] = None
+        self._recv_executor: Optional[ThreadPoolExecutor] = None
+        self._started = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 0
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    # ── lifecycle ────────────────────────────────────────────────────
+
+    async def start(self) -> None:
+        if not self.enabled or self._started:
+            return
+        self._recv_executor = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="worker-ipc")
+        for worker in self.workers:
+            self._spawn(worker)
+        self._started = True
+        await self.rebalance()
+        await self.refresh_status()
+        self._monitor = asyncio.create_task(self._run_monitor())
+        _log(f"{self.count} worker process(es) started")
+
+    def _spawn(self, worker: _Worker) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_worker_main, args=(worker.index, child_conn),
+            name=f"parser-worker-{worker.index}", daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process, worker.conn = process, parent_conn
+        worker.pending = {}
+        worker.phones = None
+        worker.started_at = time.time()
+        worker.reader = asyncio.create_task(self._read(worker, parent_conn))
+
+    async def _read(self, worker: _Worker, conn) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                reply = await loop.run_in_executor(self._recv_executor, conn.recv)
+            except (EOFError, OSError):
+                break
+            if "events" in reply:
+                for event, key, data in reply["events"]:
+                    event_bus.publish(event, {**data, "worker": worker.index}, key=f"{worker.index}:{key}")
+                continue
+            future = worker.pending.pop(reply.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(WorkerUnavailable(f"worker {worker.index} exited"))
+        worker.pending.clear()
+
+    async def stop(self) -> None:
+        if not self._started:
+            return
+        self._started = False
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+        await self.broadcast("shutdown", timeout=WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, 5)
+            if worker.process.is_alive():
+                _log(f"worker {worker.index} did not exit — terminating")
+                worker.process.terminate()
+            if worker.conn is not None:
+                worker.conn.close()
+            if worker.reader is not None:
+                worker.reader.cancel()
+        self._recv_executor.shutdown(wait=False)
+        _log("all workers stopped")
+
+    async def _run_monitor(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_STATUS_INTERVAL_SECONDS)
+            try:
+                self._restart_dead()
+                await self.rebalance()
+                await self.refresh_status()
+            except Exception as e:  # noqa: BLE001
+                _log(f"monitor error: {e}")
+
+    def _restart_dead(self) -> None:
+        now = time.time()
+        for worker in self.workers:
+            if worker.is_alive():
+                if now - worker.started_at > WORKER_RESTART_BACKOFF_MAX_SECONDS:
+                    worker.backoff = 1.0
+                continue
+            if now - worker.started_at < worker.backoff:
+                continue  # умер сразу после старта — ждём дольше
+            exitcode = worker.process.exitcode if worker.process is not None else None
+            _log(f"worker {worker.index} is down (exit code {exitcode}) — restarting")
+            if worker.reader is not None:
+                worker.reader.cancel()
+            worker.restarts += 1
+            worker.backoff = min(worker.backoff * 2, WORKER_RESTART_BACKOFF_MAX_SECONDS)
+            worker.status = {}
+            self._spawn(worker)
+
+    # ── calls ────────────────────────────────────────────────────────
+
+    async def call(self, worker: _Worker, cmd: str, timeout: Optional[float] = WORKER_CALL_TIMEOUT_SECONDS,
+                   **args) -> Any:
+        if not worker.is_alive() or worker.conn is None:
+            raise WorkerUnavailable(f"worker {worker.index} is not running")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        try:
+            worker.conn.send({"id": request_id, "cmd": cmd, "args": args})
+            reply = await asyncio.wait_for(future, timeout)
+        except (OSError, ValueError) as e:
+            raise WorkerUnavailable(f"worker {worker.index}: {e}") from e
+        finally:
+            worker.pending.pop(request_id, None)
+        if not reply.get("ok"):
+            raise WorkerError(reply.get("error"))
+        return reply.get("result")
+
+    async def broadcast(self, cmd: str, timeout: Optional[float] = WORKER_CALL_TIMEOUT_SECONDS,
+                        **args) -> List[Any]:
+        """Команда всем воркерам. Ошибки возвращаются в списке, а не бросаются."""
+        return await asyncio.gather(
+            *(self.call(worker, cmd, timeout=timeout, **args) for worker in self.workers),
+            return_exceptions=True,
+        )
+
+    def owner(self, phone: str) -> _Worker:
+        return self.workers[self._ring.node_for(phone)]
+
+    async def call_owner(self, phone: str, cmd: str, timeout: Optional[float] = WORKER_CALL_TIMEOUT_SECONDS,
+                         **args) -> Any:
+        return await self.call(self.owner(phone), cmd, timeout=timeout, phone=phone, **args)
+
+    # ── accounts ─────────────────────────────────────────────────────
+
+    async def rebalance(self) -> None:
+        """Отправляет воркерам их аккаунты, если назначение изменилось."""
+        assignment: Dict[int, List[str]] = {worker.index: [] for worker in self.workers}
+        accounts = self._account_storage.get_all_connected_accounts()
+        # Только аккаунты, аренду которых держит этот узел
+        for account in await account_leases.filter_accounts(accounts):
+            phone = account.get("phone_number")
+            if phone:
+                assignment[self._ring.node_for(phone)].append(phone)
+        for worker in self.workers:
+            phones = sorted(assignment[worker.index])
+            if phones == worker.phones or not worker.is_alive():
+                continue
+            try:
+                await self.call(worker, "assign", phones=phones)
+                worker.phones = phones
+                _log(f"worker {worker.index}: {len(phones)} account(s) assigned")
+            except (WorkerUnavailable, WorkerError, asyncio.TimeoutError) as e:
+                _log(f"worker {worker.index}: assign failed: {e}")
+
+    async def release(self, phone: str) -> None:
+        """Владелец закрывает сессию аккаунта; назначение отправится заново."""
+        worker = self.owner(phone)
+        try:
+            await self.call_owner(phone, "release")
+        except (WorkerUnavailable, WorkerError, asyncio.TimeoutError) as e:
+            _log(f"release {phone} on worker {worker.index} failed: {e}")
+        worker.phones = None
+
+    # ── parsing ──────────────────────────────────────────────────────
+
+    async def parse_scheduled(self) -> None:
+        await self.parse_all(scheduled=True)
+
+    async def parse_all(self, scheduled: bool = False) -> None:
+        """Батч-прогон: каждый воркер парсит свои аккаунты, ждём всех."""
+        response_cache.invalidate("parser")
+        try:
+            results = await self.broadcast("parse", timeout=None, scheduled=scheduled)
+        finally:
+            response_cache.invalidate("parser", "sessions")
+        for worker, result in zip(self.workers, results):
+            if isinstance(result, BaseException):
+                _log(f"worker {worker.index}: parse failed: {result}")
+
+    async def stop_parsing(self) -> bool:
+        results = await self.broadcast("stop_parsing")
+        return any(result is True for result in results)
+
+    def is_parsing(self) -> bool:
+        return any(worker.status.get("parser_running") for worker in self.workers)
+
+    # ── status ───────────────────────────────────────────────────────
+
+    async def refresh_status(self) -> None:
+        results = await self.broadcast("status", timeout=WORKER_STATUS_INTERVAL_SECONDS)
+        for worker, result in zip(self.workers, results):
+            worker.status = {} if isinstance(result, BaseException) else result
+
+    async def merged(self, cmd: str) -> dict:
+        """Словари-статусы воркеров (limits, schedule), слитые в один."""
+        merged: dict = {}
+        for result in await self.broadcast(cmd):
+            if isinstance(result, dict):
+                for key, value in result.items():
+                    if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                        merged[key].update(value)
+                    else:
+                        merged[key] = value
+        return merged
+
+    def status(self) -> dict:
+        return {
+            "workers": [
+                {
+                    "index": worker.index,
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "alive": worker.is_alive(),
+                    "restarts": worker.restarts,
+                    "phones": worker.phones or [],
+                    "parser_running": worker.status.get("parser_running", False),
+                    "realtime_running": (worker.status.get("realtime") or {}).get("running", False),
+                }
+                for worker in self.workers
+            ],
+        }
+
+
+worker_pool = WorkerPool()
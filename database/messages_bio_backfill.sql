@@ -0,0 +1,34 @@
+-- Дозаполнение bio у уже сохранённых сообщений
+-- Выполните этот SQL в Supabase SQL Editor
+
+-- У messages есть только политики SELECT и INSERT, поэтому UPDATE с anon
+-- ключом не находит ни одной строки и при этом не возвращает ошибку.
+-- Функция выполняется с правами владельца (SECURITY DEFINER) и меняет
+-- только bio, и только там, где его ещё нет.
+--
+-- p_bios — {"<user_id>": "<bio>", ...}; все пользователи обновляются одним
+-- запросом по idx_user_id. Возвращает число обновлённых строк.
+--
+-- Вызов из клиента: supabase.rpc('backfill_bios', {'p_bios': {...}})
+CREATE OR REPLACE FUNCTION backfill_bios(p_bios jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    updated_rows integer;
+BEGIN
+    UPDATE messages m
+    SET bio = b.bio
+    FROM jsonb_each_text(p_bios) AS b(user_id, bio)
+    WHERE m.user_id = b.user_id::bigint
+      AND m.bio IS NULL
+      AND b.bio <> '';
+    GET DIAGNOSTICS updated_rows = ROW_COUNT;
+    RETURN updated_rows;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION backfill_bios(jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION backfill_bios(jsonb) TO anon, authenticated, service_role;
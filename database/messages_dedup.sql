@@ -0,0 +1,45 @@
+-- Пакетная вставка сообщений с дедупликацией на стороне сервера
+-- Выполните этот SQL в Supabase SQL Editor
+
+-- Уникальный индекс по содержимому сообщения. Он построен на выражениях,
+-- поэтому PostgREST upsert (on_conflict=<колонки>) не может на него сослаться.
+CREATE UNIQUE INDEX IF NOT EXISTS messages_unique_hash_idx
+    ON messages (md5(message), COALESCE(username, ''), chat_name, message_time);
+
+-- Вставляет массив сообщений одним запросом; дубликаты (в том числе внутри
+-- самого массива) молча пропускаются через ON CONFLICT DO NOTHING.
+-- Возвращает одну строку: сколько вставлено и сколько оказалось дубликатами.
+--
+-- Вызов из клиента: supabase.rpc('insert_messages_dedup', {'p_rows': [...]})
+CREATE OR REPLACE FUNCTION insert_messages_dedup(p_rows jsonb)
+RETURNS TABLE (inserted integer, duplicates integer)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    total_rows integer := jsonb_array_length(p_rows);
+    inserted_rows integer;
+BEGIN
+    INSERT INTO messages (
+        message_time, chat_name, user_id, first_name, last_name,
+        username, bio, profile_link, message
+    )
+    SELECT
+        r.message_time, r.chat_name, r.user_id, r.first_name, r.last_name,
+        r.username, r.bio, r.profile_link, r.message
+    FROM jsonb_to_recordset(p_rows) AS r(
+        message_time TIMESTAMPTZ,
+        chat_name TEXT,
+        user_id BIGINT,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        bio TEXT,
+        profile_link TEXT,
+        message TEXT
+    )
+    ON CONFLICT (md5(message), COALESCE(username, ''), chat_name, message_time) DO NOTHING;
+
+    GET DIAGNOSTICS inserted_rows = ROW_COUNT;
+    RETURN QUERY SELECT inserted_rows, total_rows - inserted_rows;
+END;
+$$;
@@ -37,6 +37,8 @@ CREATE INDEX IF NOT EXISTS idx_parsing_logs_started_at ON parsing_logs(started_a
 CREATE INDEX IF NOT EXISTS idx_parsing_logs_phone ON parsing_logs(phone_number);
 CREATE INDEX IF NOT EXISTS idx_parsing_logs_chat ON parsing_logs(chat_id);
 CREATE INDEX IF NOT EXISTS idx_parsing_logs_status ON parsing_logs(status);
+-- Постраничный просмотр истории по курсору (started_at, id)
+CREATE INDEX IF NOT EXISTS idx_parsing_logs_started_id ON parsing_logs(started_at DESC, id DESC);
 
 -- Включение Row Level Security (опционально)
 ALTER TABLE parsing_logs ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,42 @@
+-- Итоги прогонов батч-парсера: одна строка на прогон parse_all_accounts
+-- Выполните этот SQL в Supabase SQL Editor
+
+CREATE TABLE IF NOT EXISTS parsing_sessions (
+    -- parsing_session_id логов этого прогона (parsing_logs)
+    session_id UUID PRIMARY KEY,
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ,
+    scheduled BOOLEAN DEFAULT FALSE,
+    status TEXT NOT NULL DEFAULT 'completed', -- 'completed', 'stopped', 'failed'
+
+    -- Аккаунты и чаты
+    accounts TEXT[] NOT NULL DEFAULT '{}',
+    total_chats INTEGER DEFAULT 0,
+    success_count INTEGER DEFAULT 0,
+    error_count INTEGER DEFAULT 0, -- ошибки чатов + аккаунты с таймаутом/ошибкой
+    skipped_count INTEGER DEFAULT 0,
+
+    -- Сообщения
+    messages_found INTEGER DEFAULT 0,
+    total_messages INTEGER DEFAULT 0, -- сохранено
+    messages_skipped INTEGER DEFAULT 0,
+
+    wall_time_seconds FLOAT,
+    -- {"+7999...": {"chats", "success", "errors", "skipped", "messages_found",
+    --               "messages_saved", "messages_skipped", "status"}}
+    per_account JSONB DEFAULT '{}'::jsonb,
+    -- первые 50 ошибок: [{"phone_number", "chat_name", "error_type", "error_message"}]
+    errors JSONB DEFAULT '[]'::jsonb,
+
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_parsing_sessions_started_at ON parsing_sessions(started_at DESC);
+
+ALTER TABLE parsing_sessions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all read operations" ON parsing_sessions;
+DROP POLICY IF EXISTS "Allow all insert operations" ON parsing_sessions;
+
+CREATE POLICY "Allow all read operations" ON parsing_sessions FOR SELECT USING (true);
+CREATE POLICY "Allow all insert operations" ON parsing_sessions FOR INSERT WITH CHECK (true);
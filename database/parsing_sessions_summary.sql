@@ -0,0 +1,68 @@
+-- Агрегация сессий парсинга на стороне базы для /api/stats/parsing-sessions
+-- Выполните этот SQL в Supabase SQL Editor
+
+-- Индекс для подсчёта логов выбранных сессий: строки одной сессии
+-- лежат в нём рядом.
+CREATE INDEX IF NOT EXISTS idx_parsing_logs_session_started
+    ON parsing_logs(parsing_session_id, started_at);
+
+-- Последние p_limit сессий (по времени первого лога) за последние p_days
+-- дней, по одной строке на сессию со счётчиками по ВСЕМ её логам.
+-- Кандидаты ищутся диапазоном по idx_parsing_logs_started_id (started_at),
+-- а не группировкой всей таблицы; логи выбранных сессий читаются по
+-- idx_parsing_logs_session_started.
+--
+-- Вызов из клиента: supabase.rpc('get_parsing_sessions', {'p_limit': 50})
+
+-- Прежняя версия с одним аргументом: иначе вызов с p_limit неоднозначен
+DROP FUNCTION IF EXISTS get_parsing_sessions(integer);
+
+CREATE OR REPLACE FUNCTION get_parsing_sessions(p_limit integer DEFAULT 50, p_days integer DEFAULT 30)
+RETURNS TABLE (
+    session_id UUID,
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    total_chats integer,
+    total_messages integer,
+    success_count integer,
+    error_count integer,
+    skipped_count integer,
+    accounts text[],
+    errors jsonb
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH recent AS (
+        SELECT parsing_session_id, MIN(started_at) AS started_at
+        FROM parsing_logs
+        WHERE started_at >= now() - make_interval(days => p_days)
+        GROUP BY parsing_session_id
+        ORDER BY MIN(started_at) DESC
+        LIMIT p_limit
+    )
+    SELECT
+        r.parsing_session_id,
+        r.started_at,
+        MAX(l.finished_at),
+        COUNT(*)::integer,
+        COALESCE(SUM(l.messages_saved), 0)::integer,
+        (COUNT(*) FILTER (WHERE l.status = 'success'))::integer,
+        (COUNT(*) FILTER (WHERE l.status = 'error'))::integer,
+        (COUNT(*) FILTER (WHERE l.status = 'skipped'))::integer,
+        ARRAY_AGG(DISTINCT l.phone_number),
+        COALESCE(
+            jsonb_agg(
+                jsonb_build_object(
+                    'chat_name', l.chat_name,
+                    'error_type', l.error_type,
+                    'error_message', l.error_message
+                )
+            ) FILTER (WHERE l.status = 'error'),
+            '[]'::jsonb
+        )
+    FROM recent r
+    JOIN parsing_logs l ON l.parsing_session_id = r.parsing_session_id
+    GROUP BY r.parsing_session_id, r.started_at
+    ORDER BY r.started_at DESC;
+$$;
@@ -39,10 +39,18 @@ function AccountList({ accounts, onRefresh }) {
     try {
       const response = await axios.post(`${API_BASE}/accounts/${accountId}/check-status`);
       const statusText = response.data.is_connected ? 'подключен' : 'не подключен';
-      setMessage({ 
-        type: response.data.is_connected ? 'success' : 'info', 
-        text: `Статус аккаунта: ${statusText}` 
-      });
+      if (response.data.status === 'check_failed') {
+        // Сессия цела, но проверить не удалось (FloodWait, сеть)
+        setMessage({
+          type: 'info',
+          text: `Не удалось проверить статус: ${response.data.message}`
+        });
+      } else {
+        setMessage({ 
+          type: response.data.is_connected ? 'success' : 'info', 
+          text: `Статус аккаунта: ${statusText}` 
+        });
+      }
       if (onRefresh) {
         onRefresh();
       }
@@ -1,8 +1,16 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import './ParserControls.css';
 import API_BASE from '../config';
 
+// Без живого потока (/parser/events) — опрос как раньше
+const POLL_INTERVAL_MS = 5000;
+// С потоком опрашивается только расписание (next_run, пауза)
+const SCHEDULE_POLL_INTERVAL_MS = 60000;
+
+// События приходят по источнику: один процесс или каждый воркер отдельно
+const sourceOf = (data) => (data.worker === undefined ? 'main' : data.worker);
+
 function ParserControls() {
   const [loading, setLoading] = useState(false);
   const [message, setMessage] = useState(null);
@@ -11,14 +19,53 @@ function ParserControls() {
   const [nextRun, setNextRun] = useState(null);
   const [realtime, setRealtime] = useState({ running: false, accounts: 0, messages_received: 0 });
 
+  const parserSources = useRef({});
+  const realtimeSources = useRef({});
+
   useEffect(() => {
     checkParserStatus();
     checkScheduleStatus();
-    const interval = setInterval(() => {
-      checkParserStatus();
-      checkScheduleStatus();
-    }, 5000);
-    return () => clearInterval(interval);
+
+    let interval = null;
+    const poll = (ms, withParser) => {
+      clearInterval(interval);
+      interval = setInterval(() => {
+        if (withParser) checkParserStatus();
+        checkScheduleStatus();
+      }, ms);
+    };
+
+    if (typeof EventSource === 'undefined') {
+      poll(POLL_INTERVAL_MS, true);
+      return () => clearInterval(interval);
+    }
+
+    const source = new EventSource(`${API_BASE}/parser/events`);
+    source.onopen = () => poll(SCHEDULE_POLL_INTERVAL_MS, false);
+    // Обрыв: браузер переподключается сам, а пока — опрос
+    source.onerror = () => poll(POLL_INTERVAL_MS, true);
+
+    source.addEventListener('parser', (e) => {
+      const data = JSON.parse(e.data);
+      parserSources.current[sourceOf(data)] = data.is_running;
+      setIsRunning(Object.values(parserSources.current).some(Boolean));
+    });
+    source.addEventListener('realtime', (e) => {
+      const data = JSON.parse(e.data);
+      realtimeSources.current[sourceOf(data)] = data;
+      const all = Object.values(realtimeSources.current);
+      setRealtime((prev) => ({
+        ...prev,
+        running: all.some((s) => s.running),
+        accounts: all.reduce((sum, s) => sum + (s.accounts || 0), 0),
+        messages_received: all.reduce((sum, s) => sum + (s.messages_received || 0), 0)
+      }));
+    });
+
+    return () => {
+      source.close();
+      clearInterval(interval);
+    };
   }, []);
 
   const checkParserStatus = async () => {
@@ -228,7 +275,7 @@ function ParserControls() {
 
       {/* Блок автоматического парсинга (fallback) */}
       <div className="auto-parsing-section">
-        <h3>⏰ Batch-парсинг (страховка, каждые 30 мин)</h3>
+        <h3>⏰ Batch-парсинг (по активности чатов)</h3>
         <div className="auto-parsing-status">
           <div className={`status-badge ${autoParsingEnabled ? 'status-active' : 'status-paused'}`}>
             {autoParsingEnabled ? '✅ Включен' : '⏸️ Выключен'}
@@ -271,7 +318,7 @@ function ParserControls() {
           </p>
           <ul>
             <li><strong>Real-time:</strong> сообщения приходят мгновенно (задержка &lt; 3 сек)</li>
-            <li><strong>Batch-парсинг:</strong> страховка каждые 30 мин, подбирает пропущенное</li>
+            <li><strong>Batch-парсинг:</strong> активные чаты — каждые несколько минут, тихие — реже; подбирает пропущенное</li>
             <li><strong>Ручной запуск:</strong> собирает сообщения за последний час прямо сейчас</li>
           </ul>
         </div>
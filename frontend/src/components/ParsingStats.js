@@ -3,10 +3,18 @@ import axios from 'axios';
 import './ParsingStats.css';
 import API_BASE from '../config';
 
+// Колонки деталей сессии; страницы по курсору, строки в compact-виде
+const DETAILS_FIELDS = [
+  'status', 'chat_name', 'chat_id', 'phone_number', 'messages_found', 'messages_saved',
+  'messages_skipped', 'execution_time_seconds', 'error_type', 'error_message'
+].join(',');
+const DETAILS_PAGE_SIZE = 100;
+
 function ParsingStats() {
   const [sessions, setSessions] = useState([]);
   const [selectedSession, setSelectedSession] = useState(null);
   const [sessionDetails, setSessionDetails] = useState([]);
+  const [detailsCursor, setDetailsCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
@@ -33,11 +41,24 @@ function ParsingStats() {
     }
   };
 
-  const loadSessionDetails = async (sessionId) => {
+  const loadSessionDetails = async (sessionId, cursor = null) => {
     try {
-      const response = await axios.get(`${API_BASE}/stats/parsing-stats?session_id=${sessionId}`);
+      const response = await axios.get(`${API_BASE}/stats/parsing-stats`, {
+        params: {
+          session_id: sessionId,
+          fields: DETAILS_FIELDS,
+          limit: DETAILS_PAGE_SIZE,
+          compact: true,
+          ...(cursor ? { cursor } : {})
+        }
+      });
       if (response.data.success) {
-        setSessionDetails(response.data.logs);
+        const { columns, logs } = response.data;
+        const rows = logs.map((values) =>
+          Object.fromEntries(columns.map((column, i) => [column, values[i]]))
+        );
+        setSessionDetails((prev) => (cursor ? [...prev, ...rows] : rows));
+        setDetailsCursor(response.data.next_cursor);
         setSelectedSession(sessionId);
       }
     } catch (err) {
@@ -200,6 +221,14 @@ function ParsingStats() {
               </tbody>
             </table>
           </div>
+          {detailsCursor && (
+            <button
+              className="btn btn-secondary"
+              onClick={() => loadSessionDetails(selectedSession, detailsCursor)}
+            >
+              Показать ещё
+            </button>
+          )}
         </div>
       )}
     </div>
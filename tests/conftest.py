@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+# The process-wide realtime spool and profile cache open SQLite files in the
+# working directory when first used; tests build their own.
+os.environ.setdefault("REALTIME_SPOOL_PATH", "")
+os.environ.setdefault("PROFILE_CACHE_DB", "")
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    """Storages write accounts.json, watermarks.json, ... into the working
+    directory — keep them out of the repository."""
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+
+from backend.services import account_leases
+from backend.services.account_leases import (
+    ACCOUNT_LEASE_RENEW_BELOW_SECONDS, LEASE_KEY_PREFIX, AccountLeases, LeaseStoreError, _FileLeaseStore,
+)
+
+PHONE = "+7 900-000-00-01"
+KEY = LEASE_KEY_PREFIX + "79000000001"
+
+
+def _node(node_id, store):
+    leases = AccountLeases(node_id=node_id, enabled=True)
+    leases._store = store
+    return leases
+
+
+def _expire(store, holder):
+    """Время аренды holder вышло: строка в хранилище и его копия совпадают."""
+    data = store._read()
+    lease = json.loads(data[KEY])
+    lease["expires_at"] = 0
+    data[KEY] = holder._held[PHONE] = json.dumps(lease)
+    store._write(data)
+
+
+def test_first_claim_wins_and_other_node_is_refused(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    a, b = _node("a", store), _node("b", store)
+
+    assert a._claim_sync(PHONE) is True
+    assert b._claim_sync(PHONE) is False
+    assert PHONE in a._held and PHONE not in b._held
+    assert b._owners[PHONE] == "a"
+    assert json.loads(store.get(KEY))["node"] == "a"
+
+
+def test_holder_renews_its_lease_once_a_third_of_the_ttl_is_gone(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    a = _node("a", store)
+    assert a._claim_sync(PHONE)
+    first = a._held[PHONE]
+
+    # Fresh lease: no write at all
+    assert a._claim_sync(PHONE) is True
+    assert a._held[PHONE] == store.get(KEY) == first
+
+    aged = json.loads(first)
+    aged["expires_at"] = time.time() + ACCOUNT_LEASE_RENEW_BELOW_SECONDS - 1
+    data = store._read()
+    data[KEY] = a._held[PHONE] = json.dumps(aged)
+    store._write(data)
+
+    assert a._claim_sync(PHONE) is True
+    assert store.get(KEY) == a._held[PHONE]
+    assert json.loads(a._held[PHONE])["expires_at"] > aged["expires_at"]
+
+
+def test_expired_lease_is_taken_over_and_old_holder_loses_it(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    a, b = _node("a", store), _node("b", store)
+    assert a._claim_sync(PHONE)
+
+    _expire(store, a)
+    assert b._claim_sync(PHONE) is True
+    assert b.takeovers == 1
+    assert json.loads(store.get(KEY))["node"] == "b"
+
+    # a's compare-and-swap fails, and the row is b's and not expired
+    assert a._claim_sync(PHONE) is False
+
+
+def test_restarted_node_reclaims_its_own_lease(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    assert _node("a", store)._claim_sync(PHONE)
+
+    # Same node id after a restart: nothing held in memory, row still its own
+    restarted = _node("a", store)
+    assert restarted._claim_sync(PHONE) is True
+    assert restarted.takeovers == 0
+
+
+def test_release_deletes_only_own_row(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    a, b = _node("a", store), _node("b", store)
+    assert a._claim_sync(PHONE)
+    _expire(store, a)
+    assert b._claim_sync(PHONE)
+
+    a._held[PHONE] = "stale"
+    a._release_sync(PHONE)
+    assert json.loads(store.get(KEY))["node"] == "b"
+
+    b._release_sync(PHONE)
+    assert store.get(KEY) is None
+
+
+def test_disabled_leases_own_every_account():
+    leases = AccountLeases(node_id="a", enabled=False)
+    accounts = [{"phone_number": "1"}, {"phone_number": "2"}]
+
+    assert asyncio.run(leases.filter_accounts(accounts)) == accounts
+    assert leases._store is None
+
+
+def test_acquire_from_filter_accounts_notifies_listeners(tmp_path):
+    store = _FileLeaseStore(str(tmp_path / "leases.json"))
+    a, b = _node("a", store), _node("b", store)
+    changes = []
+
+    async def listener(lost):
+        changes.append(lost)
+
+    a.on_change(listener)
+
+    async def run():
+        owned = await a.filter_accounts([{"phone_number": PHONE}])
+        assert owned == [{"phone_number": PHONE}]
+        await a._notify_task
+        assert changes == [set()]
+
+        # Nothing changed — nobody is told
+        await a.acquire([PHONE])
+        await a._notify_task
+        assert len(changes) == 1
+
+        _expire(store, a)
+        assert b._claim_sync(PHONE)
+        assert await a.acquire([PHONE]) == set()
+        await a._notify_task
+        assert changes == [set(), {PHONE}]
+
+    asyncio.run(run())
+
+
+class _DownStore:
+    def __getattr__(self, name):
+        def fail(*args):
+            raise LeaseStoreError("store is down")
+        return fail
+
+
+def _held_until(expires_at):
+    return json.dumps({"node": "a", "heartbeat_at": 0, "expires_at": expires_at})
+
+
+def test_unreachable_store_keeps_leases_only_until_they_expire():
+    leases = _node("a", _DownStore())
+    leases._held = {PHONE: _held_until(time.time() + 3600), "+2": _held_until(time.time() + 1)}
+    changes = []
+
+    async def listener(lost):
+        changes.append(lost)
+
+    leases.on_change(listener)
+
+    async def run():
+        owned = await leases.acquire([PHONE, "+2"])
+        await leases._notify_task
+        return owned
+
+    assert asyncio.run(run()) == {PHONE}
+    assert changes == [{"+2"}]
+    assert leases.status()["store_ok"] is False
+
+
+def test_node_that_never_reached_store_owns_nothing(monkeypatch):
+    leases = _node("a", _DownStore())
+    assert asyncio.run(leases.acquire([PHONE])) == set()
+
+    monkeypatch.setattr(account_leases, "ACCOUNT_LEASE_FAIL_OPEN", True)
+    assert asyncio.run(leases.acquire([PHONE])) == {PHONE}
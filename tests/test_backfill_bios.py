@@ -0,0 +1,56 @@
+"""SupabaseClient.backfill_bios — один RPC на пачку, счётчик из базы."""
+import pytest
+
+pytest.importorskip("supabase")
+
+from backend.database.supabase_client import SupabaseClient  # noqa: E402
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Client:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        return self
+
+    def execute(self):
+        if self.error is not None:
+            raise self.error
+        return _Result(self.result)
+
+
+def _supabase(client):
+    supabase = SupabaseClient.__new__(SupabaseClient)
+    supabase.client = client
+    supabase._bios_rpc_available = True
+    return supabase
+
+
+def test_one_rpc_call_per_flush_and_its_row_count():
+    client = _Client(result=7)
+    supabase = _supabase(client)
+
+    assert supabase.backfill_bios({1: "bio one", 2: "bio two"}) == 7
+    assert client.calls == [("backfill_bios", {"p_bios": {"1": "bio one", "2": "bio two"}})]
+
+
+def test_missing_function_disables_backfill():
+    client = _Client(error=Exception("PGRST202: Could not find the function public.backfill_bios"))
+    supabase = _supabase(client)
+
+    assert supabase.backfill_bios({1: "bio"}) == 0
+    assert supabase.backfill_bios({2: "bio"}) == 0
+    assert len(client.calls) == 1
+
+
+def test_unexpected_result_counts_nothing():
+    supabase = _supabase(_Client(result=[]))
+    assert supabase.backfill_bios({1: "bio"}) == 0
@@ -0,0 +1,38 @@
+from backend.database.checkpoint_storage import CheckpointStorage
+
+PHONE = "+79000000001"
+
+
+def _point(chat_id, offset_id, topic_id=None):
+    return {"chat_id": chat_id, "topic_id": topic_id, "min_id": 10, "offset_id": offset_id,
+            "newest_id": 500, "newest_time": "2026-01-01T00:00:00+00:00"}
+
+
+def test_checkpoint_keeps_partial_sources_until_chat_is_done():
+    storage = CheckpointStorage()
+    storage.start(PHONE, "run-1")
+    storage.record(PHONE, [_point(1, 300), _point(2, 200, topic_id=5)], [])
+    storage.record(PHONE, [_point(1, 250)], [2])
+
+    entry = storage.get_account(PHONE)
+    assert entry["done"] == [2]
+    assert list(entry["sources"]) == ["1:0"]
+    assert entry["sources"]["1:0"]["offset_id"] == 250
+
+
+def test_checkpoint_finish_requires_every_chat_done():
+    storage = CheckpointStorage()
+    storage.start(PHONE, "run-1")
+    storage.record(PHONE, [], [1])
+
+    assert storage.finish(PHONE, [1, 2]) is False
+    assert storage.get_account(PHONE) is not None
+    storage.record(PHONE, [], [2])
+    assert storage.finish(PHONE, [1, 2]) is True
+    assert storage.get_account(PHONE) is None
+
+
+def test_checkpoint_record_after_finish_is_ignored():
+    storage = CheckpointStorage()
+    storage.record(PHONE, [_point(1, 300)], [])
+    assert storage.get_account(PHONE) is None
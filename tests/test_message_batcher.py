@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from backend.database.message_spool import MessageSpool
+from backend.services import message_batcher
+from backend.services.message_batcher import MessageBatcher
+
+
+@pytest.fixture(autouse=True)
+def fast_batches(monkeypatch):
+    monkeypatch.setattr(message_batcher, "REALTIME_BATCH_MAX_DELAY_MS", 10)
+    monkeypatch.setattr(message_batcher, "REALTIME_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(message_batcher, "REALTIME_RETRY_MAX_SECONDS", 0.02)
+
+
+class _Writer:
+    """write() для батчера: первые `failures` вызовов — неудача."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.written = []
+
+    async def __call__(self, batch):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.written.extend(batch)
+        return True
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+def test_saved_batches_are_acked_and_removed_from_spool(tmp_path):
+    async def scenario():
+        spool = MessageSpool(str(tmp_path / "spool.sqlite3"))
+        writer = _Writer()
+        batcher = MessageBatcher(writer, spool=spool)
+        for i in range(30):
+            await batcher.put({"i": i})
+        await _wait_for(lambda: len(writer.written) == 30)
+        await batcher.drain()
+        return spool, batcher, writer
+
+    spool, batcher, writer = asyncio.run(scenario())
+    assert [m["i"] for m in writer.written] == list(range(30))
+    assert spool.count() == 0
+    assert batcher.saved == 30
+    assert batcher.committed_seq == batcher.batches - 1
+
+
+def test_failed_batch_stays_in_spool_and_is_replayed(tmp_path):
+    async def scenario():
+        spool = MessageSpool(str(tmp_path / "spool.sqlite3"))
+        writer = _Writer(failures=2)
+        batcher = MessageBatcher(writer, spool=spool)
+        for i in range(10):
+            await batcher.put({"i": i})
+        await _wait_for(lambda: spool.count() == 0 and not batcher.status()["backlog"])
+        await batcher.drain()
+        return spool, batcher, writer
+
+    spool, batcher, writer = asyncio.run(scenario())
+    assert sorted({m["i"] for m in writer.written}) == list(range(10))
+    assert batcher.retries >= 1
+    assert batcher.replayed >= 1
+
+
+def test_rows_left_by_previous_run_are_replayed_on_start(tmp_path):
+    path = str(tmp_path / "spool.sqlite3")
+    MessageSpool(path).append({"i": "left over"})
+
+    async def scenario():
+        spool = MessageSpool(path)
+        writer = _Writer()
+        batcher = MessageBatcher(writer, spool=spool)
+        assert batcher.status()["backlog"] is True
+        batcher.start()
+        await _wait_for(lambda: spool.count() == 0)
+        await batcher.drain()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert writer.written == [{"i": "left over"}]
+
+
+def test_without_spool_failed_batch_is_counted_as_lost():
+    async def scenario():
+        writer = _Writer(failures=1)
+        batcher = MessageBatcher(writer)
+        await batcher.put({"i": 0})
+        await _wait_for(lambda: batcher.batches == 1)
+        await batcher.drain()
+        return batcher
+
+    batcher = asyncio.run(scenario())
+    assert batcher.failed == 1
+    assert batcher.saved == 0
+
+
+def test_concurrent_appends_share_one_commit(tmp_path):
+    async def scenario():
+        spool = MessageSpool(str(tmp_path / "spool.sqlite3"))
+        ids = await asyncio.gather(*(spool.append_async({"i": i}) for i in range(50)))
+        return spool, ids
+
+    spool, ids = asyncio.run(scenario())
+    assert len(set(ids)) == 50 and None not in ids
+    assert spool.count() == 50
+    assert spool.commits < 50
+
+
+def test_spool_stats_come_from_counters_not_the_database(tmp_path):
+    path = str(tmp_path / "spool.sqlite3")
+
+    async def scenario():
+        spool = MessageSpool(path)
+        ids = await asyncio.gather(*(spool.append_async({"i": i}) for i in range(5)))
+        await spool.remove_async(ids[:2])
+        return spool, ids
+
+    spool, ids = asyncio.run(scenario())
+    stats = spool.stats()
+    assert stats["pending"] == spool.count() == 3
+    assert stats["oldest_age_seconds"] is not None
+
+    spool._db.close()
+    spool._db = None  # status() must not touch SQLite
+    assert spool.stats()["pending"] == 3
+
+    reopened = MessageSpool(path)
+    assert reopened.stats()["pending"] == 3
+    reopened.remove(ids[2:])
+    assert reopened.stats()["pending"] == 0
+    assert reopened.stats()["oldest_age_seconds"] is None
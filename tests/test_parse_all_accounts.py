@@ -0,0 +1,108 @@
+"""Ограниченный параллелизм аккаунтов в ParserService.parse_all_accounts."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("supabase")
+pytest.importorskip("fastapi")
+
+from backend.services import parser_service as parser_module  # noqa: E402
+from backend.services.parser_service import ParserService  # noqa: E402
+
+PHONES = [f"+7900000000{i}" for i in range(6)]
+
+
+class _Accounts:
+    def get_all_connected_accounts(self):
+        return [{"id": i, "phone_number": phone} for i, phone in enumerate(PHONES)]
+
+
+class _Supabase:
+    async def insert_parsing_session_async(self, row):
+        return True
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(parser_module, "MAX_PARALLEL_ACCOUNTS", 2)
+    monkeypatch.setattr(parser_module.state_persistence, "backup_watermarks", lambda: None)
+    monkeypatch.setattr(parser_module.state_persistence, "backup_checkpoints", lambda: None)
+    monkeypatch.setattr(parser_module.profile_cache, "flush", lambda: None)
+    svc = ParserService.__new__(ParserService)
+    svc.account_storage = _Accounts()
+    svc.supabase_client = _Supabase()
+    svc.account_filter = set(PHONES)
+    svc._realtime_service = None
+    svc._is_running = False
+    svc._should_stop = False
+    svc._account_tasks = []
+    return svc
+
+
+def test_accounts_run_in_parallel_up_to_the_cap(service):
+    active, peak, parsed = 0, 0, []
+
+    async def parse_account(account, *args):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        parsed.append(account["phone_number"])
+
+    service._parse_account = parse_account
+    asyncio.run(service.parse_all_accounts())
+
+    assert peak == 2
+    assert sorted(parsed) == PHONES
+    assert not service.is_running()
+
+
+def test_failing_account_does_not_stop_the_others(service):
+    parsed = []
+
+    async def parse_account(account, *args):
+        if account["phone_number"] == PHONES[0]:
+            raise RuntimeError("session revoked")
+        await asyncio.sleep(0)
+        parsed.append(account["phone_number"])
+
+    service._parse_account = parse_account
+    asyncio.run(service.parse_all_accounts())
+
+    assert sorted(parsed) == PHONES[1:]
+
+
+def test_stop_skips_accounts_not_started_yet(service):
+    parsed = []
+
+    async def parse_account(account, *args):
+        parsed.append(account["phone_number"])
+        await asyncio.sleep(0.01)
+        service.stop_parsing()
+
+    service._parse_account = parse_account
+    asyncio.run(service.parse_all_accounts())
+
+    assert parsed == PHONES[:2]
+
+
+def test_second_run_is_skipped_while_one_is_in_progress(service):
+    calls = []
+
+    async def parse_account(account, *args):
+        calls.append(account["phone_number"])
+        await asyncio.sleep(0.01)
+
+    async def run_twice():
+        first = asyncio.create_task(service.parse_all_accounts())
+        await asyncio.sleep(0)
+        assert service.is_running()
+        await service.parse_all_accounts()
+        await first
+
+    service._parse_account = parse_account
+    asyncio.run(run_twice())
+
+    assert sorted(calls) == PHONES
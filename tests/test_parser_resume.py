@@ -0,0 +1,24 @@
+"""Порядок чатов при продолжении прерванного прогона (ParserService._resume_order)."""
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("supabase")
+pytest.importorskip("fastapi")
+
+from backend.services.parser_service import ParserService  # noqa: E402
+
+
+def test_resume_order_puts_partial_chats_first_and_skips_done():
+    checkpoint = {
+        "done": [2],
+        "sources": {
+            "4:0": {"chat_id": 4, "topic_id": None, "offset_id": 10},
+            "4:7": {"chat_id": 4, "topic_id": 7, "offset_id": 20},
+            "2:0": {"chat_id": 2, "topic_id": None, "offset_id": 30},
+            "9:0": {"chat_id": 9, "topic_id": None, "offset_id": 40},
+        },
+    }
+    chats, resume = ParserService._resume_order([1, 2, 3, 4], checkpoint)
+
+    assert chats == [4, 1, 3]
+    assert set(resume) == {"4:0", "4:7"}
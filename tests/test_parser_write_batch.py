@@ -0,0 +1,121 @@
+"""Правила сдвига high-water marks и чекпоинта в ParserService._write_batch."""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("supabase")
+pytest.importorskip("fastapi")
+
+from backend.database.checkpoint_storage import CheckpointStorage  # noqa: E402
+from backend.database.watermark_storage import WatermarkStorage  # noqa: E402
+from backend.services import parser_service as parser_module  # noqa: E402
+from backend.services.parser_service import ParserService, _PendingBatch  # noqa: E402
+
+PHONE = "+79000000001"
+ACCOUNT = {"phone_number": PHONE}
+STARTED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class _Supabase:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    async def insert_messages_batch_counts_async(self, messages):
+        errors = self.errors.pop(0)
+        return {"inserted": len(messages) - errors, "duplicates": 0, "errors": errors}
+
+    async def insert_parsing_logs_batch_async(self, logs):
+        return True
+
+
+class _Scheduler:
+    def observe(self, phone, stat):
+        pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(parser_module.profile_cache, "fill_missing", lambda messages: None)
+    svc = ParserService.__new__(ParserService)
+    svc.watermark_storage = WatermarkStorage()
+    svc.checkpoint_storage = CheckpointStorage()
+    svc.checkpoint_storage.start(PHONE, "run-1")
+    svc.chat_scheduler = _Scheduler()
+    svc._is_running = True
+    return svc
+
+
+def _message(chat_id):
+    return {"message_time": "2026-01-01T00:00:00+00:00", "chat_name": f"Chat {chat_id}", "message": "hi"}
+
+
+def _batch(messages=(), done=(), partial=(), progress=()):
+    batch = _PendingBatch()
+    for chat_id in messages:
+        batch.messages.append(_message(chat_id))
+        batch.chat_ids.add(chat_id)
+    for chat_id in list(done) + list(partial):
+        batch.stats.append({"chat_id": chat_id, "chat_name": f"Chat {chat_id}", "messages_found": 1,
+                            "messages_saved": 1, "messages_skipped": 0, "status": "success",
+                            "partial": chat_id in partial})
+    for chat_id in done:
+        batch.watermarks.append({"chat_id": chat_id, "topic_id": None, "message_id": 100 + chat_id})
+    for chat_id, offset_id in progress:
+        batch.progress.append({"chat_id": chat_id, "topic_id": None, "min_id": 1, "offset_id": offset_id,
+                               "newest_id": 99, "newest_time": "2026-01-01T00:00:00+00:00"})
+    return batch
+
+
+def _write(svc, batches, supabase):
+    svc.supabase_client = supabase
+    failed_chats = set()
+
+    async def run():
+        for batch in batches:
+            await svc._write_batch(ACCOUNT, batch, "run-1", STARTED_AT, None, failed_chats)
+
+    asyncio.run(run())
+    return failed_chats
+
+
+def test_successful_batch_advances_marks_and_checkpoint(service):
+    _write(service, [_batch(messages=[1, 2], done=[1, 2])], _Supabase(0))
+
+    marks = service.watermark_storage.get_account_marks(PHONE)
+    assert marks["1:0"]["message_id"] == 101
+    assert marks["2:0"]["message_id"] == 102
+    assert service.checkpoint_storage.get_account(PHONE)["done"] == [1, 2]
+
+
+def test_failed_batch_advances_nothing(service):
+    _write(service, [_batch(messages=[1], done=[1], progress=[(1, 50)])], _Supabase(1))
+
+    assert service.watermark_storage.get_account_marks(PHONE) == {}
+    entry = service.checkpoint_storage.get_account(PHONE)
+    assert entry["done"] == [] and entry["sources"] == {}
+
+
+def test_earlier_failed_batch_holds_chat_for_the_rest_of_the_run(service):
+    failed = _write(service, [
+        _batch(messages=[1, 2], progress=[(1, 50)]),        # не записалась
+        _batch(messages=[1, 3], done=[1, 3], progress=[(2, 40)]),  # записалась
+    ], _Supabase(1, 0))
+
+    assert failed == {1, 2}
+    marks = service.watermark_storage.get_account_marks(PHONE)
+    assert "1:0" not in marks
+    assert marks["3:0"]["message_id"] == 103
+    entry = service.checkpoint_storage.get_account(PHONE)
+    assert entry["done"] == [3]
+    assert entry["sources"] == {}
+
+
+def test_partial_chat_keeps_its_checkpoint_and_is_not_done(service):
+    _write(service, [_batch(messages=[1], partial=[1], progress=[(1, 60)])], _Supabase(0))
+
+    entry = service.checkpoint_storage.get_account(PHONE)
+    assert entry["done"] == []
+    assert entry["sources"]["1:0"]["offset_id"] == 60
+    assert service.watermark_storage.get_account_marks(PHONE) == {}
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from backend.services.rate_limiter import AdaptiveConcurrencyLimiter, FloodLimiter, RateLimited, TokenBucket
+
+
+def test_flood_wait_halves_parallelism_and_clean_calls_grow_it_back():
+    limiter = AdaptiveConcurrencyLimiter(max_concurrency=8)
+    limiter.on_flood_wait(0)
+    limiter.on_flood_wait(0)
+    assert limiter.status()["limit"] == 2
+    assert limiter.status()["paused_for"] == 0
+
+    for _ in range(2):
+        limiter.on_success()
+    assert limiter.status()["limit"] == 3
+
+
+def test_flood_wait_pauses_the_gate():
+    limiter = AdaptiveConcurrencyLimiter(max_concurrency=2)
+    limiter.on_flood_wait(30)
+    assert limiter.status()["paused_for"] > 29
+
+    async def enter():
+        await asyncio.wait_for(limiter.acquire(), timeout=0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(enter())
+
+
+def test_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=1.0, burst=3)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire(max_wait=0)
+
+    asyncio.run(take(3))
+    assert bucket.calls == 3
+    with pytest.raises(RateLimited) as e:
+        asyncio.run(take(1))
+    assert 0 < e.value.retry_after <= 1
+
+
+def test_bucket_learns_from_flood_wait():
+    bucket = TokenBucket(rate=2.0, burst=4)
+    bucket.on_flood_wait(60)
+
+    assert bucket.rate == 1.0
+    assert bucket.delay() > 59
+    assert bucket.status()["max_flood_wait"] == 60
+
+
+def test_buckets_are_per_account_and_method():
+    limiter = FloodLimiter()
+    limiter.on_flood_wait("+1", "messages.GetReplies", 120)
+
+    async def acquire(account, method):
+        await limiter.acquire(account, method, max_wait=0)
+
+    asyncio.run(acquire("+1", "messages.GetHistory"))
+    asyncio.run(acquire("+2", "messages.GetReplies"))
+    with pytest.raises(RateLimited) as e:
+        asyncio.run(acquire("+1", "messages.GetReplies"))
+    assert (e.value.account, e.value.method) == ("+1", "messages.GetReplies")
+    assert e.value.retry_after > 119
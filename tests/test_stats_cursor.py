@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("supabase")
+
+from fastapi import HTTPException  # noqa: E402
+
+from backend.routers import stats  # noqa: E402
+
+
+def test_cursor_round_trip():
+    row = {"started_at": "2026-01-02T03:04:05.678+00:00", "id": 12345}
+    cursor = stats._encode_cursor(row)
+
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert stats._decode_cursor(cursor) == (row["started_at"], row["id"])
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", "bm90IGpzb24", "WzFd", "WyJ4IiwgIm5vdCBhbiBpZCJd"])
+def test_bad_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        stats._decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_select_columns_sets_and_lists():
+    assert stats._select_columns(None, "errors") == stats.PARSING_LOG_FIELD_SETS["errors"]
+    assert stats._select_columns("chat_name,status", "full") == ["started_at", "id", "chat_name", "status"]
+    with pytest.raises(HTTPException) as error:
+        stats._select_columns("chat_name,password", "full")
+    assert error.value.status_code == 400
+
+
+class _Query:
+    """Минимальный PostgREST-запрос: or_/order/limit/execute по списку строк."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.after = None
+        self.count = None
+
+    def or_(self, expression):
+        # started_at.lt."<ts>",and(started_at.eq."<ts>",id.lt.<id>)
+        started_at = expression.split('"')[1]
+        row_id = int(expression.rsplit("id.lt.", 1)[1].rstrip(")"))
+        self.after = (started_at, row_id)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        rows = sorted(self.rows, key=lambda r: (r["started_at"], r["id"]), reverse=True)
+        if self.after:
+            rows = [r for r in rows if (r["started_at"], r["id"]) < self.after]
+        return type("Result", (), {"data": rows[:self.count]})()
+
+
+def test_pages_cover_every_row_once():
+    rows = [{"started_at": f"2026-01-01T00:00:{i // 3:02d}+00:00", "id": i, "status": "success"}
+            for i in range(25)]
+    columns = ["started_at", "id", "status"]
+
+    async def collect():
+        seen, cursor = [], None
+        while True:
+            page = await stats._page_parsing_logs(_Query(rows), columns, 10, cursor, False, "logs")
+            seen.extend(row["id"] for row in page["logs"])
+            if not page["has_more"]:
+                return seen
+            cursor = page["next_cursor"]
+
+    seen = asyncio.run(collect())
+    assert sorted(seen) == list(range(25))
+    assert len(seen) == 25
@@ -0,0 +1,24 @@
+import json
+import os
+
+from backend.database.watermark_storage import WatermarkStorage
+
+PHONE = "+79000000001"
+
+
+def test_watermark_only_moves_forward():
+    storage = WatermarkStorage()
+    assert storage.update(PHONE, [{"chat_id": 1, "message_id": 100, "message_time": "t1"}]) == 1
+    assert storage.update(PHONE, [{"chat_id": 1, "message_id": 90, "message_time": "t0"}]) == 0
+    assert storage.update(PHONE, [{"chat_id": 1, "topic_id": 7, "message_id": 5}]) == 1
+
+    marks = storage.get_account_marks(PHONE)
+    assert marks["1:0"]["message_id"] == 100
+    assert marks["1:7"]["message_id"] == 5
+
+
+def test_watermark_write_leaves_no_temp_files():
+    WatermarkStorage().update(PHONE, [{"chat_id": 1, "message_id": 1}])
+    assert not [name for name in os.listdir(".") if name.endswith(".tmp")]
+    with open("watermarks.json", encoding="utf-8") as f:
+        assert json.load(f)[PHONE]["1:0"]["message_id"] == 1
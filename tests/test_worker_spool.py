@@ -0,0 +1,35 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from backend.database import message_spool  # noqa: E402
+
+
+@pytest.fixture
+def worker_pool():
+    # Imported inside the temporary working directory: the module-level
+    # WorkerPool creates accounts.json where it is imported.
+    return importlib.import_module("backend.services.worker_pool")
+
+
+def test_worker_spool_file_carries_index(worker_pool, monkeypatch):
+    monkeypatch.setenv("REALTIME_SPOOL_PATH", "/data/realtime_spool.sqlite3")
+    assert worker_pool._spool_path(0) == "/data/realtime_spool.sqlite3"
+    assert worker_pool._spool_path(1) == "/data/realtime_spool.worker1.sqlite3"
+    assert worker_pool._spool_path(3) == "/data/realtime_spool.worker3.sqlite3"
+
+
+def test_worker_spool_default_path(worker_pool, monkeypatch):
+    monkeypatch.delenv("REALTIME_SPOOL_PATH", raising=False)
+    assert worker_pool._spool_path(2) == "realtime_spool.worker2.sqlite3"
+
+
+def test_disabled_spool_stays_disabled(worker_pool, monkeypatch):
+    monkeypatch.setenv("REALTIME_SPOOL_PATH", "")
+    assert worker_pool._spool_path(1) == ""
+
+
+def test_import_opens_no_spool():
+    assert message_spool._default_spool is None